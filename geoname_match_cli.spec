@@ -0,0 +1,39 @@
+# -*- mode: python -*-
+
+# Lean bundle of the matcher, built from its command-line entry point (py_scripts/geoname_match_cli.py).
+# The GUI, notebook and plotting packages that pandas can optionally use are excluded, as the matcher needs none of
+# them; py_scripts/startup_benchmark.py --command dist/geoname_match_cli/geoname_match_cli measures the result.
+
+block_cipher = None
+
+
+a = Analysis(['py_scripts/geoname_match_cli.py'],
+             pathex=['py_scripts'],
+             binaries=None,
+             datas=None,
+             hiddenimports=['geoname_match_161014rev', 'match_service'],
+             hookspath=[],
+             runtime_hooks=[],
+             excludes=['PyQt4', 'PyQt5', 'PySide', 'IPython', 'ipykernel', 'jupyter_client', 'notebook', 'nbformat',
+                       'zmq', 'jinja2', 'Cython', 'PIL', 'matplotlib', 'tkinter', 'Tkinter', 'sphinx', 'docutils',
+                       'scipy', 'sqlalchemy', 'tables', 'xlrd', 'openpyxl', 'bs4', 'lxml'],
+             win_no_prefer_redirects=False,
+             win_private_assemblies=False,
+             cipher=block_cipher)
+pyz = PYZ(a.pure, a.zipped_data,
+             cipher=block_cipher)
+exe = EXE(pyz,
+          a.scripts,
+          exclude_binaries=True,
+          name='geoname_match_cli',
+          debug=False,
+          strip=False,
+          upx=True,
+          console=True )
+coll = COLLECT(exe,
+               a.binaries,
+               a.zipfiles,
+               a.datas,
+               strip=False,
+               upx=True,
+               name='geoname_match_cli')
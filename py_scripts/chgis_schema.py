@@ -0,0 +1,208 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/chgis_schema.py
+#
+# Helper module for geoname_match and version_merge: a registry of the known layouts of CHGIS .csv tables (v5, v6,
+# PartOf, MainTable and GISInfoTable), with a compact dtype planned for each column.
+# Repetitive strings (administrative types, object types, sources, ranks, compilers...) are read as categoricals, and
+# years and IDs as nullable small integers, instead of every column ending up as object or float64.
+# Coordinates are kept as float64: they carry up to six decimal places, which float32's seven significant digits can't
+# guarantee.  They are compared (with incoming coordinates, or across versions) as fixed-point integers, see coordinates.py.
+# pandas and numpy are only imported by the functions that read and convert tables, so that the layouts themselves can
+# be looked up (e.g. for the first prompts of geoname_match) without waiting for them to load.
+# Only non-core libraries used are pandas and numpy
+
+import csv
+from collections import OrderedDict
+
+
+# planned dtype of each column of each known layout; None marks free text (names, present locations, IDs such as
+# 'hvd_12345'), which is left as pandas reads it
+LAYOUTS = OrderedDict([
+    # CHGIS v5 (taken from v5_augment_2016-08-09.csv)
+    ('v5', OrderedDict([
+        ('seq', 'Int32'),
+        ('sys_id', None),
+        ('src', 'category'),
+        ('nm_py', None),
+        ('nm_simp', None),
+        ('nm_trad', None),
+        ('x_coord', 'float64'),
+        ('y_coord', 'float64'),
+        ('pres_loc', None),
+        ('type_py', 'category'),
+        ('type_ch', 'category'),
+        ('beg', 'Int16'),
+        ('end', 'Int16'),
+        ('obj_type', 'category'),
+        ('prnt_id', 'Int32'),
+        ('prnt_sysid', 'category'),
+        ('prnt_simp', 'category'),
+        ('prnt_py', 'category')
+    ])),
+    # CHGIS v6 (taken from V6_input_draft_20160811.csv)
+    ('v6', OrderedDict([
+        ('beg_rule', 'category'),
+        ('beg_type', 'category'),
+        ('beg_yr', 'Int16'),
+        ('checker', 'category'),
+        ('compiler', 'category'),
+        ('end_rule', 'category'),
+        ('end_type', 'category'),
+        ('end_yr', 'Int16'),
+        ('entry_date', 'category'),
+        ('filename', 'category'),
+        ('geo_comp', 'category'),
+        ('geo_src', 'category'),
+        ('level', 'category'),
+        ('mdb_id', 'Int32'),
+        ('nm_py', None),
+        ('nm_simp', None),
+        ('nm_trad', None),
+        ('note_id', None),
+        ('obj_type', 'category'),
+        ('orig_id', None),
+        ('pres_loc', None),
+        ('sys_id', None),
+        ('type_py', 'category'),
+        ('type_simp', 'category'),
+        ('x_coord', 'float64'),
+        ('y_coord', 'float64')
+    ])),
+    # the parent-child relationships of the CHGIS (PartOf.csv)
+    ('PartOf', OrderedDict([
+        ('CHILD_ID', 'Int32'),
+        ('CHILD_NMPY', None),
+        ('CHILD_NMCH', None),
+        ('CHILD_NMFT', None),
+        ('BEG_YR', 'Int16'),
+        ('END_YR', 'Int16'),
+        ('PRT_NMPY', 'category'),
+        ('PRT_NMCH', 'category'),
+        ('PRT_ID', 'Int32')
+    ])),
+    # the CHGIS GISInfoTable
+    ('GISInfoTable', OrderedDict([
+        ('SYS_ID', 'Int32'),
+        ('NAME_PY', None),
+        ('NAME_CH', None),
+        ('NAME_FT', None),
+        ('X_COOR', 'float64'),
+        ('Y_COOR', 'float64'),
+        ('PRES_LOC', None),
+        ('TYPE_PY', 'category'),
+        ('TYPE_CH', 'category'),
+        ('LEV_RANK', 'Int8'),
+        ('BEG_YR', 'Int16'),
+        ('BEG_RULE', 'Int8'),
+        ('BEG_CHG_TY', 'category'),
+        ('END_YR', 'Int16'),
+        ('END_RULE', 'Int8'),
+        ('END_CHG_TY', 'category'),
+        ('NOTE_ID', 'Int32'),
+        ('OBJ_TYPE', 'category'),
+        ('GEO_SRC', 'category'),
+        ('COMPILER', 'category'),
+        ('GEOCOMP', 'category'),
+        ('CHECKER', 'category'),
+        ('ENT_DATE', 'category'),
+        ('FILENAME', 'category')
+    ])),
+    # the CHGIS MainTable
+    ('MainTable', OrderedDict([
+        ('NAME_PY', None),
+        ('NAME_CH', None),
+        ('NAME_FT', None),
+        ('PRES_LOC', None),
+        ('BEG_CHG_TY', 'category'),
+        ('END_CHG_TY', 'category'),
+        ('TYPE_PY', 'category'),
+        ('TYPE_CH', 'category'),
+        ('LEV_RANK', 'Int8'),
+        ('BEG_YR', 'Int16'),
+        ('END_YR', 'Int16'),
+        ('BOU_NOTE_ID', 'Int32'),
+        ('PT_NOTE_ID', 'Int32'),
+        ('BOU_ID', 'Int32'),
+        ('PT_ID', 'Int32'),
+        ('X_COOR', 'float64'),
+        ('Y_COOR', 'float64')
+    ]))
+])
+
+
+def detect_layout(columns):
+    ''' Function that returns the name of the first known layout all of whose columns are among 'columns', or None '''
+    columns = set(columns)
+    for name, layout in LAYOUTS.items():
+        if all(column in columns for column in layout):
+            return name
+    return None
+
+
+def read_header(path):
+    ''' Function that returns the field names in the header row of a .csv file, without reading the rest of it '''
+    with open(path, 'r', encoding='utf-8-sig', newline='') as source:
+        return next(csv.reader(source), [])
+
+
+def _to_integers(values, dtype):
+    ''' Converts a column to the given nullable integer dtype if that loses nothing, i.e. if every value is either
+        missing or a whole number within the dtype's range; otherwise returns the column as it was.
+    '''
+    import pandas as pd
+    import numpy as np
+
+    numbers = pd.to_numeric(values, errors='coerce')
+    if (numbers.isnull() & values.notnull()).any():
+        return values
+    present = numbers.dropna()
+    limits = np.iinfo(dtype.lower())
+    if len(present) and ((present % 1 != 0).any() or present.min() < limits.min or present.max() > limits.max):
+        return values
+    return numbers.astype(dtype)
+
+
+def compact_frame(frame, layout):
+    ''' Function that converts the columns of a DataFrame in-place to the dtypes planned for them in the given layout
+        (see LAYOUTS).  Columns that aren't in the layout, or whose values don't fit their planned dtype, are left as they are.
+        Returns the DataFrame.
+    '''
+    import pandas as pd
+
+    for column, dtype in LAYOUTS[layout].items():
+        if column not in frame.columns or dtype is None or frame[column].dtype == dtype:
+            continue
+        if dtype.startswith('Int'):
+            frame[column] = _to_integers(frame[column], dtype)
+        elif dtype == 'category':
+            frame[column] = frame[column].astype('category')
+        else:
+            frame[column] = pd.to_numeric(frame[column], errors='coerce').astype(dtype)
+    return frame
+
+
+def read_table(path, usecols=None):
+    ''' Function that reads a .csv file, recognizing its layout from its header row (see detect_layout()).
+        Only the columns named in 'usecols' (where present in the file) are read, if it is given; the columns of a known
+        layout are then converted to their compact dtypes.
+        Returns the DataFrame and the name of its layout, or None if the layout isn't known.
+    '''
+    import pandas as pd
+
+    columns = read_header(path)
+    layout = detect_layout(columns)
+    if usecols is not None:
+        usecols = [column for column in columns if column in set(usecols)]
+
+    # categoricals are parsed as such directly, rather than as strings to be converted afterwards
+    dtypes = {}
+    if layout is not None:
+        dtypes = {column: dtype for column, dtype in LAYOUTS[layout].items() if dtype == 'category' and (usecols is None or column in usecols)}
+    frame = pd.read_csv(path, low_memory=False, usecols=usecols, dtype=dtypes or None)
+
+    if layout is not None:
+        frame = compact_frame(frame, layout)
+    return frame, layout
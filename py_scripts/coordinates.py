@@ -0,0 +1,81 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/coordinates.py
+#
+# Helper module for geoname_match and version_merge: spatial coordinates as fixed-point integers, in millionths of a
+# degree (micro-degrees), for comparing them.
+# CHGIS coordinates carry up to six decimal places, which float64 can't always hold exactly (e.g. 119.64656 being
+# 119.6465599999...), so that the same coordinate read from two files, or typed with a different number of trailing
+# digits, need not compare as equal.  Parsed once into integers, coordinates compare, hash, group and round exactly,
+# and can be compared within a tolerance (an 'epsilon', in degrees) without any rounding of floats.
+# The coordinates themselves are kept (and written out) as they are; the integers are only used to compare them.
+# Only non-core libraries used are pandas and numpy
+
+import pandas as pd
+import numpy as np
+
+
+# number of fixed-point units in a degree (micro-degrees, about 0.1 m on the ground)
+SCALE = 1000000
+
+
+def fixed_column(field):
+    ''' Function that returns the name of the column under which the fixed-point form of a coordinate field can be stored
+        alongside it, e.g. 'tgaz_x_coord__fixed', so that it is computed once with the rest of a target's snapshot
+    '''
+    return '%s__fixed' % field
+
+
+def to_fixed(values, scale=SCALE):
+    ''' Function that parses coordinates (numbers, or numbers as text) into fixed-point integers, rounded to the nearest
+        unit.  Returns a Series of nullable integers (Int64), missing where the value is missing or not a number.
+    '''
+    values = pd.Series(values)
+    degrees = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    missing = np.isnan(degrees)
+    units = np.rint(np.where(missing, 0.0, degrees) * scale).astype(np.int64)
+    return pd.Series(pd.arrays.IntegerArray(units, missing), index=values.index)
+
+
+def to_units(epsilon, scale=SCALE):
+    ''' Function that returns a tolerance given in degrees (e.g. 0.00001) as a whole number of fixed-point units '''
+    return int(round(float(epsilon or 0) * scale))
+
+
+def _integers(fixed):
+    # the units of fixed-point coordinates as int64 (0 where missing), and where they are missing
+    fixed = pd.array(fixed, dtype='Int64')
+    return fixed.to_numpy(dtype=np.int64, na_value=0), fixed.isna()
+
+
+def fixed_equal(first, second, epsilon=0):
+    ''' Function that returns, for each pair of fixed-point coordinates, whether both are given and lie within 'epsilon'
+        units of one another (0: exactly equal), as a boolean array
+    '''
+    first, first_missing = _integers(first)
+    second, second_missing = _integers(second)
+    return ~first_missing & ~second_missing & (np.abs(first - second) <= epsilon)
+
+
+def fixed_differ(first, second, epsilon=0):
+    ''' Function that returns, for each pair of fixed-point coordinates, whether they differ: by more than 'epsilon' units,
+        or by one of them being missing (two missing coordinates being the same), as a boolean array
+    '''
+    _, first_missing = _integers(first)
+    _, second_missing = _integers(second)
+    return ~fixed_equal(first, second, epsilon) & ~(first_missing & second_missing)
+
+
+def round_fixed(fixed, decimal_place, scale=SCALE):
+    ''' Function that rounds fixed-point coordinates to the given number of decimal places of a degree (halves to the
+        even neighbour, as numpy rounds), returning fixed-point coordinates.  Places beyond the units are left as they are.
+    '''
+    values, missing = _integers(fixed)
+    step = int(scale // 10 ** int(decimal_place)) if 10 ** int(decimal_place) < scale else 1
+    if step > 1:
+        quotient, remainder = np.divmod(values, step)
+        up = (remainder * 2 > step) | ((remainder * 2 == step) & (quotient % 2 == 1))
+        values = (quotient + up) * step
+    return pd.Series(pd.arrays.IntegerArray(values, missing))
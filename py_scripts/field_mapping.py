@@ -0,0 +1,175 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/field_mapping.py
+#
+# Helper module for geoname_match and the match service: the standard 'input_*' and 'tgaz_*' output fields, and the
+# default mapping of the fields of CHGIS v5 and v6 .csv files onto the latter, so that a CHGIS target can be loaded
+# without any prompts.
+# Nothing here imports pandas until a target is actually loaded, so that the prompts can use the field lists right away.
+# Only non-core library used is pandas
+
+import hashlib
+import json
+from collections import OrderedDict
+
+from chgis_schema import LAYOUTS, detect_layout, read_header, read_table
+
+
+# defining ordered dictionary that stores the standard incoming field names along with a natural English description, for use in user prompts
+incoming_description = OrderedDict([
+    ('input_id', 'a unique ID'),
+    ('input_nm_py',"a name in pinyin"),
+    ('input_nm_simp',"a name in simplified Chinese characters (简体字)"),
+    ('input_nm_trad',"a name in traditional Chinese characters (繁體字)"),
+    ('input_type_py',"an administrative type in pinyin (e.g. 'Xian')"),
+    ('input_type_ch',"an administrative type in Chinese (simplified) characters (e.g. '县')"),
+    ('input_year_beg',"a beginning year"),
+    ('input_year_end',"an ending year"),
+    ('input_dynasty',"a dynasty"),
+    ('input_other_id',"another, alternate unique ID"),
+    ('input_prnt',"the parent administrative unit's name"),
+    ('input_obj_type',"a geospatial type (Point/Vector/Polygon)"),
+    ('input_x_coord',"an x coordinate"),
+    ('input_y_coord',"a y coordinate")
+])
+
+# declaring the list of output .csv field names that will derive from the new data
+# i.e., all those fields whose names will be 'input_*' in the final .csv
+final_incoming_fields = list(incoming_description.keys())
+
+# initializing list of default target CHGIS v5 fields (taken from v5_augment_2016-08-09.csv), for use in automated renaming
+default_target_fields_v5 = list(LAYOUTS['v5'].keys())
+
+# initializing list of default target CHGIS v6 fields (taken from V6_input_draft_20160811.csv), for use in automated renaming
+default_target_fields_v6 = list(LAYOUTS['v6'].keys())
+
+# the renamings of default target fields that are exceptions to the 'tgaz_' prefixing pattern
+default_renames_v5 = {'src':'data_source'}
+default_renames_v6 = {'geo_src':'data_source', 'type_simp':'type_ch', 'beg_yr':'beg', 'end_yr':'end'}
+
+# defining ordered dictionary that stores the standard target field names along with a natural English description, for use in user prompts
+target_description = OrderedDict([
+    ('tgaz_sys_id','a unique ID'),
+    ('tgaz_nm_py', "a name in pinyin"),
+    ('tgaz_nm_simp',"a name in simplified Chinese characters (简体字)"),
+    ('tgaz_nm_trad',"a name in traditional Chinese characters (繁體字)"),
+    ('tgaz_beg',"a beginning year"),
+    ('tgaz_end',"an ending year"),
+    ('tgaz_data_source', "the source of the data"),
+    ('tgaz_obj_type',"a geospatial type (Point/Vector/Polygon)"),
+    ('tgaz_pres_loc',"the place's present-day name"),
+    ('tgaz_prnt_id',"the parent administrative unit's unique ID (NOT prefixed 'hvd_')"),
+    ('tgaz_prnt_py',"the parent administrative unit's name in pinyin"),
+    ('tgaz_prnt_simp',"the parent administrative unit's name in simplified Chinese characters (简体字)"),
+    ('tgaz_prnt_sysid',"the parent administrative unit's unique ID (prefxed 'hvd_')"),
+    ('tgaz_type_ch',"an administrative type in Chinese (simplified) characters (e.g. 县)"),
+    ('tgaz_type_py',"an administrative type in pinyin (e.g. 'Xian')"),
+    ('tgaz_x_coord',"an x coordinate"),
+    ('tgaz_y_coord',"a y coordinate")
+])
+
+# initializing list of tgaz fields (i.e. the standardized output-form of the CHGIS fields)
+final_target_fields = list(target_description.keys())
+
+# name fields of a default-mapped target whose characters are folded into one script (see name_keys.fold_keys()) when
+# it is loaded, and stored alongside them in its cached snapshot (outside the output fields)
+FOLDED_TARGET_FIELDS = ['tgaz_nm_simp', 'tgaz_nm_trad']
+
+# coordinate fields of a default-mapped target whose fixed-point forms (see coordinates.py) are stored alongside them
+# in its cached snapshot in the same way, for comparing coordinates without parsing them again for each match
+FIXED_TARGET_FIELDS = ['tgaz_x_coord', 'tgaz_y_coord']
+
+
+def title_caser(fields, actual_fields, frame):
+    '''Very simple function that title-cases the contents of the given fields, provided that they are actually used in the DataFrame 
+    '''   
+    for field in fields:
+        if field in actual_fields:
+            frame[field] = frame[field].map(lambda x: str(x).title())
+
+
+def default_mapper(frame, layout):
+    ''' Function that applies the default mapping of CHGIS v5 or v6 fields to the target DataFrame, given its layout ('v5' or 'v6', see chgis_schema.py):
+        renaming the fields with a 'tgaz_' prefix, dropping the fields not used in the output, and title-casing the pinyin fields.
+        Returns the renamed DataFrame and the target_mapping, or the untouched DataFrame and None if the layout is neither.
+    '''
+    # if the target has the CHGIS v5 fields, rename and use them while dropping the fields not in CHGIS v5
+    if layout == 'v5':
+        # manually renaming one exception to the following pattern
+        frame.rename(columns=default_renames_v5, inplace=True)
+
+        # manually dropping the 'seq' field, if it has been read at all
+        if 'seq' in frame.columns:
+            del frame['seq']
+        fields = list(final_target_fields)
+      
+    # if the target has the CHGIS v6 fields, rename and use them while dropping the fields not in CHGIS v6
+    elif layout == 'v6':
+        # renaming in preparation for "tgaz_" prefixing
+        frame.rename(columns=default_renames_v6, inplace=True)
+                        
+        # eliminating parent fields (since v6 data does not include parent information)
+        fields = [field for field in final_target_fields if field not in ['tgaz_prnt_id', 'tgaz_prnt_sysid', 'tgaz_prnt_simp', 'tgaz_prnt_py']]
+        
+    else:
+        return frame, None
+            
+    # generating the target_mapping 
+    mapping = OrderedDict([(key, 'tgaz_%s' % key) for key in frame.columns]) 
+            
+    # renaming the target fields in-place to conform to output specifications
+    frame.rename(columns={key:value for key,value in mapping.items()}, inplace=True)
+                        
+    # dropping excess fields, and titlecasing string values in pinyin fields to avoid spurious mismatches
+    frame = frame[fields]
+    title_caser(['tgaz_nm_py', 'tgaz_type_py'], fields, frame)
+    return frame, mapping
+
+
+def snapshot_variant():
+    ''' Function that returns the name of the cached snapshot of a default-mapped target (see target_cache.py), ending
+        in a hash of what its added columns are derived with: the folding table of name_keys, the scale of the
+        fixed-point coordinates and the fields they are added for.  Changing any of these makes a new snapshot, rather
+        than the old keys being served from the cache.
+    '''
+    from name_keys import FOLD_TABLE
+    from coordinates import SCALE
+    derived = [sorted(FOLD_TABLE.items()), SCALE, FOLDED_TARGET_FIELDS, FIXED_TARGET_FIELDS]
+    return 'geoname_match_default_mapping_%s' % hashlib.sha1(json.dumps(derived).encode('utf-8')).hexdigest()[:16]
+
+
+def default_target_loader(path):
+    ''' Function that loads the target .csv file at the given path with the default mapping of CHGIS fields (see default_mapper()).
+        Only the fields used in the output are read, with the compact dtypes planned for them in chgis_schema.py.
+        The folded forms of its names in characters are added under their key columns (see FOLDED_TARGET_FIELDS), and the
+        fixed-point forms of its coordinates under theirs (see FIXED_TARGET_FIELDS).
+        The renamed DataFrame is cached in a binary format after the first load, and reloaded from the cache for as long as the .csv file,
+        and what the added columns are derived with (see snapshot_variant()), are unchanged.
+        Returns the DataFrame and the target_mapping, or the DataFrame as read from the file and None if the default mapping doesn't apply.
+    '''
+    from target_cache import cached_frame
+    from name_keys import name_keys, key_column
+    from coordinates import to_fixed, fixed_column
+
+    def build():
+        # the original names of the fields that end up in the output, under either version's renamings
+        used_fields = [field for field in default_target_fields_v5 + default_target_fields_v6
+                       if 'tgaz_%s' % default_renames_v5.get(field, default_renames_v6.get(field, field)) in final_target_fields]
+        # (without a default layout, every field is read, to be mapped manually)
+        if detect_layout(read_header(path)) not in ('v5', 'v6'):
+            used_fields = None
+        frame, layout = read_table(path, usecols=used_fields)
+        frame, mapping = default_mapper(frame, layout)
+        if mapping is not None:
+            for field in [field for field in FOLDED_TARGET_FIELDS if field in frame.columns]:
+                frame[key_column(field, ['fold'])] = name_keys(frame[field], ['fold'])
+            for field in [field for field in FIXED_TARGET_FIELDS if field in frame.columns]:
+                frame[fixed_column(field)] = to_fixed(frame[field])
+        return frame, (list(mapping.items()) if mapping is not None else None)
+    
+    frame, mapping = cached_frame(path, snapshot_variant(), build)
+    if mapping is not None:
+        mapping = OrderedDict([tuple(item) for item in mapping])
+    return frame, mapping
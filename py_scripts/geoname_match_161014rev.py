@@ -10,14 +10,18 @@
 # Only non-core library used is pandas, which can be installed via pip or as part of a Python distribution (e.g. Anaconda)
 # by Stephen Ford (stephen.p.ford@gmail.com)
 
-import pandas as pd
-from datetime import datetime
 from collections import OrderedDict
-from pprint import pprint
 import os.path
 
-# suppressing SettingWithCopyWarning
-pd.options.mode.chained_assignment = None  # default='warn'
+# (pandas and the matching modules are only imported once the first files have been chosen, see below, so that the
+# first prompts appear straight away)
+from field_mapping import incoming_description, target_description, final_target_fields
+from field_mapping import default_target_fields_v5, default_target_fields_v6, default_target_loader
+from run_profiler import stage
+import run_profiler
+
+# timing the stages of the run if asked to by the CHGIS_PROFILE environment variable (see run_profiler.py)
+profiler = run_profiler.start_from_environment()
 
 
 # In[ ]:
@@ -30,121 +34,25 @@ pd.options.mode.chained_assignment = None  # default='warn'
 # initializing list of incoming_fields 
 incoming_fields = []
 
-# defining ordered dictionary that stores the standard incoming field names along with a natural English description, for use in user prompts
-incoming_description = OrderedDict([
-    ('input_id', 'a unique ID'),
-    ('input_nm_py',"a name in pinyin"),
-    ('input_nm_simp',"a name in simplified Chinese characters (简体字)"),
-    ('input_nm_trad',"a name in traditional Chinese characters (繁體字)"),
-    ('input_type_py',"an administrative type in pinyin (e.g. 'Xian')"),
-    ('input_type_ch',"an administrative type in Chinese (simplified) characters (e.g. '县')"),
-    ('input_year_beg',"a beginning year"),
-    ('input_year_end',"an ending year"),
-    ('input_dynasty',"a dynasty"),
-    ('input_other_id',"another, alternate unique ID"),
-    ('input_prnt',"the parent administrative unit's name"),
-    ('input_obj_type',"a geospatial type (Point/Vector/Polygon)"),
-    ('input_x_coord',"an x coordinate"),
-    ('input_y_coord',"a y coordinate")
-])
-    
 # initializing ordered dictionary that will store the original .csv's fields and what they're renamed in the final output as key-value pairs 
 incoming_mapping = OrderedDict([])
 
-# declaring the list of output .csv field names that will derive from the new data
-# i.e., all those fields whose names will be 'input_*' in the final .csv
-final_incoming_fields = list(incoming_description.keys())
-
 # initializing list of actual target fields
 target_fields = []
 
-# initializing list of default target CHGIS v5 fields (taken from v5_augment_2016-08-09.csv), for use in automated renaming
-default_target_fields_v5 = [
-    'seq', 
-    'sys_id', 
-    'src', 
-    'nm_py', 
-    'nm_simp', 
-    'nm_trad', 
-    'x_coord', 
-    'y_coord', 
-    'pres_loc', 
-    'type_py', 
-    'type_ch', 
-    'beg', 
-    'end', 
-    'obj_type',
-    'prnt_id', 
-    'prnt_sysid', 
-    'prnt_simp', 
-    'prnt_py'
-]
-
-# initializing list of default target CHGIS v6 fields (taken from V6_input_draft_20160811.csv), for use in automated renaming
-default_target_fields_v6 = [
- 'beg_rule',
- 'beg_type',
- 'beg_yr',
- 'checker',
- 'compiler',
- 'end_rule',
- 'end_type',
- 'end_yr',
- 'entry_date',
- 'filename',
- 'geo_comp',
- 'geo_src',
- 'level',
- 'mdb_id',
- 'nm_py',
- 'nm_simp',
- 'nm_trad',
- 'note_id',
- 'obj_type',
- 'orig_id',
- 'pres_loc',
- 'sys_id',
- 'type_py',
- 'type_simp',
- 'x_coord',
- 'y_coord'
-]
-
-# defining ordered dictionary that stores the standard target field names along with a natural English description, for use in user prompts
-target_description = OrderedDict([
-    ('tgaz_sys_id','a unique ID'),
-    ('tgaz_nm_py', "a name in pinyin"),
-    ('tgaz_nm_simp',"a name in simplified Chinese characters (简体字)"),
-    ('tgaz_nm_trad',"a name in traditional Chinese characters (繁體字)"),
-    ('tgaz_beg',"a beginning year"),
-    ('tgaz_end',"an ending year"),
-    ('tgaz_data_source', "the source of the data"),
-    ('tgaz_obj_type',"a geospatial type (Point/Vector/Polygon)"),
-    ('tgaz_pres_loc',"the place's present-day name"),
-    ('tgaz_prnt_id',"the parent administrative unit's unique ID (NOT prefixed 'hvd_')"),
-    ('tgaz_prnt_py',"the parent administrative unit's name in pinyin"),
-    ('tgaz_prnt_simp',"the parent administrative unit's name in simplified Chinese characters (简体字)"),
-    ('tgaz_prnt_sysid',"the parent administrative unit's unique ID (prefxed 'hvd_')"),
-    ('tgaz_type_ch',"an administrative type in Chinese (simplified) characters (e.g. 县)"),
-    ('tgaz_type_py',"an administrative type in pinyin (e.g. 'Xian')"),
-    ('tgaz_x_coord',"an x coordinate"),
-    ('tgaz_y_coord',"a y coordinate")
-])
-
 # initializing dictionary that will store as key-value pairs the original target .csv's fields and what they're renamed in the final output
 target_mapping = OrderedDict([])
 
-# initializing list of tgaz fields (i.e. the standardized output-form of the CHGIS fields)
-final_target_fields = list(target_description.keys())
+# (the standard incoming and target fields, and the default mappings of CHGIS v5 and v6 fields onto the latter, are defined in field_mapping.py)
 
 
 # In[ ]:
 
 # function for selecting .csv files for manipulation
-def csv_picker():
+def path_picker():
     ''' Function for checking whether user input path 1) is that of a valid file, and 2) is of a file ending with '.csv'
         Prompts for re-entry if entry is invalid.
-        Returns a pandas DataFrame constructed from the valid .csv file
+        Returns the valid path
     '''
     path_name = input()
 
@@ -159,10 +67,7 @@ def csv_picker():
         path_name = input()
 
     print("\nThank you -- path %s is valid.\n" % path_name)
-    
-    # storing only the file's basename, for use in user prompts
-    name = os.path.basename(path_name)
-    return pd.read_csv(path_name, low_memory=False), name
+    return path_name
 
 
 # In[ ]:
@@ -217,18 +122,27 @@ def name_checker(name_fields, fields, prefix, frame):
 
 # In[ ]:
 
-# offering user choice of strict or fuzzy name-matching
+# offering user choice of strict, fuzzy, stem or cross-script name-matching
 
-def merge_chooser(target_field, incoming_field):
+def merge_chooser():
     ''' Function called only if the user selects to merge on traditional characters 繁體字 or simplified characters 简体字
-        Lets user choose whether to do a strict or fuzzy merge.
-        In a fuzzy merge, only the first two characters of the Chinese names will be checked against one another.
+        Lets user choose whether to do a strict, fuzzy, stem or cross-script merge.  Returns the mode chosen, for a fuzzy
+        merge the number of candidates to keep, and the list of name keys to compare by (empty for a strict or fuzzy merge).
+        In a stem merge, names are compared exactly once a trailing administrative type (縣, 州, 郡...) has been stripped
+        from both sides (see name_keys.stem_keys()).  In a cross-script merge, traditional, simplified and variant
+        characters are first folded into one form (see name_keys.fold_keys()).
+        In a fuzzy merge, the names are looked up in a character n-gram index built over the target's names: a target name
+        is a candidate if either name contains the other, or if enough of the incoming name's two-character sequences occur in it.
+        Only the best candidates (up to a user-specified number) are kept for each incoming name.
     '''
     print(
     '''
-Please indicate, by entering a numerical digit 1-2, whether you wish to do a strict or fuzzy match of names:
+Please indicate, by entering a numerical digit 1-5, whether you wish to do a strict, fuzzy, stem or cross-script match of names:
     1. Strict matching (e.g. '張掖' matches '張掖', but '張掖' does not match '張掖居延屬國')
-    2. Fuzzy matching (e.g. '張掖' matches '張掖', and '張掖' also matches '張掖居延屬國')
+    2. Fuzzy matching (e.g. '張掖' matches '張掖', and '張掖' also matches '張掖居延屬國' and '張掖郡')
+    3. Stem matching, ignoring administrative types at the end of names (e.g. '張掖' matches '張掖' and '張掖郡', but not '張掖居延屬國')
+    4. Cross-script matching, ignoring differences between traditional, simplified and variant characters (e.g. '張掖' matches '张掖')
+    5. Cross-script stem matching, combining 3. and 4. (e.g. '張掖' matches '張掖郡' and '张掖郡')
     ''')
 
     accepted = False
@@ -238,17 +152,34 @@ Please indicate, by entering a numerical digit 1-2, whether you wish to do a str
         if choice == '1':
             print('Proceeding with strict matching of names.')
             accepted = True
-            mode = 'strict'
-            df = target.merge(incoming, how='outer', left_on=target_field, right_on=incoming_field, indicator=True)
-            return df, mode
+            return 'strict', None, []
         elif choice == '2':
             print('Proceeding with fuzzy matching of names.')
             accepted = True
-            mode = 'fuzzy'
-            target['fuzzy_nm'] = target[target_field].map(lambda x: str(x)[:2])
-            incoming['fuzzy_nm'] = incoming[incoming_field].map(lambda x: str(x)[:2])
-            df = target.merge(incoming, how='outer', on='fuzzy_nm', indicator=True)
-            return df, mode
+            print('''
+Please enter the maximum number of candidate matches to keep for each incoming name, best first (e.g. 10).
+     Containing/contained names (e.g. '張掖' and '張掖居延屬國') rank first, then names sharing the most characters.
+     Hit RETURN without entering anything to keep the default of 10.
+                  ''')
+            top_k = input()
+            try:
+                top_k = int(top_k) if top_k else 10
+            except ValueError:
+                print("Not a valid response. Defaulting to 10.")
+                top_k = 10
+            return 'fuzzy', top_k, []
+        elif choice == '3':
+            print('Proceeding with stem matching of names.')
+            accepted = True
+            return 'strict', None, ['stem']
+        elif choice == '4':
+            print('Proceeding with cross-script matching of names.')
+            accepted = True
+            return 'strict', None, ['fold']
+        elif choice == '5':
+            print('Proceeding with cross-script stem matching of names.')
+            accepted = True
+            return 'strict', None, ['fold', 'stem']
         else:
             print("\nNot a valid response.  Please try again:\n")
             choice = input()
@@ -256,9 +187,64 @@ Please indicate, by entering a numerical digit 1-2, whether you wish to do a str
 
 # In[ ]:
 
-def coordinate_matcher(coords, frame, fields):
-    ''' Function that performs a strict or fuzzy matching of spatial coordinates.  Returns a string indicating the type of match performed.
-        The matches' results are added to the DataFrame within the function.
+# offering user choice of exact or normalized pinyin name-matching
+
+def pinyin_chooser():
+    ''' Function called only if the user selects to merge on names in pinyin 拼音
+        Lets user choose whether to compare the names exactly or by a normalized phonetic key (see name_keys.pinyin_keys()),
+        which ignores trailing administrative suffixes, tone marks, apostrophes, hyphens and spaces, and converts
+        recognizably Wade-Giles spellings to pinyin.  Returns the list of name keys to compare by (empty for exact matching).
+    '''
+    print(
+    """
+Please indicate, by entering a numerical digit 1-2, whether you wish to do an exact or normalized match of pinyin names:
+    1. Exact matching (e.g. 'Quyang' matches 'Quyang', but not 'Quyang Xian' or 'Qu-yang')
+    2. Normalized matching (e.g. 'Quyang' matches 'Quyang Xian', 'Qu-yang', 'Qūyáng' and "Ch'ü-yang hsien")
+    """)
+
+    accepted = False
+    choice = input()
+
+    while accepted == False:
+        if choice == '1':
+            print('Proceeding with exact matching of pinyin names.')
+            accepted = True
+            return []
+        elif choice == '2':
+            print('Proceeding with normalized matching of pinyin names.')
+            accepted = True
+            return ['pinyin']
+        else:
+            print("\nNot a valid response.  Please try again:\n")
+            choice = input()
+
+
+# In[ ]:
+
+def radius_chooser():
+    ''' Function called only if the user selects to match on spatial coordinates rather than on a name.
+        Every target point within a user-specified radius (in kilometres) of an incoming point becomes a candidate match, whatever its name;
+        the great-circle distance between the two points is stored in the 'out_distance_km' field.
+        Returns the radius chosen.
+    '''
+    print('''
+Please enter the radius, in kilometres, within which target points will be matched to each incoming point (e.g. 5).
+     Hit RETURN without entering anything to use the default of 5 km.
+                  ''')
+    radius = input()
+    try:
+        radius = float(radius) if radius else 5.0
+    except ValueError:
+        print("Not a valid response. Defaulting to 5 km.")
+        radius = 5.0
+    return radius
+
+
+# In[ ]:
+
+def coordinate_matcher():
+    ''' Function that lets the user choose between a strict or fuzzy matching of spatial coordinates.
+        Returns a string indicating the type of match chosen, and the number of decimal places to round to for a fuzzy match.
     '''
     
     print('''
@@ -274,9 +260,6 @@ Please indicate, by entering a numerical digit 1-2, whether you wish to do a str
         if choice == '1':
             print('Proceeding with strict matching of spatial coordinates.')
             accepted = True
-            for coord in coords:
-                frame['out_%s_coord_match' % coord] = frame['input_%s_coord' % coord] == frame['tgaz_%s_coord' % coord]
-                fields += ['out_%s_coord_match' % coord]
             decimal_place = None
             return "strict", decimal_place
         elif choice == '2':
@@ -289,40 +272,56 @@ Please enter a number indicating the number of decimal places to which to round
                   ''')
             decimal_place = input()
             try: 
-                for coord in coords:
-                    frame['fuzzy_out_%s_coord_match' % coord] = frame['input_%s_coord' % coord].map(lambda x: round(x, int(decimal_place))) == frame['tgaz_%s_coord' % coord].map(lambda x: round(x, int(decimal_place)))
-                    fields += ['fuzzy_out_%s_coord_match' % coord]
-                return "fuzzy", decimal_place
-                                                                                                
-            except:
+                decimal_place = int(decimal_place)
+            except ValueError:
                 print("Not a valid response. Defaulting to 0 (integer-rounding).")
-                for coord in coords:
-                    frame['fuzzy_out_%s_coord_match' % coord] = frame['input_%s_coord' % coord].map(lambda x: round(x, 0)) == frame['tgaz_%s_coord' % coord].map(lambda x: round(x, 0))
-                    fields += ['fuzzy_out_%s_coord_match' % coord]
-                return "fuzzy", decimal_place
+                decimal_place = 0
+            return "fuzzy", decimal_place
         else:
             print("\nNot a valid response.  Please try again:\n")
             choice = input()
 
-
 # In[ ]:
 
-def title_caser(fields, actual_fields, frame):
-    '''Very simple function that title-cases the contents of the given fields, provided that they are actually used in the DataFrame 
-    '''   
-    for field in fields:
-        if field in actual_fields:
-            frame[field] = frame[field].map(lambda x: str(x).title())
+# soliciting files for comparison; presumption is that second file entered will be the CHGIS v5 in .csv format
+print("Please type the path of the INCOMING .csv file (with extension):")
+incoming_path = path_picker()
+incoming_name = os.path.basename(incoming_path)
+
+# offering to read large incoming files a chunk at a time, so that memory use depends on the chunk size rather than on the file size
+print('''
+Please enter the number of rows of the INCOMING file to read and match at a time (e.g. 50000), if it is too large to handle at once.
+     Each chunk is matched and appended to the output file before the next is read.
+     Hit RETURN without entering anything to read the whole file at once.
+''')
+chunksize = input()
+try:
+    chunksize = int(chunksize) if chunksize else None
+except ValueError:
+    print("Not a valid response. Reading the whole file at once.")
+    chunksize = None
+
+print("Please type the path of the TARGET .csv file (with extension):")
+target_path = path_picker()
+target_name = os.path.basename(target_path)
 
 
 # In[ ]:
 
-# soliciting files for comparison; presumption is that second file entered will be the CHGIS v5 in .csv format
-print("Please type the path of the INCOMING .csv file (with extension):")
-incoming, incoming_name = csv_picker()
+import pandas as pd
 
-print("Please type the path of the TARGET .csv file (with extension):")
-target, target_name = csv_picker()
+from match_engine import match_options
+from chgis_schema import read_table, detect_layout, read_header
+from geoname_matcher import Matcher, matcher_config, write_summary
+from target_cache import CACHE_DIR
+
+# suppressing SettingWithCopyWarning
+pd.options.mode.chained_assignment = None  # default='warn'
+
+# when reading in chunks, only the first chunk is loaded here, for mapping the fields
+with stage('read incoming' if not chunksize else 'read first chunk') as counts:
+    incoming = pd.read_csv(incoming_path, low_memory=False, nrows=chunksize)
+    counts['rows_out'] = len(incoming.index)
 
 
 # In[ ]:
@@ -344,46 +343,22 @@ print('''Please indicate by entering '1' or '2' whether you wish to use a defaul
 ''' % (str(default_target_fields_v5), str(default_target_fields_v6)))
 
 accepted = False
+target_title_cased = False
 mapping = input()
 
 while accepted == False:
     # checks them against one another using comparison of sets (which are collections of unordered, unique items)
     if (mapping == '1'):
-        # if the default target fields from CHGIS v5 are a subset of the target's fields, rename and use them while dropping the fields not in CHGIS v5 
-        if all(item in set(list(target.columns)) for item in set(default_target_fields_v5)):
-            # manually renaming one exception to the following pattern
-            target.rename(columns={'src':'data_source'}, inplace=True)
-
-            # manually dropping the 'seq' field
-            del target['seq']
-            
-            # generating the target_mapping 
-            target_mapping = OrderedDict([(key, 'tgaz_%s' % key) for key in target.columns]) 
-            
-            # renaming the target fields in-place to conform to output specifications
-            target.rename(columns={key:value for key,value in target_mapping.items()}, inplace=True)
-                        
-            # dropping excess fields
-            target = target[final_target_fields]
-            target_fields = list(target.columns)
-            accepted = True
-      
-        # if the default target fields from CHGIS v6 are a subset of the target's fields, rename and use them while dropping the fields not in CHGIS v6
-        elif all(item in set(list(target.columns)) for item in set(default_target_fields_v6)):
-            # renaming in preparation for "tgaz_" prefixing
-            target.rename(columns={'geo_src':'data_source', 'type_simp':'type_ch', 'beg_yr':'beg', 'end_yr':'end' }, inplace=True)
-            
-            # generating target_mapping 
-            target_mapping = OrderedDict([(key, 'tgaz_%s' % key) for key in target.columns])
-            target.rename(columns={key:value for key,value in target_mapping.items()}, inplace=True)
-                        
-            # eliminating parent fields (since v6 data does not include parent information)
-            for parent_item in ['tgaz_prnt_id', 'tgaz_prnt_sysid', 'tgaz_prnt_simp', 'tgaz_prnt_py']:
-                final_target_fields.remove(parent_item) 
-    
-            # dropping other excess fields
-            target = target[final_target_fields]
-            target_fields = list(target.columns)
+        with stage('load target') as counts:
+            target, default_mapping = default_target_loader(target_path)
+            counts['rows_out'] = len(target.index)
+        
+        # the default mapping has been applied (and the pinyin fields title-cased) if the TARGET has either set of default fields
+        if default_mapping is not None:
+            target_mapping = default_mapping
+            # (leaving out the stored name keys, which aren't output fields)
+            target_fields = [field for field in target.columns if field in final_target_fields]
+            target_title_cased = True
             accepted = True
         
         else: 
@@ -394,6 +369,9 @@ while accepted == False:
             target = target[target_fields]
             accepted = True
     elif (mapping == '2'):
+        with stage('load target') as counts:
+            target, _ = read_table(target_path)
+            counts['rows_out'] = len(target.index)
         print("Please specify fields from the TARGET .csv that will be included in output.\n")
         for field, description in target_description.items():
             target_fields, target_mapping = field_mapper(field, description, target, target_fields, target_name, target_mapping, "TARGET")  
@@ -411,18 +389,87 @@ while accepted == False:
 print("Now we will specify fields from the INCOMING (match-making) data that will be included in the final spreadsheet.\n")
 print("Your INCOMING file, %s, contains these fields: %s \n" % (incoming_name, str(list(incoming.columns))))
 print("If your INCOMING field has no appropriate match, hit RETURN without entering any field name to continue.\n")
+incoming_original_fields = list(incoming.columns)
 for field, description in incoming_description.items():
     incoming_fields, incoming_mapping = field_mapper(field, description, incoming, incoming_fields, incoming_name, incoming_mapping, "INCOMING")    
 
 incoming_fields = name_checker(['input_nm_py', 'input_nm_simp', 'input_nm_trad'], incoming_fields, "input", incoming)
+
+# recording every renaming done above (by field_mapper or name_checker), for renaming further chunks of the file the same way
+incoming_renames = OrderedDict(zip(incoming_original_fields, incoming.columns))
 incoming = incoming[incoming_fields]
 
 
 # In[ ]:
 
-### titlecasing string values in pinyin fields to avoid spurious mismatches
-title_caser(['tgaz_nm_py', 'tgaz_type_py'], target_fields, target)
-title_caser(['input_nm_py', 'input_type_py'], incoming_fields, incoming)
+### offering to restrict the comparison to target rows from the same period, before any merging is done
+year_tolerance = None
+
+if all(field in incoming_fields for field in ['input_year_beg', 'input_year_end']) and all(field in target_fields for field in ['tgaz_beg', 'tgaz_end']):
+    print('''
+Beginning and ending years were found in both files. Please indicate, by entering a numerical digit 1-2, whether target rows should be restricted by year:
+    1. No -- compare incoming rows with target rows from any period
+    2. Yes -- only compare incoming rows with target rows whose years overlap theirs (rows with non-numeric years are always compared)
+    ''')
+
+    accepted = False
+    choice = input()
+
+    while accepted == False:
+        if choice == '1':
+            accepted = True
+        elif choice == '2':
+            accepted = True
+            print('''
+Please enter the number of years by which two spans may miss one another and still be compared.
+     For example, if you enter 1, adjacent spans such as 220-265 and 266-316 will be compared; if you enter 0, only overlapping spans will be.
+     Hit RETURN without entering anything to use 0.
+                  ''')
+            year_tolerance = input()
+            try:
+                year_tolerance = int(year_tolerance) if year_tolerance else 0
+            except ValueError:
+                print("Not a valid response. Defaulting to 0.")
+                year_tolerance = 0
+        else:
+            print("\nNot a valid response.  Please try again:\n")
+            choice = input()
+
+
+# In[ ]:
+
+# offering user choice of exact or normalized matching of all names at once
+
+def multi_chooser():
+    ''' Function called only if the user selects to merge on all names at once
+        Lets user choose whether to compare the names exactly or by their normalized keys (names in characters folded into
+        one script and stripped of administrative types, names in pinyin by their phonetic key; see name_keys.py).
+        Returns the list of (target field, incoming field, name keys) to match on, for every name field the two files share.
+    '''
+    print(
+    '''
+Please indicate, by entering a numerical digit 1-2, whether you wish to do an exact or normalized match of the names:
+    1. Exact matching (e.g. '張掖' matches '張掖', and 'Zhangye' matches 'Zhangye')
+    2. Normalized matching (e.g. '張掖' matches '张掖郡', and 'Zhangye' matches 'Zhangye Jun' and 'Zhang-ye')
+    ''')
+
+    accepted = False
+    choice = input()
+
+    while accepted == False:
+        if choice in ('1', '2'):
+            accepted = True
+        else:
+            print("\nNot a valid response.  Please try again:\n")
+            choice = input()
+
+    print('Proceeding with %s matching of names.' % ('exact' if choice == '1' else 'normalized'))
+    fields = []
+    for key in ['nm_trad', 'nm_simp', 'nm_py']:
+        if ('input_%s' % key) in incoming_fields and ('tgaz_%s' % key) in target_fields:
+            keys = [] if choice == '1' else (['pinyin'] if key == 'nm_py' else ['fold', 'stem'])
+            fields.append(('tgaz_%s' % key, 'input_%s' % key, keys))
+    return fields
 
 
 # In[ ]:
@@ -430,16 +477,25 @@ title_caser(['input_nm_py', 'input_type_py'], incoming_fields, incoming)
 # soliciting user choice regarding which name field to take as primary
 print(
     '''
-Thank you. Now, please indicate, by entering a numerical digit 1-3, which of the following names you wish to make the primary key for comparing data:
+Thank you. Now, please indicate, by entering a numerical digit 1-5, which of the following names you wish to make the primary key for comparing data:
     1. Name in complex/traditional Chinese characters 繁体字
     2. Name in simplified Chinese characters 简体字
     3. Name in pinyin 拼音
+    4. No name -- match on spatial coordinates instead (every target point within a given distance of an incoming point, whatever its name)
+    5. All names at once -- every target row matching any of the names the two files have in common, noting which of them matched
     '''
 )
 
 accepted = False
 choice = input()
 
+incoming_name_match_field = None
+target_name_match_field = None
+top_k = None
+spatial_radius = None
+name_keys = []
+name_fields = []
+
 while accepted == False:
     if ((choice == '1') and ('input_nm_trad' in incoming_fields)):
         print("\nUsing name in complex/traditional Chinese characters 繁体字 as primary matching key.")
@@ -447,14 +503,14 @@ while accepted == False:
         match_key = 'nm_trad'
         incoming_name_match_field = 'input_nm_trad'
         target_name_match_field = 'tgaz_nm_trad'
-        df, name_mode = merge_chooser(target_name_match_field, incoming_name_match_field)
+        name_mode, top_k, name_keys = merge_chooser()
     elif ((choice == '2') and ('input_nm_simp' in incoming_fields)):
         print("\nUsing name in simplified Chinese characters 简体字 as primary matching key.")
         accepted = True
         match_key = 'nm_simp'
         incoming_name_match_field = 'input_nm_simp'
         target_name_match_field = 'tgaz_nm_simp'
-        df, name_mode = merge_chooser(target_name_match_field, incoming_name_match_field)
+        name_mode, top_k, name_keys = merge_chooser()
     elif ((choice == '3') and ('input_nm_py' in incoming_fields)):
         print("\nUsing name in pinyin 拼音 as primary matching key.")
         accepted = True
@@ -462,50 +518,74 @@ while accepted == False:
         incoming_name_match_field = 'input_nm_py'
         target_name_match_field = 'tgaz_nm_py'
         name_mode = 'strict'
-        print('Fuzzy matching is not currently supported for pinyin names.  Proceeding with strict matching.')
-        df = target.merge(incoming, how='outer', left_on=target_name_match_field, right_on=incoming_name_match_field, indicator=True)
+        name_keys = pinyin_chooser()
+    elif ((choice == '4') and ('input_x_coord' in incoming_fields) and ('input_y_coord' in incoming_fields) and ('tgaz_x_coord' in target_fields) and ('tgaz_y_coord' in target_fields)):
+        print("\nUsing spatial coordinates as primary matching key.")
+        accepted = True
+        match_key = 'coordinates'
+        name_mode = 'spatial'
+        spatial_radius = radius_chooser()
+    elif ((choice == '5') and any(('input_%s' % key) in incoming_fields and ('tgaz_%s' % key) in target_fields for key in ['nm_trad', 'nm_simp', 'nm_py'])):
+        print("\nUsing all names in common as matching keys.")
+        accepted = True
+        name_mode = 'multi'
+        name_fields = multi_chooser()
+        match_key = ', '.join(target_field.replace('tgaz_', '') for target_field, _, _ in name_fields)
         
     else:
         print("\nNot a valid response.  Please try again, entering a choice corresponding to a valid field:\n")
         choice = input()
-        
-output_fields = []            
 
 
 # In[ ]:
 
-# removing rows that are only present in the CHGIS file
-df = df[df['_merge'] != 'left_only']
+### offering to restrict strict matches to target rows within a unit of the incoming parent's name
+parent_field = None
+part_of_path = None
+target_parents = ('tgaz_prnt_py' if match_key == 'nm_py' else 'tgaz_prnt_simp') in target_fields
 
-# renaming merge indicators for legibility
-df = df.replace(to_replace='both', value='found')
-df = df.replace(to_replace='right_only', value='not_found')
-df.rename(columns={'_merge':'match'}, inplace=True)
+if name_mode == 'strict' and 'input_prnt' in incoming_fields:
+    print('''
+Would you like to restrict the candidates of each incoming name to the target rows lying within a unit of the incoming parent's name?
+     (e.g. '薊縣' with the parent '幽州刺史部' would then only match the 薊縣 of 幽州刺史部; incoming rows without a parent match by name alone)
+     Enter the path of the CHGIS PartOf.csv to look up the parents of parent units too (e.g. input/PartOf.csv),
+     'y' to use only the TARGET's own parent fields, or hit RETURN for no restriction.
+''')
+    accepted = False
+    choice = input().strip()
+
+    while accepted == False:
+        if not choice:
+            accepted = True
+        elif choice.lower() in ('y', 'yes') and target_parents:
+            parent_field = 'input_prnt'
+            accepted = True
+        elif os.path.isfile(choice) and detect_layout(read_header(choice)) == 'PartOf':
+            parent_field = 'input_prnt'
+            part_of_path = choice
+            accepted = True
+        else:
+            print("\nNot a valid response (the TARGET has no parent fields, or the file isn't a CHGIS PartOf.csv).  Please try again:\n")
+            choice = input().strip()
+
+    if parent_field:
+        print("Restricting candidates to target rows within a unit of the incoming parent's name%s." % (' (looked up in %s)' % part_of_path if part_of_path else ''))
 
 
 # In[ ]:
 
-### comparing spatial coordinates
-
-spatial_coords = ['input_x_coord', 'input_y_coord', 'tgaz_x_coord', 'tgaz_y_coord']
-
-# converting the given field's values to a numeric, or NaN, for possible rounding later
-try: 
-    for field in spatial_coords:
-        #print("in the for loop")
-        if (field in incoming_fields) or (field in target_fields):
-            #print("converting %s" % field)
-            df[field] = pd.to_numeric(df[field], errors='coerce')
-    if ('input_x_coord' in incoming_fields) and ('input_y_coord' in incoming_fields):
-        coord_mode, decimal_place = coordinate_matcher(['x', 'y'], df, output_fields)
-    elif ('input_x_coord' in incoming_fields) and not ('input_y_coord' in incoming_fields):
-        coord_mode, decimal_place = coordinate_matcher(['x'], df, output_fields)
-    elif not ('input_x_coord' in incoming_fields) and ('input_y_coord' in incoming_fields):
-        coord_mode, decimal_place = coordinate_matcher(['y'], df, output_fields)
-    else:
-        print("\nNo spatial coordinate fields available for matching.")
-except KeyError:
+### choosing how to compare spatial coordinates
+coords = [coord for coord in ['x', 'y'] if ('input_%s_coord' % coord) in incoming_fields]
+coord_mode = None
+decimal_place = None
+
+if not coords:
+    print("\nNo spatial coordinate fields available for matching.")
+elif not all(('tgaz_%s_coord' % coord) in target_fields for coord in coords):
     print("Spatial coordinates not properly entered. Skipping coordinate matching.")
+    coords = []
+else:
+    coord_mode, decimal_place = coordinate_matcher()
 
 
 # In[ ]:
@@ -522,30 +602,22 @@ if ('input_type_ch' in incoming_fields) and ('input_type_py' in incoming_fields)
     
     while accepted == False:
         if (type_choice) == '1':
-            df['out_type_py_match'] = df['tgaz_type_py'] == df['input_type_py']
             accepted = True
             type_key = 'type_py'
-            output_fields += ['out_type_py_match']
         elif type_choice == '2':
-            df['out_type_ch_match'] = df['tgaz_type_ch'] == df['input_type_ch']
             accepted = True
             type_key = 'type_ch'
-            output_fields += ['out_type_ch_match']
         else:
             print('Not a valid choice, please try again:')
             type_choice = input()
             
 elif ('input_type_ch' in incoming_fields) and ('input_type_py' not in incoming_fields):
     print("The field 'input_type_py' could not be found; matching administrative type on field 'input_type_ch'")
-    df['out_type_ch_match'] = df['tgaz_type_ch'] == df['input_type_ch']
     type_key = 'type_ch'
-    output_fields += ['out_type_ch_match']
     
 elif ('input_type_py' in incoming_fields) and ('input_type_ch' not in incoming_fields):
     print("The field 'input_type_ch' could not be found; matching administrative type on field 'input_type_py'")
-    df['out_type_py_match'] = df['tgaz_type_py'] == df['input_type_py']
     type_key = 'type_py'
-    output_fields += ['out_type_py_match']
     
 else:
     print("Administrative type (e.g. 'Xian' or '县') could not be found in incoming data -- matching will not be attempted.")
@@ -555,84 +627,65 @@ else:
 # In[ ]:
 
 ### handling year matching
-if (not 'input_year_beg' in incoming_fields) or (not 'input_year_end' in incoming_fields):
+compare_years = ('input_year_beg' in incoming_fields) and ('input_year_end' in incoming_fields)
+
+if not compare_years:
     print("Incoming data lacks a beginning and/or ending year field; no date comparisons will be made.")
-else:
-    year_fields = ['input_year_beg', 'input_year_end', 'tgaz_beg', 'tgaz_end']
-    
-    # overlap field initialization
-    df['out_year_overlap'] = ''
-      
-    # converting to type float64 (invalid years become 'NaN', and pandas.isnull(<Series_(column)>) returns True for those values
-    for year_field in year_fields:
-        df[year_field] = pd.to_numeric(df[year_field], errors='coerce')
-    
-    # in-row match testing
-    df['out_beg_match'] = df['input_year_beg'] == df['tgaz_beg']
-    df['out_end_match'] = df['input_year_end'] == df['tgaz_end']
-    
-    # testing for timespan relationships
-    df['out_year_overlap'][((df['input_year_beg'] == (df['tgaz_end'] + 1)) | (df['input_year_end'] == (df['tgaz_beg'] - 1)))] = 'adjacent'
-    df['out_year_overlap'][(df['input_year_beg'] <= df['tgaz_beg']) & (df['input_year_end'] >= df['tgaz_beg']) & (df['input_year_end'] < df['tgaz_end'])] = 'partial_incl_start_of_target'
-    df['out_year_overlap'][(df['input_year_beg'] > df['tgaz_beg']) & (df['input_year_beg'] <= df['tgaz_end']) & (df['input_year_end'] >= df['tgaz_end'])] = 'partial_incl_end_of_target'
-    df['out_year_overlap'][((df['input_year_beg'] >= df['tgaz_beg']) & (df['input_year_end'] < df['tgaz_end'])) | ((df['input_year_beg'] > df['tgaz_beg']) & (df['input_year_end'] <= df['tgaz_end']))] = 'incoming_nested_in_target'
-    df['out_year_overlap'][((df['input_year_beg'] <= df['tgaz_beg']) & (df['input_year_end'] > df['tgaz_end']) | (df['input_year_beg'] < df['tgaz_beg']) & (df['input_year_end'] >= df['tgaz_end']))] = 'target_nested_in_incoming'
-    df['out_year_overlap'][(df['input_year_beg'] == df['tgaz_beg']) & (df['input_year_end'] == df['tgaz_end'])] = 'perfect_match'
-    df['out_year_overlap'][(df['input_year_beg'] == 0) | (df['input_year_end'] == 0) | (df['tgaz_beg'] == 0) | (df['tgaz_end'] == 0)] = 'CAUTION__ZEROES'
-    df['out_year_overlap'][(df['input_year_beg'] > df['input_year_end']) | (df['tgaz_beg'] > df['tgaz_end'])] = 'ERROR__END_BEFORE_BEG'
-    
-    # designating items with non-numeric text values in at least one year field (which therefore break the overlap checker)
-    df['out_year_overlap'][(df['match'] == 'found') & (pd.isnull(df['input_year_beg']) | pd.isnull(df['input_year_end']) | pd.isnull(df['tgaz_beg']) | pd.isnull(df['tgaz_end']))] = 'ERROR__NON_NUMERIC_YEAR_VALUE'
-    
-    # updating output fields
-    output_fields += ['out_beg_match'] + ['out_end_match'] + ['out_year_overlap']
 
 
 # In[ ]:
 
-# adding the 'match_strength' column, leveraging the fact that Python True and False evaluate to 1 and 0 respectively when passed to int()
-df['out_content_match_strength'] = 0
-output_fields += ['out_content_match_strength']
-
-if ('input_x_coord' in incoming_fields):
-    if coord_mode == "strict":
-        df['out_content_match_strength'] += df['out_x_coord_match'].astype(int)
-    else: 
-        df['out_content_match_strength'] += df['fuzzy_out_x_coord_match'].astype(int)
-
-if ('input_y_coord' in incoming_fields):
-    if coord_mode == "strict":
-        df['out_content_match_strength'] += df['out_y_coord_match'].astype(int)
-    else: 
-        df['out_content_match_strength'] += df['fuzzy_out_y_coord_match'].astype(int)
-    
-for field in ['out_beg_match', 'out_end_match', 'out_type_ch_match', 'out_type_py_match']:
-    if field in list(df.columns):
-        df['out_content_match_strength'] += df[field].astype(int)
+### offering to keep only the best candidates of each incoming record
+print('''
+Please enter the number of candidate matches to keep for each incoming record, best first (e.g. 3).
+     Candidates are scored by their matching coordinates, years and types (and, in fuzzy mode, by how much of the name matched).
+     Hit RETURN without entering anything to keep every candidate.
+''')
+
+best_k = input()
+try:
+    best_k = int(best_k) if best_k else None
+except ValueError:
+    print("Not a valid response. Keeping every candidate.")
+    best_k = None
+
+write_candidates = False
+if best_k is not None:
+    print("\nWould you like every candidate (not only the best) to be listed in a separate, compact file as well? Enter 'y' for yes, or hit RETURN for no.\n")
+    write_candidates = (input().strip().lower() in ('y', 'yes'))
 
 
 # In[ ]:
 
-# sorting columns
-ordered_fields = target_fields + incoming_fields + ['match'] + output_fields
-fuzzy_ordered_fields = ['fuzzy_nm'] + ordered_fields
+### offering to spread the matching over several processes
+print('''
+Please enter the number of processes to spread the matching over (this computer has %s processors).
+     The incoming rows are split into shards by name, and the shards are matched side by side; this only pays off for large incoming files.
+     Hit RETURN without entering anything to do all the matching in a single process.
+''' % os.cpu_count())
 
-if name_mode == 'strict':
-    df = df[ordered_fields]
-else:
-    df = df[fuzzy_ordered_fields]
+processes = input()
+try:
+    processes = int(processes) if processes else 1
+except ValueError:
+    print("Not a valid response. Defaulting to a single process.")
+    processes = 1
 
 
 # In[ ]:
 
-# replacing 'nan' with '' for improved legibility
-df = df.replace('nan', '')
+### offering to re-match only the incoming rows that have changed since an earlier run
+print('''
+Would you like to re-use the results of earlier runs of this INCOMING file against this TARGET with the same choices, matching only the rows that are new or have changed since?
+     The candidates found for every row are kept in a cache (in %s) for the next run. Enter 'y' for yes, or hit RETURN to match every row.
+''' % CACHE_DIR)
+incremental = (input().strip().lower() in ('y', 'yes'))
 
 
 # In[ ]:
 
-# outputing results
-print('\nData check is complete.  Please type a path (without extension) for your output files:\n')
+# soliciting the output path
+print('\nPlease type a path (without extension) for your output files:\n')
 output_path = input()
 accepted = False
 
@@ -641,115 +694,66 @@ accepted = False
     # CHECK THAT FILENAMES DON'T ALREADY EXIST
     # CHECK THAT PATH IS VALID
 
-print("Thank you. Saving results.")  
 
-# writing the DataFrame to a .csv file at the specified output path while dropping the unlabeled index column that pandas DataFrames generate by default
-df.to_csv("%s.csv" % output_path, index=False)
+# In[ ]:
+
+### performing the match: merging by name (or coordinates), then comparing coordinates, types and years, and adding the 'match_strength' column
+# (the matching itself is done by geoname_matcher.Matcher, to which these prompts are a front end)
+match_settings = match_options(
+    target_name_field=target_name_match_field,
+    incoming_name_field=incoming_name_match_field,
+    name_mode=name_mode,
+    name_keys=name_keys,
+    name_fields=name_fields,
+    parent_field=parent_field,
+    part_of_path=part_of_path,
+    top_k=top_k,
+    radius_km=spatial_radius,
+    year_tolerance=year_tolerance,
+    coords=coords,
+    coord_mode=coord_mode,
+    decimal_place=decimal_place,
+    type_key=type_key,
+    compare_years=compare_years,
+    best_k=best_k
+)
+
+# the whole incoming file has already been read and renamed above, unless it is to be read in chunks, which are renamed the same way
+match_config = matcher_config(
+    mapping=OrderedDict([(field, renamed) for field, renamed in incoming_renames.items() if renamed in incoming_fields]) if chunksize else None,
+    fields=incoming_fields,
+    options=match_settings,
+    processes=processes,
+    chunksize=chunksize,
+    candidates=write_candidates,
+    incremental=incremental
+)
+matcher = Matcher(target, target_fields, title_cased=target_title_cased)
+
+print("\nMatching -- this may take a while for large files.")
+
+result = matcher.match_to_file(incoming_path if chunksize else incoming, output_path, match_config,
+                               progress=(lambda rows: print("%s incoming rows matched" % rows)) if chunksize else None,
+                               name=os.path.abspath(incoming_path))
+incoming_rows = result['incoming_rows']
+output_rows = result['output_rows']
+
+print("\nData check is complete. Results saved.")  
+if result['rematched_rows'] is not None:
+    print("%s of the %s incoming rows were matched anew; the candidates of the others were those of an earlier run." % (result['rematched_rows'], incoming_rows))
+
 
 # creating the summary .info.txt file
-summary_file = open("%s.info.txt" % output_path, "w")
-
-# writing boilerplate 
-summary_file.write("SUMMARY OF RESULTS\nGenerated at %s\n\n" % datetime.now().strftime("%H:%M, %m/%d/%Y"))
-
-# writing compared & output filenames
-summary_file.write("Incoming file: %s\n" % incoming_name)
-summary_file.write("Target file: %s\n" % target_name)
-summary_file.write("Output file: %s.csv\n\n" % os.path.basename(output_path))
-
-# writing basic statistics
-summary_file.write("Rows in incoming file: %s\n" % str(len(incoming.index)))
-summary_file.write("Rows in target file: %s\n" % str(len(target.index)))
-summary_file.write("Rows in output file: %s\n\n\n\n" % str(len(df.index)))
-
-summary_file.write("FREQUENCY COUNTS\n")
-summary_file.write("Counts given for all values; 'Name' is the field name in the output file, and 'dtype' simply indicates the type of the counts (i.e. integers)\n\n")
-summary_file.write("Matches by name: \n")
-summary_file.write(str(df['match'].value_counts()))
-summary_file.write("\n\n")
-
-if ('input_x_coord' in incoming_fields):
-    if coord_mode == "strict":
-        summary_file.write("X coordinate matches: \n")
-        summary_file.write(str(df['out_x_coord_match'].value_counts()))
-        summary_file.write("\n\n")
-    else:
-        summary_file.write("Fuzzy x coordinate matches: \n")
-        summary_file.write(str(df['fuzzy_out_x_coord_match'].value_counts()))
-        summary_file.write("\n\n")
-if ('input_y_coord' in incoming_fields):
-    if coord_mode == "strict":
-        summary_file.write("Y coordinate matches: \n")
-        summary_file.write(str(df['out_y_coord_match'].value_counts()))
-        summary_file.write("\n\n")
-    else:
-        summary_file.write("Fuzzy y coordinate matches: \n")
-        summary_file.write(str(df['fuzzy_out_y_coord_match'].value_counts()))
-        summary_file.write("\n\n")
-        
-if 'out_beg_match' in list(df.columns):
-    summary_file.write("Beginning year matches: \n")
-    summary_file.write(str(df['out_beg_match'].value_counts()))
-    summary_file.write("\n\n")
-if 'out_end_match' in list(df.columns):
-    summary_file.write("Ending year matches: \n")
-    summary_file.write(str(df['out_end_match'].value_counts()))
-    summary_file.write("\n\n")
-if 'out_year_overlap' in list(df.columns):
-    summary_file.write("Year overlaps: \n")
-    summary_file.write(str(df['out_year_overlap'].value_counts()))
-    summary_file.write("\n\n")
-    
-if 'out_type_ch_match' in list(df.columns):
-    summary_file.write("Administrative type match (Chinese): \n")
-    summary_file.write(str(df['out_type_ch_match'].value_counts()))
-    summary_file.write("\n\n")
-if 'out_type_py_match' in list(df.columns):
-    summary_file.write("Administrative type match (pinyin): \n")
-    summary_file.write(str(df['out_type_py_match'].value_counts()))
-    summary_file.write("\n\n")
-
-summary_file.write("Content match strengths: \n")
-summary_file.write(str(df['out_content_match_strength'].value_counts()))
-summary_file.write("\n\n\n\n")
-
-# writing information about match
-
-summary_file.write("BACKGROUND INFORMATION\n\n")
-summary_file.write("The name match key was %s \n" % match_key)
-summary_file.write("The name match mode was %s \n" % name_mode)
-#summary_file.write("Report created at %s \n" % str(datetime.now)) 
-type_key = None
-if type_key:
-    summary_file.write("The administrative type match key was %s\n" % type_key)
-summary_file.write("The coordinate match mode was %s \n" % coord_mode)
-if coord_mode == 'fuzzy':
-    summary_file.write("Coordinates were rounded to %s decimal place(s)" % decimal_place)
-summary_file.write("\n\n")
-summary_file.write("The target file's fields were renamed as follows (not all fields are necessarily included in final output):\n") 
-with summary_file as out:
-    pprint(target_mapping, stream=out)
-    
-# reopening because pprint automatically closes file upon completion
-summary_file = open("%s.info.txt" % output_path, "a")
-summary_file.write("\n\n")
-summary_file.write("The incoming file's fields were renamed as follows (not all fields are necessarily included in final output):\n")
-
-with summary_file as out:
-    pprint(incoming_mapping, stream=out)
-
-summary_file = open("%s.info.txt" % output_path, "a")
-summary_file.write("\n\n")
-summary_file.write("The actual fields used in the output file are:\n")
-with summary_file as out:
-    pprint(list(df.columns), stream=out)
-
-summary_file = open("%s.info.txt" % output_path, "a")
-summary_file.write("\n\n\n")
-summary_file.write("Report generated using geoname_match.py \nQuestions or concerns? Contact Stephen Ford (stephen.p.ford@gmail.com)")
-
-# closing file
-summary_file.close()
+write_summary(output_path, result, incoming_name, target_name, len(target.index), target_mapping, incoming_mapping,
+              profile_file=('%s.profile.json' % os.path.basename(output_path)) if profiler is not None else None)
+
+# writing the timings of the stages of the run, if they were recorded
+if profiler is not None:
+    run_profiler.stop()
+    profile_files = profiler.write(output_path, incoming_file=incoming_name, target_file=target_name, options=match_settings,
+                                   chunksize=chunksize, processes=processes, incoming_rows=incoming_rows,
+                                   target_rows=len(target.index), output_rows=output_rows)
+    print("\nTimings of the stages of the run stored in %s" % ' and '.join(os.path.basename(path) for path in profile_files))
 
 print("\nMatch results stored in %s.csv \n\nMatching info and summary of results stored in %s.info.txt \n\nNow exiting." % (os.path.basename(output_path), os.path.basename(output_path)))
 
@@ -0,0 +1,51 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/geoname_match_cli.py
+#
+# Lean entry point for the matcher, for running it from the command line or bundling it with PyInstaller
+# (see geoname_match_cli.spec).  Nothing heavier than the standard library is imported until a stage needs it:
+# the interactive matcher only loads pandas once its first files have been chosen, and the match service is only
+# imported when asked for.  startup_benchmark.py measures how long the first prompt takes to appear.
+#
+# Usage:
+#   python3 geoname_match_cli.py                  runs the interactive matcher (geoname_match_161014rev.py)
+#   python3 geoname_match_cli.py --profile        runs it, timing its stages into <output_path>.profile.json (see run_profiler.py)
+#   python3 geoname_match_cli.py --cprofile       runs it, also dumping cProfile statistics into <output_path>.prof
+#   python3 geoname_match_cli.py serve [...]      runs the local match service (see match_service.py for its options)
+
+import os
+import sys
+
+
+USAGE = '''Usage:
+  geoname_match_cli                  run the interactive matcher
+  geoname_match_cli --profile        run it, writing the timings of its stages to <output_path>.profile.json
+  geoname_match_cli --cprofile       run it, writing cProfile statistics to <output_path>.prof as well
+  geoname_match_cli serve [options]  run the local match service (serve --help for its options)
+'''
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv[:1] == ['serve']:
+        import match_service
+        sys.argv = ['%s serve' % sys.argv[0]] + argv[1:]
+        match_service.main()
+    elif argv[:1] in (['--profile'], ['--cprofile']) and len(argv) == 1:
+        # (the matcher starts its profiler from the environment, see run_profiler.start_from_environment())
+        os.environ['CHGIS_PROFILE'] = 'cprofile' if argv[0] == '--cprofile' else '1'
+        import geoname_match_161014rev
+    elif argv:
+        print(USAGE)
+        return 0 if argv[0] in ('-h', '--help') else 2
+    else:
+        # the interactive matcher is a script, which runs its prompts as it is imported
+        import geoname_match_161014rev
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
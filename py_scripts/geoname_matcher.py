@@ -0,0 +1,458 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/geoname_matcher.py
+#
+# Library interface of geoname_match, for matching without prompts: a Matcher holds a target (a CHGIS .csv file loaded
+# with the default mapping of its fields, or a DataFrame given with a mapping of its own) and the indexes built over it,
+# and matches any number of incoming DataFrames or .csv files against it, as described by a declarative configuration:
+#
+#   from geoname_matcher import Matcher
+#   matcher = Matcher.from_path('input/v5_augment_2016-08-09.csv')
+#   config = {'mapping': {'县名': 'input_nm_trad', '經度': 'input_x_coord', '緯度': 'input_y_coord', 'BEG': 'input_year_beg', 'END': 'input_year_end'},
+#             'options': {'name_mode': 'fuzzy', 'name_keys': ['fold'], 'top_k': 5, 'best_k': 1}}
+#   result = matcher.match('input/sample_data/Donghan_2014-10-02_copy.csv', config)     # result['frame'], result['counts']...
+#   result = matcher.match_to_file('input/sample_data/Donghan_2014-10-02_copy.csv', 'output/donghan', config)
+#   write_summary('output/donghan', result, 'Donghan_2014-10-02_copy.csv', 'v5_augment_2016-08-09.csv',
+#                 len(matcher.target.index), matcher.target_mapping, config['mapping'])        # output/donghan.info.txt
+#
+# The configuration is a dictionary with the (optional) keys:
+#   'mapping'     the incoming fields to rename to the standard 'input_*' fields (fields already named so need none)
+#   'fields'      the standard incoming fields to keep, in output order (by default every one found, in standard order)
+#   'options'     matching options, as understood by match_engine.match_options(); those left out that the prompts of
+#                 geoname_match would infer from the available fields (name fields, coordinates, type key, year
+#                 comparison) are inferred the same way (see infer_options())
+#   'processes'   number of processes to spread the match over (default 1)
+#   'chunksize'   number of rows of an incoming .csv file to read and match at a time (match_to_file() only)
+#   'candidates'  with the 'best_k' option, whether to keep every candidate (not only the best) in a compact list as well
+#   'incremental' whether to re-use the candidates found for incoming rows by earlier runs (True, or the directory of
+#                 the cache), matching only the rows that are new or have changed since (see match_cache.py)
+# geoname_match_161014rev.py (the interactive prompts) and match_service.py (the HTTP service) are front ends to it.
+# Only non-core library used is pandas
+
+import os.path
+from collections import OrderedDict
+from pprint import pformat
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+from chgis_schema import read_table
+from field_mapping import final_incoming_fields, final_target_fields, title_caser, default_target_loader
+from match_engine import match_options, match_in_parallel, build_indexes, sort_output, count_values, name_fields_legend
+from match_engine import rank_candidates, best_candidates, COUNT_FIELDS, CANDIDATE_FIELDS, MERGE_FIELDS
+from match_cache import ROW_HASH_FIELD, row_hashes, frame_fingerprint, entry_key, load_results, store_results
+from run_profiler import stage, timed_items
+
+
+# names to match on, in order of preference, when the configuration doesn't specify the name fields
+NAME_KEYS = ['nm_trad', 'nm_simp', 'nm_py']
+
+# the keys of a configuration, with their defaults
+DEFAULT_CONFIG = {
+    'mapping': {},
+    'fields': None,
+    'options': {},
+    'processes': 1,
+    'chunksize': None,
+    'candidates': False,
+    'incremental': False
+}
+
+# field holding, while incoming rows are matched incrementally, the position of the row each candidate was found for
+ROW_FIELD = '_incoming_row'
+
+
+def matcher_config(config=None, **settings):
+    ''' Function that returns a complete configuration (see the top of this module), from a dictionary and/or keywords,
+        filling in the defaults for any key not given
+    '''
+    complete = dict(DEFAULT_CONFIG)
+    complete.update(config or {})
+    complete.update(settings)
+    unknown = set(complete) - set(DEFAULT_CONFIG)
+    if unknown:
+        raise ValueError("Unknown configuration key(s): %s" % ', '.join(sorted(unknown)))
+    return complete
+
+
+def prepare_incoming(frame, mapping=None, fields=None):
+    ''' Function that renames the fields of an incoming DataFrame to the standard 'input_*' fields according to 'mapping'
+        (incoming field -> standard field), keeps only the standard fields (those in 'fields', in that order, if given)
+        and title-cases the pinyin ones.  Returns the new DataFrame and the list of its fields.
+    '''
+    mapping = dict(mapping or {})
+    unknown = [field for field in list(mapping.values()) + list(fields or []) if field not in final_incoming_fields]
+    if unknown:
+        raise ValueError("Not standard incoming fields: %s" % ', '.join(unknown))
+    frame = frame.rename(columns=mapping)
+    if fields is None:
+        fields = [field for field in final_incoming_fields if field in frame.columns]
+    missing = [field for field in fields if field not in frame.columns]
+    if missing:
+        raise ValueError("Incoming fields not found: %s" % ', '.join(missing))
+    fields = list(fields)
+    frame = frame[fields]
+    title_caser(['input_nm_py', 'input_type_py'], fields, frame)
+    return frame, fields
+
+
+def infer_options(options, target_fields, incoming_fields):
+    ''' Function that returns the complete matching options (see match_engine.match_options()), inferring those left out
+        from the fields of the target and incoming data as the prompts of geoname_match would: the first name field
+        found in both (traditional, simplified, then pinyin) or all of them in 'multi' mode, the coordinates found in
+        both (compared strictly), the administrative type (in characters rather than pinyin), and whether to compare years
+    '''
+    options = dict(options or {})
+    both = lambda key: ('input_%s' % key) in incoming_fields and ('tgaz_%s' % key) in target_fields
+
+    if options.get('name_mode') == 'multi' and not options.get('name_fields'):
+        options['name_fields'] = [('tgaz_%s' % key, 'input_%s' % key, []) for key in NAME_KEYS if both(key)]
+        if not options['name_fields']:
+            raise ValueError("The incoming data and the target have no name field in common")
+    elif options.get('name_mode', 'strict') not in ('spatial', 'multi') and not options.get('incoming_name_field'):
+        keys = [key for key in NAME_KEYS if both(key)]
+        if not keys:
+            raise ValueError("The incoming data and the target have no name field in common")
+        options['incoming_name_field'] = 'input_%s' % keys[0]
+        options['target_name_field'] = 'tgaz_%s' % keys[0]
+    if 'coords' not in options:
+        options['coords'] = [coord for coord in ['x', 'y'] if both('%s_coord' % coord)]
+    if options['coords'] and not options.get('coord_mode'):
+        options['coord_mode'] = 'strict'
+    if 'type_key' not in options:
+        options['type_key'] = next((key for key in ['type_ch', 'type_py'] if both(key)), None)
+    if 'compare_years' not in options:
+        options['compare_years'] = ('input_year_beg' in incoming_fields) and ('input_year_end' in incoming_fields)
+    return match_options(**options)
+
+
+def match_key(options):
+    ''' Returns the description of what was matched on, e.g. 'nm_trad', 'coordinates' or 'nm_trad, nm_py' '''
+    if options['name_mode'] == 'spatial':
+        return 'coordinates'
+    if options['name_mode'] == 'multi':
+        return ', '.join(target_field.replace('tgaz_', '') for target_field, _, _ in options['name_fields'])
+    return options['target_name_field'].replace('tgaz_', '')
+
+
+class Matcher(object):
+    ''' A target, renamed to the standard 'tgaz_*' fields, with the indexes built over it by earlier matches (see
+        match_engine.build_indexes()), which are reused by later ones.
+    '''
+
+    def __init__(self, target, target_fields=None, target_mapping=None, title_cased=False):
+        ''' Takes the target DataFrame, either already renamed to the standard 'tgaz_*' fields (of which those in
+            'target_fields' are output, by default all of them), or with a 'target_mapping' (target field -> standard field)
+            to rename it by.  Its pinyin fields are title-cased, unless 'title_cased' says that they already are.
+        '''
+        if target_mapping is not None:
+            unknown = [field for field in target_mapping.values() if field not in final_target_fields]
+            if unknown:
+                raise ValueError("Not standard target fields: %s" % ', '.join(unknown))
+            target = target.rename(columns=dict(target_mapping))
+        self.target_mapping = OrderedDict(target_mapping or [])
+        self.target_fields = list(target_fields) if target_fields is not None else [field for field in final_target_fields if field in target.columns]
+        if target_mapping is not None:
+            target = target[self.target_fields]
+        if not title_cased:
+            with stage('title-case names'):
+                title_caser(['tgaz_nm_py', 'tgaz_type_py'], self.target_fields, target)
+        self.target = target
+        self.index_cache = {}
+        self._fingerprint = None
+
+    @classmethod
+    def from_path(cls, path, target_mapping=None):
+        ''' Function that loads the target .csv file at 'path': with the default mapping of CHGIS v5/v6 fields (see
+            field_mapping.default_target_loader()), unless a 'target_mapping' is given.  Returns the Matcher.
+        '''
+        with stage('load target') as counts:
+            if target_mapping is None:
+                target, mapping = default_target_loader(path)
+                if mapping is None:
+                    raise ValueError("%s has neither the CHGIS v5 nor the v6 fields, and needs a mapping of its fields" % path)
+                matcher = cls(target, [field for field in target.columns if field in final_target_fields], title_cased=True)
+                matcher.target_mapping = mapping
+            else:
+                target, _ = read_table(path)
+                matcher = cls(target, target_mapping=target_mapping)
+            counts['rows_out'] = len(matcher.target.index)
+        return matcher
+
+    def options(self, config, incoming_fields):
+        ''' Returns the complete matching options of a configuration for incoming data with the given fields '''
+        return infer_options(matcher_config(config)['options'], self.target_fields, incoming_fields)
+
+    def warm(self):
+        ''' Function that builds, ahead of the first match that needs them, the fuzzy name indexes over all of the target's
+            name fields, and the key indexes over their stems and folded forms (or, for pinyin names, their phonetic keys)
+        '''
+        for key in NAME_KEYS:
+            field = 'tgaz_%s' % key
+            if field in self.target_fields:
+                build_indexes(self.target, match_options(name_mode='fuzzy', target_name_field=field), self.index_cache)
+                for keys in ([['pinyin']] if key == 'nm_py' else [['stem'], ['fold'], ['fold', 'stem']]):
+                    build_indexes(self.target, match_options(target_name_field=field, name_keys=keys), self.index_cache)
+
+    def fingerprint(self):
+        ''' Returns the fingerprint of the target's contents (see match_cache.frame_fingerprint()), computed once '''
+        if self._fingerprint is None:
+            self._fingerprint = frame_fingerprint(self.target[self.target_fields])
+        return self._fingerprint
+
+    def _match_incrementally(self, incoming, config, options, indexes, name):
+        # matching only the incoming rows whose candidates aren't in the cache entry for this target, these options and
+        # fields and this incoming data ('name'), and storing theirs along with those of the other rows back in it.
+        # Candidates are cached before being ranked, since the ranks of a record's candidates depend on its other rows.
+        # Returns the candidates of every row, grouped by incoming row in incoming order, the list of the fields added by
+        # the comparisons, and the number of rows matched anew.
+        cache_dir = config['incremental'] if isinstance(config['incremental'], str) else None
+        unranked = dict(options, best_k=None)
+        key = entry_key(self.fingerprint(), unranked, list(incoming.columns), self.target_fields, name)
+        with stage('hash rows', len(incoming.index)):
+            hashes = row_hashes(incoming)
+        with stage('load cached candidates') as rows:
+            cached = load_results(key, hashes, cache_dir)
+            rows['rows_out'] = len(cached.index) if cached is not None else None
+        known = np.isin(hashes, cached[ROW_HASH_FIELD].values) if cached is not None else np.zeros(len(hashes), dtype=bool)
+
+        # (identical rows are only matched once)
+        unmatched = ~known & ~pd.Series(hashes).duplicated().values
+        new = incoming[unmatched].assign(**{ROW_FIELD: np.flatnonzero(unmatched)})
+        stored_fields = [ROW_HASH_FIELD] + self.target_fields + list(incoming.columns) + ['match'] + MERGE_FIELDS[options['name_mode']]
+        if len(new.index) or cached is None:
+            df, output_fields = match_in_parallel(self.target, new, unranked, config['processes'], indexes)
+            # (positions turn into floats where the merge has left some empty, i.e. in the target's unmatched rows since dropped)
+            df[ROW_HASH_FIELD] = hashes[df[ROW_FIELD].values.astype(np.int64)]
+            df = df[stored_fields + output_fields]
+            if cached is not None:
+                df = pd.concat([cached, df], ignore_index=True)
+            with stage('store cached candidates', len(df.index)):
+                store_results(key, df, cache_dir)
+        else:
+            df = cached
+            output_fields = [field for field in df.columns if field not in stored_fields]
+
+        # the candidates of each incoming row, by its hash
+        with stage('merge cached candidates', len(incoming.index)) as rows:
+            df = pd.DataFrame({ROW_HASH_FIELD: hashes}).merge(df, on=ROW_HASH_FIELD, sort=False)
+            rows['rows_out'] = len(df.index)
+        if options['best_k'] is not None:
+            with stage('rank candidates', len(df.index)):
+                output_fields = output_fields + rank_candidates(df, options)
+        return df, output_fields, int((~known).sum())
+
+    def _match_frame(self, incoming, config, options, counts=None, name=None):
+        # matching one (renamed) DataFrame, returning the output, the list of every candidate if asked for, the counts
+        # (added to those given, e.g. of earlier chunks), and the number of rows matched anew (None unless incremental)
+        indexes = build_indexes(self.target, options, self.index_cache)
+        with stage('match', len(incoming.index)) as rows:
+            if config['incremental']:
+                df, output_fields, rematched = self._match_incrementally(incoming, config, options, indexes, name)
+            else:
+                df, output_fields = match_in_parallel(self.target, incoming, options, config['processes'], indexes)
+                rematched = None
+            rows['rows_out'] = len(df.index)
+        candidates = None
+        if options['best_k'] is not None:
+            if config['candidates']:
+                candidates = df[[field for field in CANDIDATE_FIELDS if field in df.columns]]
+            with stage('best candidates', len(df.index)) as rows:
+                df = best_candidates(df, options)
+                rows['rows_out'] = len(df.index)
+        with stage('sort output', len(df.index)):
+            df = sort_output(df, self.target_fields, list(incoming.columns), options, output_fields)
+        with stage('count values', len(df.index)):
+            counts = count_values(df, COUNT_FIELDS, counts)
+        return df, candidates, counts, rematched
+
+    def _read(self, incoming, chunksize=None):
+        # the incoming DataFrame as it is, or the .csv file at the path read whole or (as an iterator) in chunks
+        if not isinstance(incoming, str):
+            return incoming
+        with stage('read incoming' if not chunksize else 'open incoming'):
+            return pd.read_csv(incoming, low_memory=False, chunksize=chunksize)
+
+    def match(self, incoming, config=None, name=None):
+        ''' Function that matches incoming data, given as a DataFrame or the path of a .csv file, against the target as
+            configured (see the top of this module).  Returns an ordered dictionary of:
+              'frame'           the matched DataFrame, its fields in output order
+              'candidates'      the compact list of every candidate, if asked for (else None)
+              'counts'          the frequency counts of the values of the output fields (see match_engine.count_values())
+              'options'         the complete matching options used
+              'incoming_fields', 'incoming_rows', 'output_rows'
+              'rematched_rows'  if matching incrementally, the number of incoming rows matched anew (else None)
+            When matching incrementally, the cached results are those of earlier matches of the incoming data of the
+            same 'name' (by default its path, if given one), and the candidates come out grouped by incoming row.
+        '''
+        config = matcher_config(config)
+        if name is None and isinstance(incoming, str):
+            name = os.path.abspath(incoming)
+        incoming = self._read(incoming)
+        with stage('title-case names'):
+            incoming, incoming_fields = prepare_incoming(incoming, config['mapping'], config['fields'])
+        options = self.options(config, incoming_fields)
+        df, candidates, counts, rematched = self._match_frame(incoming, config, options, name=name)
+        return OrderedDict([
+            ('frame', df), ('candidates', candidates), ('counts', counts), ('options', options),
+            ('incoming_fields', incoming_fields), ('incoming_rows', len(incoming.index)), ('output_rows', len(df.index)),
+            ('rematched_rows', rematched)
+        ])
+
+    def match_to_file(self, incoming, output_path, config=None, progress=None, name=None):
+        ''' Function that matches incoming data (a DataFrame, the path of a .csv file, or an iterator of DataFrames, e.g. a
+            .csv file read in chunks) against the target as configured, writing the results to <output_path>.csv and, if
+            asked for, every candidate to <output_path>.candidates.csv.  A .csv file is read and matched 'chunksize' rows
+            at a time if configured so, each chunk being appended to the output before the next one is read, with
+            'progress' (if given) called with the number of incoming rows matched so far after each.
+            Returns the same dictionary as match(), but with 'fields' (the list of output fields) instead of 'frame', and
+            with 'output_file' and 'candidates_file' instead of 'candidates'.
+            When matching incrementally, each chunk has a cache entry of its own.
+        '''
+        config = matcher_config(config)
+        if name is None and isinstance(incoming, str):
+            name = os.path.abspath(incoming)
+        chunks = self._read(incoming, config['chunksize'])
+        if isinstance(chunks, pd.DataFrame):
+            chunks = [chunks]
+        else:
+            chunks = timed_items('read incoming', chunks)
+
+        options, counts, fields, rematched = None, None, None, None
+        incoming_rows, output_rows = 0, 0
+        for number, chunk in enumerate(chunks):
+            with stage('title-case names'):
+                chunk, incoming_fields = prepare_incoming(chunk, config['mapping'], config['fields'])
+            if options is None:
+                options = self.options(config, incoming_fields)
+            df, candidates, counts, chunk_rematched = self._match_frame(chunk, config, options, counts, (name, number))
+
+            mode, header = ('w' if number == 0 else 'a'), (number == 0)
+            if candidates is not None:
+                with stage('write candidates', len(candidates.index)):
+                    candidates.to_csv('%s.candidates.csv' % output_path, index=False, mode=mode, header=header)
+            # writing the DataFrame to a .csv file at the specified output path while dropping the unlabeled index column that pandas DataFrames generate by default
+            with stage('write output', len(df.index)):
+                df.to_csv('%s.csv' % output_path, index=False, mode=mode, header=header)
+
+            fields = list(df.columns)
+            incoming_rows += len(chunk.index)
+            output_rows += len(df.index)
+            if chunk_rematched is not None:
+                rematched = (rematched or 0) + chunk_rematched
+            if progress is not None:
+                progress(incoming_rows)
+
+        if options is None:
+            raise ValueError("The incoming data has no rows")
+        return OrderedDict([
+            ('fields', fields), ('counts', counts), ('options', options), ('incoming_fields', incoming_fields),
+            ('incoming_rows', incoming_rows), ('output_rows', output_rows), ('rematched_rows', rematched), ('output_file', '%s.csv' % output_path),
+            ('candidates_file', '%s.candidates.csv' % output_path if config['candidates'] and options['best_k'] is not None else None)
+        ])
+
+
+def summary_text(result, incoming_name, target_name, output_name, target_rows, target_mapping=None, incoming_mapping=None,
+                 profile_file=None):
+    ''' Function that returns the text of the summary of a match (the .info.txt file written by geoname_match), given
+        the result of Matcher.match_to_file() and the names of the files involved
+    '''
+    options, counts = result['options'], result['counts']
+    lines = []
+    write = lines.append
+
+    # writing boilerplate
+    write("SUMMARY OF RESULTS\nGenerated at %s\n\n" % datetime.now().strftime("%H:%M, %m/%d/%Y"))
+
+    # writing compared & output filenames
+    write("Incoming file: %s\n" % incoming_name)
+    write("Target file: %s\n" % target_name)
+    write("Output file: %s.csv\n" % output_name)
+    if result.get('candidates_file'):
+        write("All candidates file: %s.candidates.csv\n" % output_name)
+    if profile_file:
+        write("Run profile: %s\n" % profile_file)
+    write("\n")
+
+    # writing basic statistics
+    write("Rows in incoming file: %s\n" % str(result['incoming_rows']))
+    if result.get('rematched_rows') is not None:
+        write("Rows matched anew (the candidates of the others were those of an earlier run): %s\n" % str(result['rematched_rows']))
+    write("Rows in target file: %s\n" % str(target_rows))
+    write("Rows in output file: %s\n\n\n\n" % str(result['output_rows']))
+
+    write("FREQUENCY COUNTS\n")
+    write("Counts given for all values; 'Name' is the field name in the output file, and 'dtype' simply indicates the type of the counts (i.e. integers)\n\n")
+
+    def write_counts(title, field):
+        write(title)
+        write(str(counts[field]))
+        write("\n\n")
+
+    write_counts("Matches by name: \n", 'match')
+    if 'out_name_containment' in counts:
+        write_counts("Fuzzy name candidates where one name contains the other: \n", 'out_name_containment')
+    if 'out_name_fields_matched' in counts:
+        write_counts("Names matched (bitmask, see BACKGROUND INFORMATION below): \n", 'out_name_fields_matched')
+
+    for coord in options['coords']:
+        if options['coord_mode'] == "strict":
+            write_counts("%s coordinate matches: \n" % coord.upper(), 'out_%s_coord_match' % coord)
+        else:
+            write_counts("Fuzzy %s coordinate matches: \n" % coord, 'fuzzy_out_%s_coord_match' % coord)
+
+    for title, field in [("Beginning year matches: \n", 'out_beg_match'), ("Ending year matches: \n", 'out_end_match'),
+                         ("Year overlaps: \n", 'out_year_overlap'), ("Administrative type match (Chinese): \n", 'out_type_ch_match'),
+                         ("Administrative type match (pinyin): \n", 'out_type_py_match')]:
+        if field in counts:
+            write_counts(title, field)
+
+    write("Content match strengths: \n")
+    write(str(counts['out_content_match_strength']))
+    write("\n\n\n\n")
+
+    # writing information about match
+    write("BACKGROUND INFORMATION\n\n")
+    write("The name match key was %s \n" % match_key(options))
+    write("The name match mode was %s \n" % options['name_mode'])
+    if options['name_keys']:
+        write("Names were compared by their normalized key(s): %s \n" % ', '.join(options['name_keys']))
+    if options['year_tolerance'] is not None:
+        write("Only target rows whose years overlapped the incoming row's (within %s years) were compared \n" % options['year_tolerance'])
+    if options['parent_field']:
+        write("Only target rows within a unit of the incoming parent's name (%s) were matched%s \n" % (
+            options['parent_field'], ' (parents of parent units looked up in %s)' % options['part_of_path'] if options['part_of_path'] else ''))
+    if options['best_k'] is not None:
+        write("Only the best %s candidate(s) of each incoming record were kept, as ranked by out_match_score \n" % options['best_k'])
+    if options['name_mode'] == 'multi':
+        write("The names that matched are given by out_name_fields_matched, adding up: %s \n" % name_fields_legend(options))
+    if options['name_mode'] == 'spatial':
+        write("Target points were matched within %s km of each incoming point \n" % options['radius_km'])
+    write("The coordinate match mode was %s \n" % options['coord_mode'])
+    if options['coord_mode'] == 'strict' and options.get('coord_epsilon'):
+        write("Coordinates matched within %s degree(s) of one another \n" % options['coord_epsilon'])
+    if options['coord_mode'] == 'fuzzy':
+        write("Coordinates were rounded to %s decimal place(s)" % options['decimal_place'])
+    write("\n\n")
+    write("The target file's fields were renamed as follows (not all fields are necessarily included in final output):\n")
+    write(pformat(target_mapping or OrderedDict()) + "\n")
+    write("\n\n")
+    write("The incoming file's fields were renamed as follows (not all fields are necessarily included in final output):\n")
+    write(pformat(incoming_mapping or OrderedDict()) + "\n")
+    write("\n\n")
+    write("The actual fields used in the output file are:\n")
+    write(pformat(result['fields']) + "\n")
+    write("\n\n\n")
+    write("Report generated using geoname_match.py \nQuestions or concerns? Contact Stephen Ford (stephen.p.ford@gmail.com)")
+    return ''.join(lines)
+
+
+def write_summary(output_path, result, incoming_name, target_name, target_rows, target_mapping=None, incoming_mapping=None,
+                  profile_file=None):
+    ''' Function that writes the summary of a match (see summary_text()) to <output_path>.info.txt '''
+    with open("%s.info.txt" % output_path, "w") as summary_file:
+        summary_file.write(summary_text(result, incoming_name, target_name, os.path.basename(output_path), target_rows,
+                                        target_mapping, incoming_mapping, profile_file))
@@ -0,0 +1,360 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/match_benchmark.py
+#
+# Benchmark suite for geoname_match and version_merge: generates synthetic CHGIS targets of the given sizes (see
+# synthetic_chgis.py), with incoming data drawn from them and a v6 release derived from them, and runs on each:
+#   name join       the strict name merge of geoname_match, with its coordinate, type and year comparisons
+#   fuzzy join      the fuzzy name merge (top 3 candidates), with the same comparisons
+#   spatial join    the merge by coordinates (within 5 km)
+#   year blocking   the strict name merge restricted to target rows whose years overlap
+#   version merge   the duplicate checks of version_merge_161018.py between the v5 target and the v6 release
+#   version diff    the keyed change-set from the v5 target to the v6 release (see version_compare.diff_versions())
+#   version delta   the delta from the v5 target to the v6 release, made and applied to rebuild v6 (see version_delta.py)
+#   release merge   the N-way merge of the v5 target and the v6 release (see version_compare.merge_releases())
+# Each case is run in a forked process of its own, so that its peak resident memory can be told apart from the others'.
+# Its output is checked, where the sizes allow (see --reference-rows), against a plain pandas (or brute-force)
+# computation of the same result, and summed up in a digest that, compared with the digest of an earlier run (see
+# --baseline), tells whether an optimization changed the output at all.
+# The report is printed, and written as JSON with --report.  Exits with status 1 if any check fails.
+#
+# Usage:
+#   python3 match_benchmark.py [--rows 10000 100000 1000000] [--incoming-rows N] [--cases name_join fuzzy_join ...]
+#                              [--repeat 3] [--report benchmark.json] [--baseline earlier_benchmark.json]
+#
+# Uses os.fork(), and so only runs on Unix-like systems.
+# Only non-core libraries used are pandas and numpy
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import platform
+import resource
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import pandas as pd
+import numpy as np
+
+from chgis_schema import compact_frame
+from field_mapping import default_mapper
+from match_engine import match_options, match_frames
+from spatial_index import haversine_km
+from version_compare import compare_versions, diff_versions, merge_releases, COMPARED_FIELDS, RELEASE_MAPPINGS
+from version_delta import make_delta, apply_delta, content_fingerprint
+import synthetic_chgis
+
+
+# the number of incoming rows drawn for each target row, and the most that are drawn
+INCOMING_SHARE, MAX_INCOMING_ROWS = 0.1, 100000
+
+# number of incoming rows checked against a brute-force search in the spatial join
+SPATIAL_REFERENCE_ROWS = 200
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def digest(frame):
+    ''' Returns a short hash of the fields and values of the DataFrame, in order, for telling whether two outputs are the same '''
+    sha = hashlib.sha1(json.dumps([str(column) for column in frame.columns]).encode('utf-8'))
+    sha.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+    return sha.hexdigest()[:16]
+
+
+def generate(rows, incoming_rows, seed):
+    ''' Function that generates the data of one size: the v5 target (renamed as geoname_match renames it), the incoming
+        data, and the v5 and v6 tables compared by version_merge, with the compact dtypes they are read with
+    '''
+    v5 = synthetic_chgis.generate_target(rows, seed)
+    incoming = synthetic_chgis.incoming_from(v5, incoming_rows, seed + 2)
+    v6 = synthetic_chgis.to_v6(synthetic_chgis.derive_release(v5, seed + 1))
+    v5 = compact_frame(v5, 'v5')
+    target, _ = default_mapper(v5.copy(), 'v5')
+    return {'target': target, 'incoming': incoming, 'v5': v5, 'v6': compact_frame(v6, 'v6')}
+
+
+def _comparisons(**options):
+    # the comparisons geoname_match makes when both files have coordinates, types and years
+    return match_options(coords=['x', 'y'], coord_mode='strict', type_key='type_ch', compare_years=True, **options)
+
+
+def name_join(data):
+    options = _comparisons(target_name_field='tgaz_nm_simp', incoming_name_field='input_nm_simp')
+    return match_frames(data['target'], data['incoming'], options)[0]
+
+
+def fuzzy_join(data):
+    options = _comparisons(target_name_field='tgaz_nm_simp', incoming_name_field='input_nm_simp', name_mode='fuzzy', top_k=3)
+    return match_frames(data['target'], data['incoming'], options)[0]
+
+
+def spatial_join(data):
+    options = _comparisons(name_mode='spatial', radius_km=5.0)
+    return match_frames(data['target'], data['incoming'], options)[0]
+
+
+def year_blocking(data):
+    options = _comparisons(target_name_field='tgaz_nm_simp', incoming_name_field='input_nm_simp', year_tolerance=0)
+    return match_frames(data['target'], data['incoming'], options)[0]
+
+
+def _versions(data):
+    # the v5 and v6 tables concatenated as version_merge concatenates them
+    v5, v6 = data['v5'].copy(), data['v6'].copy()
+    v5['version'] = 5
+    v6['version'] = 6
+    return pd.concat([v5, v6])
+
+
+def version_merge(data):
+    ''' The duplicate checks of version_merge_161018.py (see version_compare.py), without writing any file '''
+    return compare_versions(_versions(data))
+
+
+def version_merge_reference(data, df):
+    ''' Compares the flags with those of the chain of copies that version_merge used to make, one per compared field,
+        each partitioning the rows into the duplicates and the uniques of the field and concatenating them back together
+        (after which the rows are put back into their original order)
+    '''
+    reference = _versions(data)
+    reference['_row'] = np.arange(len(reference.index))
+
+    def field_matcher(frame, v6_field, v5_field, new_field):
+        mask_duplicates = frame.duplicated(subset=[v6_field, v5_field], keep=False)
+        duplicates = frame[mask_duplicates]
+        duplicates[new_field] = True
+        uniques = frame[~mask_duplicates]
+        uniques[new_field] = False
+        return pd.concat([duplicates, uniques])
+
+    reference = field_matcher(reference, 'sys_id', 'sys_id', 'sys_id_duplicate')
+    for v6_field, v5_field, new_field in COMPARED_FIELDS:
+        if v5_field == 'x_coord':
+            reference['x_coord'], reference['y_coord'] = reference['x_coord'].astype(str), reference['y_coord'].astype(str)
+        reference = field_matcher(reference, v6_field, v5_field, new_field)
+        if v5_field == 'y_coord':
+            reference['x_coord'], reference['y_coord'] = reference['x_coord'].astype(float), reference['y_coord'].astype(float)
+    reference['exact_match'] = reference.all(axis=1, bool_only=True)
+
+    flags = [new_field for _, _, new_field in COMPARED_FIELDS]
+    reference['content_only'] = np.where((reference['sys_id_duplicate'] == False) & (reference[flags] == True).all(axis=1), 'True', 'False')
+    reference['id_only'] = np.where((reference['sys_id_duplicate'] == True) & (reference[flags] == False).all(axis=1), 'True', 'False')
+    reference = reference.sort_values('_row', kind='mergesort').drop(columns='_row')
+    return digest(reference) == digest(df)
+
+
+def version_diff(data):
+    ''' The keyed change-set from v5 to v6 (see version_compare.py), without writing any file '''
+    return diff_versions(data['v5'], data['v6'])
+
+
+def _expected_changes(data):
+    ''' Returns the (change, v5 'sys_id', v6 'sys_id', changed fields) of the records changed from v5 to v6, found by an
+        outer merge of v5 and v6 on 'sys_id' (every record of the synthetic v6 release having one), comparing the fields
+        of the merged rows one at a time
+    '''
+    v5, v6 = data['v5'].astype(object), data['v6'].astype(object)
+    merged = v5.merge(v6, on='sys_id', how='outer', suffixes=('_v5', '_v6'), indicator=True, sort=False)
+    expected = []
+    for _, row in merged.iterrows():
+        if row['_merge'] == 'left_only':
+            expected.append(('removed', row['sys_id'], None, None))
+        elif row['_merge'] == 'right_only':
+            expected.append(('added', None, row['sys_id'], None))
+        else:
+            changed = []
+            for v6_field, v5_field, flag_field in COMPARED_FIELDS:
+                old = row[v5_field + '_v5' if v5_field == v6_field else v5_field]
+                new = row[v6_field + '_v6' if v5_field == v6_field else v6_field]
+                if not (pd.isna(old) and pd.isna(new)) and (pd.isna(old) or pd.isna(new) or old != new):
+                    changed.append(flag_field.replace('_duplicate', ''))
+            if changed:
+                expected.append(('modified', row['sys_id'], row['sys_id'], ', '.join(changed)))
+    return sorted(expected, key=str)
+
+
+def version_diff_reference(data, df):
+    ''' Compares the change-set with the changes found by an outer merge of v5 and v6 (see _expected_changes()) '''
+    found = [tuple(None if pd.isna(value) else value for value in row)
+             for row in df[['change', 'v5_sys_id', 'v6_sys_id', 'changed_fields']].itertuples(index=False)]
+    return sorted(found, key=str) == _expected_changes(data)
+
+
+def release_merge(data):
+    ''' The N-way merge of v5 and v6 (see version_compare.py), without writing any file '''
+    return merge_releases([('v5', data['v5'], RELEASE_MAPPINGS['v5']), ('v6', data['v6'], RELEASE_MAPPINGS['v6'])])
+
+
+def release_merge_reference(data, df):
+    ''' Compares the records the merge finds only in v5, only in v6, or changed, with the changes found by an outer
+        merge of v5 and v6 (see _expected_changes())
+    '''
+    removed = df[df['in_v5'] & ~df['in_v6']]['sys_id']
+    added = df[~df['in_v5'] & df['in_v6']]['sys_id']
+    modified = df[df['same_v6'] == False]
+    found = ([('removed', sys_id, None, None) for sys_id in removed] + [('added', None, sys_id, None) for sys_id in added] +
+             [('modified', sys_id, sys_id, changed) for sys_id, changed in zip(modified['sys_id'], modified['changed_v6'])])
+    return sorted(found, key=str) == _expected_changes(data)
+
+
+def version_delta(data):
+    ''' The delta from v5 to v6 (see version_delta.py), applied to v5 to rebuild v6 '''
+    return apply_delta(data['v5'], make_delta(data['v5'], data['v6']))
+
+
+def version_delta_reference(data, df):
+    ''' Compares the rebuilt v6 with the v6 release, regardless of the order of their rows '''
+    return list(df.columns) == list(data['v6'].columns) and content_fingerprint(df) == content_fingerprint(data['v6'])
+
+
+def _found_pairs(df):
+    ''' Returns the sorted (input_id, tgaz_sys_id) pairs of the found candidates of a match '''
+    found = df[df['match'] == 'found']
+    return sorted(zip(found['input_id'].tolist(), found['tgaz_sys_id'].astype(str).tolist()))
+
+
+def _merged_pairs(data, year_tolerance=None):
+    ''' Returns the pairs found by a plain pandas merge on the simplified names, optionally restricted by year '''
+    merged = data['incoming'].merge(data['target'], left_on='input_nm_simp', right_on='tgaz_nm_simp')
+    if year_tolerance is not None:
+        misses = ((merged['tgaz_beg'].astype(float) > merged['input_year_end'] + year_tolerance) |
+                  (merged['tgaz_end'].astype(float) < merged['input_year_beg'] - year_tolerance))
+        merged = merged[~misses.values]
+    return sorted(zip(merged['input_id'].tolist(), merged['tgaz_sys_id'].astype(str).tolist()))
+
+
+def name_join_reference(data, df):
+    return _found_pairs(df) == _merged_pairs(data)
+
+
+def year_blocking_reference(data, df):
+    return _found_pairs(df) == _merged_pairs(data, year_tolerance=0)
+
+
+def spatial_join_reference(data, df):
+    ''' Compares the candidates of the first incoming rows with those found by measuring the distance to every target point '''
+    target, incoming = data['target'], data['incoming'].iloc[:SPATIAL_REFERENCE_ROWS]
+    expected = []
+    for number, x, y in zip(incoming['input_id'], incoming['input_x_coord'], incoming['input_y_coord']):
+        distances = haversine_km(x, y, target['tgaz_x_coord'].values, target['tgaz_y_coord'].values)
+        expected += [(number, sys_id) for sys_id in target['tgaz_sys_id'].values[distances <= 5.0].astype(str)]
+    found = [pair for pair in _found_pairs(df) if pair[0] in set(incoming['input_id'])]
+    return found == sorted(expected)
+
+
+# the benchmark cases, with the function checking their output against a reference computation (if any)
+CASES = OrderedDict([
+    ('name_join', (name_join, name_join_reference)),
+    ('fuzzy_join', (fuzzy_join, None)),
+    ('spatial_join', (spatial_join, spatial_join_reference)),
+    ('year_blocking', (year_blocking, year_blocking_reference)),
+    ('version_merge', (version_merge, version_merge_reference)),
+    ('version_diff', (version_diff, version_diff_reference)),
+    ('version_delta', (version_delta, version_delta_reference)),
+    ('release_merge', (release_merge, release_merge_reference))
+])
+
+
+def run_case(name, data, repeat, check_reference):
+    ''' Function that runs a case 'repeat' times in a forked process, returning its record: the best wall time, the CPU
+        time of that run, the peak resident memory of the process and how much it grew, the number of output rows, the
+        digest of the output, and whether it is the same as the reference computation's (None if not checked)
+    '''
+    case, reference = CASES[name]
+    reading, writing = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(reading)
+        record = OrderedDict()
+        try:
+            before = _rss_mb()
+            timings = []
+            for _ in range(repeat):
+                started, cpu = time.perf_counter(), time.process_time()
+                output = case(data)
+                timings.append((time.perf_counter() - started, time.process_time() - cpu))
+            seconds, cpu_s = min(timings)
+            record.update([
+                ('seconds', round(seconds, 4)), ('cpu_s', round(cpu_s, 4)),
+                ('peak_rss_mb', round(_rss_mb(), 1)), ('extra_rss_mb', round(_rss_mb() - before, 1)),
+                ('output_rows', len(output.index)), ('digest', digest(output)),
+                ('reference', bool(reference(data, output)) if reference is not None and check_reference else None)
+            ])
+        except Exception as error:
+            record['error'] = '%s: %s' % (type(error).__name__, error)
+        with os.fdopen(writing, 'wb') as out:
+            pickle.dump(record, out)
+        os._exit(0)
+
+    os.close(writing)
+    with os.fdopen(reading, 'rb') as results:
+        content = results.read()
+    os.waitpid(pid, 0)
+    return pickle.loads(content) if content else OrderedDict([('error', 'the case process died (out of memory?)')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the stages of geoname_match and version_merge on synthetic CHGIS data.")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help="target sizes, e.g. 10000 100000 1000000 10000000")
+    parser.add_argument('--incoming-rows', type=int, help="incoming rows (default: a tenth of the target, up to %s)" % MAX_INCOMING_ROWS)
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--repeat', type=int, default=1, help="runs of each case, of which the quickest is reported")
+    parser.add_argument('--reference-rows', type=int, default=100000, help="largest target checked against the reference computations")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', help="path of a .json file to write the report to")
+    parser.add_argument('--baseline', help="report of an earlier run, whose digests the outputs must match")
+    arguments = parser.parse_args()
+
+    baseline = {}
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as source:
+            for record in json.load(source)['cases']:
+                baseline[(record['case'], record['rows'], record['incoming_rows'], record['seed'])] = record.get('digest')
+
+    report = OrderedDict([
+        ('started', datetime.now().isoformat(timespec='seconds')),
+        ('python', platform.python_version()), ('pandas', pd.__version__), ('numpy', np.__version__),
+        ('cpus', os.cpu_count()), ('cases', [])
+    ])
+    failed = False
+    print("%-14s %9s %9s %9s %9s %9s %9s %10s %9s %9s" % ('case', 'rows', 'incoming', 'seconds', 'cpu_s', 'peak_MB', 'extra_MB', 'output', 'reference', 'baseline'))
+    for rows in arguments.rows:
+        incoming_rows = arguments.incoming_rows or max(min(int(rows * INCOMING_SHARE), MAX_INCOMING_ROWS), 1)
+        started = time.perf_counter()
+        data = generate(rows, incoming_rows, arguments.seed)
+        print("(%s target rows generated in %.1f s)" % (rows, time.perf_counter() - started))
+
+        for name in arguments.cases:
+            record = OrderedDict([('case', name), ('rows', rows), ('incoming_rows', incoming_rows), ('seed', arguments.seed)])
+            record.update(run_case(name, data, arguments.repeat, rows <= arguments.reference_rows))
+            key = (name, rows, incoming_rows, arguments.seed)
+            record['baseline'] = (record.get('digest') == baseline[key]) if key in baseline else None
+            report['cases'].append(record)
+
+            if 'error' in record:
+                print("%-14s %9s %9s   FAILED: %s" % (name, rows, incoming_rows, record['error']))
+                failed = True
+                continue
+            failed = failed or record['reference'] is False or record['baseline'] is False
+            print("%-14s %9s %9s %9.3f %9.3f %9.1f %9.1f %10s %9s %9s" % (
+                name, rows, incoming_rows, record['seconds'], record['cpu_s'], record['peak_rss_mb'], record['extra_rss_mb'], record['output_rows'],
+                {None: '-', True: 'same', False: 'DIFFERS'}[record['reference']], {None: '-', True: 'same', False: 'DIFFERS'}[record['baseline']]))
+        del data
+
+    if arguments.report:
+        with open(arguments.report, 'w', encoding='utf-8') as out:
+            json.dump(report, out, ensure_ascii=False, indent=2)
+        print("\nReport written to %s" % arguments.report)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
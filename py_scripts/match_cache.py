@@ -0,0 +1,99 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/match_cache.py
+#
+# Helper module for geoname_match: an on-disk cache of the candidates found for each incoming row, so that an incoming
+# file edited a few rows at a time can be re-matched by matching only its new or changed rows (see
+# geoname_matcher.Matcher, with the 'incremental' configuration).
+# Each incoming row is fingerprinted by a hash of the contents of its standard 'input_*' fields.  The candidates of
+# every row are stored under their row's hash, in an entry keyed by the fingerprint of the target's contents, the
+# matching options, the incoming fields and the name of the incoming data, so that a changed target or a different
+# choice of options never serves stale results.  Entries are stored in the same uncompressed Feather (Arrow IPC)
+# format, and in the same place, as the cached targets (see target_cache.py).
+# Requires pyarrow; without it, nothing is cached and every row is matched each time.
+# Only non-core libraries used are pandas and numpy
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+import numpy as np
+
+from target_cache import CACHE_DIR, pyarrow, _write_atomically
+
+
+# field holding the hash of the incoming row that each cached candidate was found for
+ROW_HASH_FIELD = '_row_hash'
+
+
+def row_hashes(frame):
+    ''' Function that returns the hash of the contents of each row of the DataFrame, as an array of unsigned 64-bit integers.
+        Numbers are hashed as floats, so that a column read as integers in one run and as floats in the next (e.g. once
+        one of its values goes missing) keeps the hashes of its rows.
+    '''
+    columns = {}
+    for field in frame.columns:
+        values = frame[field]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            values = values.astype(float)
+        columns[field] = values
+    return pd.util.hash_pandas_object(pd.DataFrame(columns, columns=list(frame.columns)), index=False).values
+
+
+def frame_fingerprint(frame):
+    ''' Function that returns the SHA-1 hex digest of the fields and contents of a DataFrame '''
+    digest = hashlib.sha1(json.dumps([str(field) for field in frame.columns]).encode('utf-8'))
+    digest.update(row_hashes(frame).tobytes())
+    return digest.hexdigest()
+
+
+def entry_key(*parts):
+    ''' Function that returns the key of the cache entry for the given parts (anything that can be written as JSON,
+        e.g. the target's fingerprint, the matching options and the incoming fields)
+    '''
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, 'matches_%s.feather' % key[:24])
+
+
+def load_results(key, hashes=None, cache_dir=None):
+    ''' Function that returns the candidates stored in the cache entry 'key' (only those of the rows with the given
+        hashes, if given), or None if there is no such entry
+    '''
+    if pyarrow is None:
+        return None
+    path = _entry_path(key, cache_dir or CACHE_DIR)
+    if not os.path.isfile(path):
+        return None
+    try:
+        frame = pyarrow.feather.read_table(path, memory_map=True).to_pandas()
+    except (OSError, ValueError, pyarrow.ArrowException):
+        return None
+    if hashes is not None:
+        frame = frame[np.isin(frame[ROW_HASH_FIELD].values, hashes)]
+    return frame
+
+
+def store_results(key, frame, cache_dir=None):
+    ''' Function that stores the candidates (with the hashes of their rows in ROW_HASH_FIELD) as the cache entry 'key',
+        replacing any earlier one.  Returns True if they were cached.
+        Candidates that Arrow can't store (e.g. columns mixing numbers and text) are simply not cached.
+    '''
+    if pyarrow is None:
+        return False
+    cache_dir = cache_dir or CACHE_DIR
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # uncompressed, so that the file can be memory-mapped as it is
+        frame = frame.reset_index(drop=True)
+        _write_atomically(_entry_path(key, cache_dir), lambda path: frame.to_feather(path, compression='uncompressed'))
+    except (OSError, ValueError, TypeError, pyarrow.ArrowException) as error:
+        print("Could not cache the match results (%s); every row will be matched next time too." % error)
+        return False
+    return True
@@ -0,0 +1,485 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/match_engine.py
+#
+# The matching stages of geoname_match -- merging by name (or by spatial coordinates), comparing coordinates,
+# administrative types and years, and computing the match strength -- as functions of the (already renamed) target
+# and incoming DataFrames and of a dictionary of the options chosen by the user.
+# Keeping them free of prompts lets the same stages be run on shards of the incoming data in a pool of processes.
+# Only non-core libraries used are pandas and numpy
+
+import multiprocessing
+import os
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from coordinates import to_fixed, to_units, fixed_column, fixed_equal, round_fixed
+from match_index import NgramIndex, KeyIndex, merge_candidates, exact_pairs
+from name_keys import name_keys, key_column
+from parent_index import ParentIndex, ancestor_names, read_part_of
+from spatial_index import GridIndex, KM_PER_DEGREE
+from year_overlap import YearFilter, classify_year_overlap
+from run_profiler import stage
+
+
+# the options understood by the functions below, with their defaults
+DEFAULT_OPTIONS = {
+    'target_name_field': None,      # e.g. 'tgaz_nm_trad' (not needed when name_mode is 'spatial')
+    'incoming_name_field': None,    # e.g. 'input_nm_trad'
+    'name_mode': 'strict',          # 'strict', 'fuzzy', 'multi' or 'spatial'
+    'name_fields': [],              # in multi mode, the (target field, incoming field, name keys) to match on, e.g.
+                                    # [('tgaz_nm_trad', 'input_nm_trad', []), ('tgaz_nm_py', 'input_nm_py', ['pinyin'])]
+    'name_keys': [],                # normalized keys to compare names by instead of as they are, e.g. ['pinyin'] (see name_keys.py)
+    'parent_field': None,           # in strict mode, e.g. 'input_prnt' to only match target rows within a unit of that name
+    'part_of_path': None,           # path of the CHGIS PartOf.csv, to look up the parent units of parent units
+    'top_k': 10,                    # maximum number of candidates per incoming row in fuzzy mode
+    'radius_km': 5.0,               # search radius in spatial mode
+    'year_tolerance': None,         # if not None, only target rows whose years overlap (within this many years) are merged
+    'coords': [],                   # coordinates to compare, e.g. ['x', 'y']
+    'coord_mode': None,             # 'strict' or 'fuzzy'
+    'decimal_place': None,          # number of decimal places to round to in fuzzy coordinate mode
+    'coord_epsilon': 0,             # in strict coordinate mode, the tolerance (in degrees) within which coordinates match
+    'type_key': None,               # 'type_py' or 'type_ch'
+    'compare_years': False,         # whether the incoming data has beginning and ending years to compare
+    'best_k': None,                 # if not None, candidates are scored and ranked, to keep only the best k per incoming record
+    'score_weights': None           # weight of each output field in the score (None for DEFAULT_SCORE_WEIGHTS)
+}
+
+# default weights of the output fields (where present) in the score of a candidate: one point for each matching coordinate,
+# year and type, plus up to one and a half for the share of the name found and containment (in fuzzy mode), minus a
+# fifth of a point per kilometre of distance (in spatial mode)
+DEFAULT_SCORE_WEIGHTS = OrderedDict([
+    ('out_content_match_strength', 1.0),
+    ('out_name_overlap', 1.0),
+    ('out_name_containment', 0.5),
+    ('out_distance_km', -0.2)
+])
+
+# fields kept in the compact file of all candidates, where present
+CANDIDATE_FIELDS = [
+    'input_id', 'input_nm_trad', 'input_nm_simp', 'input_nm_py',
+    'tgaz_sys_id', 'tgaz_nm_trad', 'tgaz_nm_simp', 'tgaz_nm_py', 'tgaz_beg', 'tgaz_end',
+    'match', 'out_match_score', 'out_match_rank'
+]
+
+
+# fields added by the name (or spatial) merge itself, according to its mode
+MERGE_FIELDS = {
+    'strict': [],
+    'fuzzy': ['out_name_containment', 'out_name_overlap'],
+    'multi': ['out_name_fields_matched'],
+    'spatial': ['out_distance_km']
+}
+
+# fields whose values are counted in the summary of a match
+COUNT_FIELDS = [
+    'match',
+    'out_name_containment',
+    'out_name_fields_matched',
+    'out_x_coord_match',
+    'fuzzy_out_x_coord_match',
+    'out_y_coord_match',
+    'fuzzy_out_y_coord_match',
+    'out_beg_match',
+    'out_end_match',
+    'out_year_overlap',
+    'out_type_ch_match',
+    'out_type_py_match',
+    'out_content_match_strength'
+]
+
+
+def match_options(**options):
+    ''' Function that returns a complete options dictionary, filling in the defaults for any option not given '''
+    unknown = set(options) - set(DEFAULT_OPTIONS)
+    if unknown:
+        raise ValueError("Unknown matching option(s): %s" % ', '.join(sorted(unknown)))
+    complete = dict(DEFAULT_OPTIONS)
+    complete.update(options)
+    return complete
+
+
+def build_indexes(target, options, cache=None):
+    ''' Function that builds the indexes over the target needed by the chosen options, to be built once and reused
+        for every (shard of the) incoming data.  Returns a dictionary, empty if strict matching needs no index.
+        If a dictionary 'cache' is given (one per target, e.g. kept by a long-running service), indexes built for earlier
+        options are taken from it rather than rebuilt, and the ones built now are stored in it.
+    '''
+    if cache is None:
+        cache = {}
+
+    def cached(key, build):
+        if key not in cache:
+            with stage('build indexes', len(target.index)):
+                cache[key] = build()
+        return cache[key]
+
+    def target_keys(field, keys):
+        # taking the keys from the target's snapshot where they were stored with it (see field_mapping.default_target_loader())
+        column = key_column(field, keys)
+        return target[column] if column in target.columns else name_keys(target[field], keys)
+
+    indexes = {}
+    field, keys = options['target_name_field'], tuple(options['name_keys'])
+    if options['name_mode'] == 'fuzzy' and keys:
+        indexes['name'] = cached(('name', field, keys), lambda: NgramIndex(target_keys(field, keys)))
+    elif options['name_mode'] == 'fuzzy':
+        indexes['name'] = cached(('name', field), lambda: NgramIndex(target[field]))
+    elif options['name_mode'] == 'strict' and (keys or options['parent_field']):
+        indexes['name'] = cached(('keys', field, keys), lambda: KeyIndex(target_keys(field, keys) if keys else target[field]))
+    elif options['name_mode'] == 'multi':
+        # (names compared as they are get a key index of their own too, so that every field is joined the same way)
+        indexes['names'] = [
+            cached(('keys', field, tuple(keys)), lambda: KeyIndex(target_keys(field, keys) if keys else target[field]))
+            for field, _, keys in options['name_fields']
+        ]
+    elif options['name_mode'] == 'spatial':
+        # cells the size of the radius mean that only the 3 x 3 neighbouring cells need to be searched (more near the poles)
+        cell_degrees = max(options['radius_km'] / KM_PER_DEGREE, 0.0001)
+        indexes['spatial'] = cached(('spatial', cell_degrees), lambda: GridIndex(target['tgaz_x_coord'], target['tgaz_y_coord'], cell_degrees=cell_degrees))
+    if options['name_mode'] == 'strict' and options['parent_field']:
+        # parent names are normalized like names of their script, whatever the keys chosen for the names themselves
+        pinyin = (field == 'tgaz_nm_py')
+        parent_keys = ['pinyin'] if pinyin else ['fold', 'stem']
+        path = options['part_of_path']
+        indexes['parents'] = cached(('parents', field, keys, path), lambda: ParentIndex(
+            target[field], ancestor_names(target, read_part_of(path) if path else None, pinyin), keys, parent_keys))
+    if options['year_tolerance'] is not None:
+        indexes['years'] = cached(('years',), lambda: YearFilter(target['tgaz_beg'], target['tgaz_end']))
+    return indexes
+
+
+def merge_names(target, incoming, options, indexes=None):
+    ''' Function that merges the target and incoming DataFrames by name (or by spatial coordinates), according to the
+        options, returning a DataFrame with one row per candidate pair plus one row per unmatched incoming row.
+        The 'match' field indicates which is which ('found'/'not_found').
+    '''
+    if indexes is None:
+        indexes = build_indexes(target, options)
+    mode = options['name_mode']
+    year_tolerance = options['year_tolerance']
+
+    def year_blocker(pairs):
+        # dropping the candidate pairs whose years don't overlap, if target rows are to be restricted by year
+        if year_tolerance is None:
+            return pairs
+        return indexes['years'].block(pairs, incoming['input_year_beg'], incoming['input_year_end'], year_tolerance)
+
+    if mode == 'strict' and options['parent_field']:
+        pairs = year_blocker(parent_pairs(incoming, options, indexes))
+        df = merge_candidates(target, incoming, pairs)
+    elif mode == 'strict' and options['name_keys']:
+        pairs = year_blocker(indexes['name'].pairs(name_keys(incoming[options['incoming_name_field']], options['name_keys'])))
+        df = merge_candidates(target, incoming, pairs)
+    elif mode == 'strict':
+        if year_tolerance is None:
+            df = target.merge(incoming, how='outer', left_on=options['target_name_field'], right_on=options['incoming_name_field'], indicator=True)
+        else:
+            pairs = year_blocker(exact_pairs(target[options['target_name_field']], incoming[options['incoming_name_field']]))
+            df = merge_candidates(target, incoming, pairs)
+    elif mode == 'fuzzy':
+        names = incoming[options['incoming_name_field']]
+        if options['name_keys']:
+            names = name_keys(names, options['name_keys'])
+        if year_tolerance is None:
+            pairs = indexes['name'].match(names, top_k=options['top_k'])
+        else:
+            # candidates from other periods are dropped first, so that they don't take up places in the top-k
+            pairs = year_blocker(indexes['name'].match(names, top_k=None))
+            pairs = pairs.groupby('incoming_pos', sort=False).head(options['top_k']).reset_index(drop=True)
+        df = merge_candidates(target, incoming, pairs)
+    elif mode == 'multi':
+        pairs = year_blocker(multi_field_pairs(incoming, options, indexes['names']))
+        df = merge_candidates(target, incoming, pairs)
+        # (0 for incoming rows that found nothing)
+        df['out_name_fields_matched'] = df['out_name_fields_matched'].fillna(0).astype(int)
+    elif mode == 'spatial':
+        pairs = year_blocker(indexes['spatial'].within(incoming['input_x_coord'], incoming['input_y_coord'], options['radius_km']))
+        df = merge_candidates(target, incoming, pairs)
+    else:
+        raise ValueError("Unknown name match mode: %s" % mode)
+
+    # removing rows that are only present in the CHGIS file
+    df = df[df['_merge'] != 'left_only']
+
+    # renaming merge indicators for legibility (kept as a categorical, as there are only the two values)
+    df['_merge'] = df['_merge'].astype(str).replace({'both': 'found', 'right_only': 'not_found'}).astype('category')
+    df.rename(columns={'_merge': 'match'}, inplace=True)
+    return df
+
+
+def parent_pairs(incoming, options, indexes):
+    ''' Function that returns the candidate pairs of a strict match blocked by parent units: the target rows with the
+        incoming row's name lying within a unit with its parent's name (see parent_index.ParentIndex), or, for incoming
+        rows without a parent, every target row with their name.  Ordered by incoming row and then target row.
+    '''
+    names = incoming[options['incoming_name_field']]
+    if options['name_keys']:
+        names = name_keys(names, options['name_keys'])
+    names = np.asarray(names, dtype=object)
+    parents = incoming[options['parent_field']]
+
+    orphans = parents.isnull().values
+    pairs = pd.concat([
+        indexes['parents'].pairs(names, parents),
+        indexes['name'].pairs(np.where(orphans, names, None))
+    ], ignore_index=True)
+    return pairs.sort_values(['incoming_pos', 'target_pos'], kind='mergesort').reset_index(drop=True)
+
+
+def multi_field_pairs(incoming, options, name_indexes):
+    ''' Function that joins each of the name fields of a multi-mode match against its key index, returning the candidate
+        pairs found by any of them once only (ordered by incoming row and then target row), with the bitmask of the
+        fields that found them in 'out_name_fields_matched': 1 for the first field in options['name_fields'], 2 for the
+        second, 4 for the third...
+    '''
+    pairs = []
+    for bit, (index, (_, incoming_field, keys)) in enumerate(zip(name_indexes, options['name_fields'])):
+        names = incoming[incoming_field]
+        found = index.pairs(name_keys(names, keys) if keys else names)
+        found['out_name_fields_matched'] = 1 << bit
+        pairs.append(found)
+    pairs = pd.concat(pairs, ignore_index=True)
+    # (each field finds a pair at most once, so summing the bits of a pair is the same as OR-ing them)
+    pairs = pairs.groupby(['incoming_pos', 'target_pos'], sort=True)['out_name_fields_matched'].sum().reset_index()
+    return pairs[['target_pos', 'incoming_pos', 'out_name_fields_matched']]
+
+
+def name_fields_legend(options):
+    ''' Function that returns the meaning of each bit of 'out_name_fields_matched' in a multi-mode match, as a string
+        (e.g. '1 = nm_trad, 2 = nm_simp, 4 = nm_py (pinyin)')
+    '''
+    return ', '.join(
+        '%s = %s%s' % (1 << bit, target_field.replace('tgaz_', ''), ' (%s)' % ', '.join(keys) if keys else '')
+        for bit, (target_field, _, keys) in enumerate(options['name_fields'])
+    )
+
+
+def compare_coordinates(df, options):
+    ''' Function that performs a strict or fuzzy matching of spatial coordinates, adding the results to the DataFrame in-place.
+        Returns the list of fields added.
+    '''
+    fields = []
+    if not options['coords']:
+        return fields
+
+    # converting the coordinates' values to a numeric, or NaN, for the output
+    for coord in options['coords']:
+        for field in ['input_%s_coord' % coord, 'tgaz_%s_coord' % coord]:
+            df[field] = pd.to_numeric(df[field], errors='coerce')
+
+    # comparing them as fixed-point integers (see coordinates.py), those of the target being taken from its snapshot
+    # where already computed (see field_mapping.default_target_loader())
+    epsilon = to_units(options.get('coord_epsilon'))
+    for coord in options['coords']:
+        incoming = to_fixed(df['input_%s_coord' % coord])
+        target_field = fixed_column('tgaz_%s_coord' % coord)
+        target = df[target_field] if target_field in df.columns else to_fixed(df['tgaz_%s_coord' % coord])
+        if options['coord_mode'] == 'strict':
+            df['out_%s_coord_match' % coord] = fixed_equal(incoming, target, epsilon)
+            fields += ['out_%s_coord_match' % coord]
+        else:
+            decimal_place = int(options['decimal_place'] or 0)
+            df['fuzzy_out_%s_coord_match' % coord] = fixed_equal(round_fixed(incoming, decimal_place), round_fixed(target, decimal_place))
+            fields += ['fuzzy_out_%s_coord_match' % coord]
+    return fields
+
+
+def compare_types(df, options):
+    ''' Function that matches the administrative type on the chosen key, adding the result to the DataFrame in-place.
+        Returns the list of fields added.
+    '''
+    if not options['type_key']:
+        return []
+    field = 'out_%s_match' % options['type_key']
+    df[field] = df['tgaz_%s' % options['type_key']] == df['input_%s' % options['type_key']]
+    return [field]
+
+
+def compare_years(df, options):
+    ''' Function that compares the beginning and ending years of the incoming and target rows, adding the results to the
+        DataFrame in-place.  Returns the list of fields added.
+    '''
+    if not options['compare_years']:
+        return []
+
+    # converting to numbers (invalid years become 'NaN', and pandas.isnull(<Series_(column)>) returns True for those values);
+    # the target's years may already be nullable integers (see chgis_schema.py), which are left as they are
+    for year_field in ['input_year_beg', 'input_year_end', 'tgaz_beg', 'tgaz_end']:
+        df[year_field] = pd.to_numeric(df[year_field], errors='coerce')
+
+    # in-row match testing (comparisons with a missing nullable integer are missing rather than False, hence the fillna())
+    df['out_beg_match'] = (df['input_year_beg'] == df['tgaz_beg']).fillna(False).astype(bool)
+    df['out_end_match'] = (df['input_year_end'] == df['tgaz_end']).fillna(False).astype(bool)
+
+    # testing for timespan relationships (incl. items with non-numeric text values in at least one year field, which therefore break the overlap checker)
+    df['out_year_overlap'] = classify_year_overlap(df['input_year_beg'], df['input_year_end'], df['tgaz_beg'], df['tgaz_end'], found=(df['match'] == 'found'))
+    return ['out_beg_match', 'out_end_match', 'out_year_overlap']
+
+
+def match_strength(df, options):
+    ''' Function that adds the 'out_content_match_strength' field, leveraging the fact that Python True and False evaluate
+        to 1 and 0 respectively when passed to int().  Returns the list of fields added.
+    '''
+    df['out_content_match_strength'] = 0
+
+    for coord in options['coords']:
+        if options['coord_mode'] == 'strict':
+            df['out_content_match_strength'] += df['out_%s_coord_match' % coord].astype(int)
+        else:
+            df['out_content_match_strength'] += df['fuzzy_out_%s_coord_match' % coord].astype(int)
+
+    for field in ['out_beg_match', 'out_end_match', 'out_type_ch_match', 'out_type_py_match']:
+        if field in list(df.columns):
+            df['out_content_match_strength'] += df[field].astype(int)
+    return ['out_content_match_strength']
+
+
+def rank_candidates(df, options):
+    ''' Function that scores every candidate as the weighted sum of its output fields (see DEFAULT_SCORE_WEIGHTS), and
+        ranks the candidates of each incoming record by score, best first, adding the 'out_match_score' and
+        'out_match_rank' fields in-place.  Incoming records are told apart by their 'input_id' where there is one, or
+        else by all of their fields; ties keep the candidates' order.  Returns the list of fields added.
+    '''
+    weights = options['score_weights'] or DEFAULT_SCORE_WEIGHTS
+    score = np.zeros(len(df.index))
+    for field, weight in weights.items():
+        if field in df.columns:
+            score += weight * pd.to_numeric(df[field], errors='coerce').fillna(0).astype(float).values
+    found = (df['match'] == 'found').values
+    df['out_match_score'] = np.where(found, score.round(3), np.nan)
+
+    if 'input_id' in df.columns and df['input_id'].notnull().all():
+        records = pd.factorize(df['input_id'])[0]
+    else:
+        records = df.groupby([field for field in df.columns if field.startswith('input_')], sort=False, dropna=False).ngroup().values
+
+    # ordering the rows by record, then best score first, then their current order, and numbering them within each record
+    rows = np.arange(len(df.index))
+    order = np.lexsort((rows, -np.where(found, score, 0), records))
+    first = np.r_[True, records[order][1:] != records[order][:-1]]
+    rank = np.empty(len(rows), dtype=np.int64)
+    rank[order] = rows - np.maximum.accumulate(np.where(first, rows, 0)) + 1
+    df['out_match_rank'] = rank
+    return ['out_match_score', 'out_match_rank']
+
+
+def best_candidates(df, options):
+    ''' Function that keeps only the best options['best_k'] candidates of each incoming record (see rank_candidates()) '''
+    return df[df['out_match_rank'] <= options['best_k']]
+
+
+def match_frames(target, incoming, options, indexes=None):
+    ''' Function that runs all of the matching stages on the target and incoming DataFrames.
+        Returns the matched DataFrame and the list of the 'out_*' fields added by the comparisons, in output order.
+    '''
+    with stage('merge', len(incoming.index)) as counts:
+        df = merge_names(target, incoming, options, indexes)
+        counts['rows_out'] = len(df.index)
+    output_fields = []
+    steps = [('compare coordinates', compare_coordinates), ('compare types', compare_types), ('compare years', compare_years),
+             ('match strength', match_strength)]
+    if options['best_k'] is not None:
+        steps.append(('rank candidates', rank_candidates))
+    for name, step in steps:
+        with stage(name, len(df.index)):
+            output_fields += step(df, options)
+    return df, output_fields
+
+
+def sort_output(df, target_fields, incoming_fields, options, output_fields):
+    ''' Function that puts the fields of the matched DataFrame into their standard order (the target's and incoming data's
+        fields, then 'match', the fields added by the name merge and those added by the comparisons), and replaces 'nan'
+        with '' for improved legibility
+    '''
+    df = df[target_fields + incoming_fields + ['match'] + MERGE_FIELDS[options['name_mode']] + output_fields]
+    return df.replace('nan', '')
+
+
+def count_values(df, fields, counts=None):
+    ''' Function that adds the frequency counts of the values of the given fields (those present in the DataFrame) to 'counts',
+        an ordered dictionary of pandas Series as returned by value_counts(), so that counts can be accumulated chunk by chunk.
+        Returns the updated dictionary (a new one if 'counts' is None).
+    '''
+    if counts is None:
+        counts = OrderedDict()
+    for field in fields:
+        if field not in df.columns:
+            continue
+        field_counts = df[field].value_counts()
+        # (categoricals, such as 'out_year_overlap', count every category: only the values found are kept)
+        field_counts = field_counts[field_counts > 0]
+        if field in counts:
+            field_counts = counts[field].add(field_counts, fill_value=0).astype(int).sort_values(ascending=False, kind='mergesort')
+        counts[field] = field_counts
+    return counts
+
+
+### parallel matching
+# The incoming rows are hash-partitioned on their name, so that repeated names land in the same shard (in spatial and
+# multi mode, they are split into contiguous ranges instead).  In strict mode the target rows are partitioned on the
+# same hash, and each shard pair is merged on its own; in the other modes, and when names are compared by their keys
+# or blocked by parent units, the whole target (with its indexes, built once) is handed to every worker process when it starts.
+
+# target and indexes shared by the shards of the current parallel run (set in each worker process)
+_shared = {}
+
+
+def _shard_numbers(values, shards):
+    ''' Returns the shard number of each value, from a hash that (unlike Python's hash()) is the same in every process '''
+    return pd.util.hash_array(np.asarray(pd.Series(values).astype(str), dtype=object)) % shards
+
+
+def _init_worker(target, indexes, options):
+    _shared['target'] = target
+    _shared['indexes'] = indexes
+    _shared['options'] = options
+
+
+def _match_shard(shard):
+    target_shard, incoming_shard = shard
+    if target_shard is None:
+        return match_frames(_shared['target'], incoming_shard, _shared['options'], _shared['indexes'])
+    return match_frames(target_shard, incoming_shard, _shared['options'])
+
+
+def match_in_parallel(target, incoming, options, processes=None, indexes=None):
+    ''' Function that runs match_frames() on hash-partitioned shards of the data in a pool of processes, and concatenates
+        the shards' results in shard order, so that the output is the same from run to run.
+        Requires the 'fork' start method (i.e. not Windows), since geoname_match runs its prompts at import time;
+        where that isn't available, or with a single process, the data is matched in the current process.
+    '''
+    processes = processes or os.cpu_count() or 1
+    if processes < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+        return match_frames(target, incoming, options, indexes)
+
+    # several shards per process, so that an unlucky large shard doesn't hold up the whole run
+    shards = processes * 4
+    if options['name_mode'] in ('spatial', 'multi'):
+        incoming_shards = np.arange(len(incoming.index)) * shards // max(len(incoming.index), 1)
+    else:
+        incoming_shards = _shard_numbers(incoming[options['incoming_name_field']], shards)
+
+    if options['name_mode'] == 'strict' and not options['name_keys'] and not options['parent_field']:
+        target_shards = _shard_numbers(target[options['target_name_field']], shards)
+        tasks = [(target[target_shards == shard], incoming[incoming_shards == shard]) for shard in range(shards)]
+        shared_target, shared_indexes = None, None
+    else:
+        tasks = [(None, incoming[incoming_shards == shard]) for shard in range(shards)]
+        shared_target, shared_indexes = target, (indexes if indexes is not None else build_indexes(target, options))
+
+    pool = multiprocessing.get_context('fork').Pool(processes, initializer=_init_worker, initargs=(shared_target, shared_indexes, options))
+    try:
+        results = pool.map(_match_shard, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    df = pd.concat([result[0] for result in results], ignore_index=True)
+    if 'out_year_overlap' in df.columns:
+        df['out_year_overlap'] = pd.Categorical(df['out_year_overlap'], categories=results[0][0]['out_year_overlap'].cat.categories)
+    return df, results[0][1]
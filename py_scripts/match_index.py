@@ -0,0 +1,203 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/match_index.py
+#
+# Helper module for geoname_match: indexes built once over the TARGET (e.g. CHGIS) name columns, so that candidate
+# pairs can be generated without a many-to-many merge on a shared prefix.
+# Candidate pairs are passed around as a DataFrame of integer row positions ('target_pos', 'incoming_pos') plus any
+# per-pair score columns, and are turned back into an outer-merge-like frame by merge_candidates()
+# Only non-core libraries used are pandas and numpy
+
+import pandas as pd
+import numpy as np
+
+
+# markers padded onto each name so that the first and last characters also form n-grams of their own
+# (e.g. '張掖' -> '^張', '張掖', '掖$'), which lets one-character names find candidates too
+NAME_START = '^'
+NAME_END = '$'
+
+
+def name_grams(name, n=2):
+    ''' Function that returns the set of character n-grams of a name, padded with start/end markers.
+        Names too short to yield a full n-gram are returned whole (padded) as their only gram.
+    '''
+    padded = '%s%s%s' % (NAME_START, name, NAME_END)
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+def _is_blank(name):
+    ''' Returns True for missing values and the empty/'nan' strings pandas leaves behind '''
+    return pd.isnull(name) or str(name) in ('', 'nan')
+
+
+class NgramIndex(object):
+    ''' Character n-gram inverted index over a column of (Chinese) names, built once over the TARGET file.
+        Each n-gram maps to a sorted numpy array of the row positions whose name contains it, so that looking up an
+        incoming name only touches the rows sharing at least one n-gram with it.
+        Candidates are scored by the share of the incoming name's n-grams found in the target name ('overlap'),
+        and flagged if either name contains the other ('containment', e.g. '張掖' in '張掖居延屬國').
+    '''
+
+    def __init__(self, names, n=2, max_postings=5000):
+        # 'max_postings' sets the size above which an n-gram is considered too common (e.g. '縣$') to generate
+        # candidates on its own; such n-grams are still counted towards the overlap of candidates found otherwise
+        self.n = n
+        self.max_postings = max_postings
+        self.names = [None if _is_blank(name) else str(name) for name in names]
+
+        postings = {}
+        for position, name in enumerate(self.names):
+            if name is None:
+                continue
+            for gram in name_grams(name, n):
+                postings.setdefault(gram, []).append(position)
+        self.postings = {gram: np.array(positions, dtype=np.int64) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, name, top_k=10, min_overlap=0.5):
+        ''' Function that returns the candidates for a single name as a list of (position, containment, overlap) tuples,
+            best first: containment matches, then higher overlap, then closer name length, then target order.
+            Candidates that neither contain/are contained in the name nor reach 'min_overlap' are dropped.
+            If 'top_k' is None, all remaining candidates are returned.
+        '''
+        if _is_blank(name):
+            return []
+        name = str(name)
+        grams = name_grams(name, self.n)
+        present = sorted((gram for gram in grams if gram in self.postings), key=lambda gram: len(self.postings[gram]))
+        if not present:
+            return []
+
+        # only the selective n-grams generate candidates; the common ones are merely counted (via binary search)
+        selective = [gram for gram in present if len(self.postings[gram]) <= self.max_postings] or present[:1]
+        common = present[len(selective):]
+
+        positions, counts = np.unique(np.concatenate([self.postings[gram] for gram in selective]), return_counts=True)
+        for gram in common:
+            posting = self.postings[gram]
+            found = np.searchsorted(posting, positions)
+            found[found == len(posting)] = 0
+            counts += (posting[found] == positions)
+
+        overlaps = counts / float(len(grams))
+        candidates = []
+        for position, overlap in zip(positions.tolist(), overlaps.tolist()):
+            other = self.names[position]
+            contained = (name in other) or (other in name)
+            if contained or overlap >= min_overlap:
+                candidates.append((position, contained, overlap, abs(len(other) - len(name))))
+
+        candidates.sort(key=lambda item: (not item[1], -item[2], item[3], item[0]))
+        if top_k is not None:
+            candidates = candidates[:top_k]
+        return [(position, contained, overlap) for position, contained, overlap, _ in candidates]
+
+    def match(self, names, top_k=10, min_overlap=0.5):
+        ''' Function that looks up every name of an incoming column, returning the candidate pairs as a DataFrame with
+            the fields 'target_pos', 'incoming_pos', 'out_name_containment' and 'out_name_overlap'.
+            Repeated incoming names are only looked up once.
+        '''
+        cache = {}
+        target_pos, incoming_pos, containment, overlap = [], [], [], []
+        for position, name in enumerate(names):
+            key = None if _is_blank(name) else str(name)
+            if key not in cache:
+                cache[key] = self.lookup(key, top_k=top_k, min_overlap=min_overlap)
+            for candidate, contained, score in cache[key]:
+                target_pos.append(candidate)
+                incoming_pos.append(position)
+                containment.append(contained)
+                overlap.append(score)
+
+        return pd.DataFrame({
+            'target_pos': np.array(target_pos, dtype=np.int64),
+            'incoming_pos': np.array(incoming_pos, dtype=np.int64),
+            'out_name_containment': np.array(containment, dtype=bool),
+            'out_name_overlap': np.array(overlap, dtype=float).round(3)
+        }, columns=['target_pos', 'incoming_pos', 'out_name_containment', 'out_name_overlap'])
+
+
+def merge_candidates(target, incoming, pairs):
+    ''' Function that turns candidate pairs (as generated by one of the indexes in this module) into a DataFrame laid out
+        like the result of target.merge(incoming, how='outer', indicator=True), minus the 'left_only' target rows:
+        one row per candidate pair ('_merge' == 'both'), plus one row for every incoming row without any candidate
+        ('_merge' == 'right_only').  Any extra fields in 'pairs' (e.g. scores) are carried over into the result.
+        Rows are ordered by incoming row, keeping the order of the candidates within each incoming row.
+    '''
+    extra_fields = [field for field in pairs.columns if field not in ('target_pos', 'incoming_pos')]
+
+    found = pd.concat([
+        target.iloc[pairs['target_pos'].values].reset_index(drop=True),
+        incoming.iloc[pairs['incoming_pos'].values].reset_index(drop=True),
+        pairs[extra_fields].reset_index(drop=True)
+    ], axis=1)
+    found['_merge'] = 'both'
+    found['_incoming_pos'] = pairs['incoming_pos'].values
+
+    unmatched_pos = np.setdiff1d(np.arange(len(incoming.index)), pairs['incoming_pos'].values)
+    not_found = incoming.iloc[unmatched_pos].reset_index(drop=True)
+    not_found['_merge'] = 'right_only'
+    not_found['_incoming_pos'] = unmatched_pos
+
+    df = pd.concat([found, not_found], ignore_index=True)
+    df = df.sort_values('_incoming_pos', kind='mergesort').reset_index(drop=True)
+    del df['_incoming_pos']
+    return df[list(target.columns) + [field for field in incoming.columns if field not in target.columns] + extra_fields + ['_merge']]
+
+
+def exact_pairs(target_keys, incoming_keys):
+    ''' Function that hash-joins two key columns (e.g. target and incoming names), returning the candidate pairs of row
+        positions whose keys are equal, ordered by incoming row and then target row.
+        Only the keys are joined, so that candidate pairs can be filtered before any full rows are merged.
+        Unlike pandas' merge, missing (NaN) keys never match one another.
+    '''
+    target = pd.DataFrame({'key': np.asarray(target_keys, dtype=object), 'target_pos': np.arange(len(target_keys))})
+    incoming = pd.DataFrame({'key': np.asarray(incoming_keys, dtype=object), 'incoming_pos': np.arange(len(incoming_keys))})
+    target = target[target['key'].notnull()]
+    incoming = incoming[incoming['key'].notnull()]
+
+    pairs = incoming.merge(target, on='key', how='inner')
+    pairs = pairs.sort_values(['incoming_pos', 'target_pos'], kind='mergesort')
+    return pairs[['target_pos', 'incoming_pos']].reset_index(drop=True)
+
+
+class KeyIndex(object):
+    ''' Hash index over a column of target keys (e.g. normalized names, see name_keys.py), built once over the TARGET
+        file.  The target row positions are kept grouped by key, so that joining the incoming keys against it only
+        hashes the incoming keys, and expands each into the run of target rows sharing it.
+        Missing (NaN) keys never match.
+    '''
+
+    def __init__(self, keys):
+        codes, uniques = pd.factorize(np.asarray(keys, dtype=object))
+        self.keys = pd.Index(uniques)
+        present = np.flatnonzero(codes >= 0)
+        # row positions sorted by key, keeping target order within each key
+        self.positions = present[np.argsort(codes[present], kind='mergesort')].astype(np.int64)
+        self.counts = np.bincount(codes[present], minlength=len(self.keys))
+        self.starts = np.cumsum(self.counts) - self.counts
+
+    def __len__(self):
+        return len(self.positions)
+
+    def pairs(self, keys):
+        ''' Function that returns the candidate pairs of row positions whose keys are equal, ordered by incoming row
+            and then target row, like exact_pairs()
+        '''
+        codes = self.keys.get_indexer(np.asarray(keys, dtype=object))
+        queries = np.flatnonzero(codes >= 0)
+        starts = self.starts[codes[queries]]
+        counts = self.counts[codes[queries]]
+        # expanding each incoming key's [start, start + count) run of target positions into single rows
+        run_starts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        return pd.DataFrame({
+            'target_pos': self.positions[run_starts + np.arange(counts.sum())],
+            'incoming_pos': np.repeat(queries, counts).astype(np.int64)
+        }, columns=['target_pos', 'incoming_pos'])
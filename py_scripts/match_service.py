@@ -0,0 +1,199 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/match_service.py
+#
+# A long-running local service for geoname_match: the CHGIS target(s) are loaded (with the default mapping of CHGIS
+# v5/v6 fields), renamed and indexed once, after which any number of match jobs can be sent over HTTP, each of them
+# taking only as long as the match itself rather than a cold start of the script and its prompts.
+#
+# Usage:
+#   python3 match_service.py --target v5=/path/to/v5_augment_2016-08-09.csv [--target v6=...] [--port 8765]
+#
+# The service only listens on localhost.  It answers:
+#   GET  /targets   the loaded targets, with their fields and numbers of rows
+#   POST /match     a match job, given as a JSON object with the keys:
+#       'target'         name of a loaded target (may be left out if only one is loaded)
+#       'incoming_path'  path of an incoming .csv file, or
+#       'rows'           the incoming rows themselves, as a list of objects
+#       'mapping'        object mapping incoming fields onto the standard 'input_*' fields (fields already named
+#                        'input_*' need no mapping), e.g. {"县名": "input_nm_trad", "BEG": "input_year_beg"}
+#       'options'        matching options, as understood by match_engine.match_options(); those the prompts of
+#                        geoname_match would infer from the available fields (name fields, coordinates, type key,
+#                        year comparison) are filled in the same way when left out
+#       'processes'      number of processes to spread the match over (default 1)
+#       'output_path'    if given, the results are written to <output_path>.csv instead of being sent back
+#       'candidates_path' with the 'best_k' option, if given, every candidate (not only the best) is listed in the
+#                        compact file <candidates_path>.csv
+#       'profile'        if true, the reply includes the timings of the stages of the match (see run_profiler.py)
+#       'incremental'    if true, only the incoming rows that are new or have changed since an earlier job on the same
+#                        'incoming_path' (or, for 'rows', an earlier job also sending rows) are matched, the candidates of
+#                        the others being taken from the cache of results (see match_cache.py)
+#   Every reply is a JSON object; failed jobs get a 400 reply with an 'error' key.
+#
+# Only non-core library used is pandas
+
+import argparse
+import json
+import os.path
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pandas as pd
+
+from geoname_matcher import Matcher
+from run_profiler import stage
+import run_profiler
+
+
+class MatchService(object):
+    ''' The loaded targets, each a geoname_matcher.Matcher keeping the indexes built over it, and the running of match
+        jobs against them.  Indexes are built the first time a job needs them (see match_engine.build_indexes()) and kept
+        for later jobs.
+    '''
+
+    def __init__(self):
+        self.targets = OrderedDict()
+
+    def add_target(self, name, path, warm=True):
+        ''' Function that loads a CHGIS v5/v6 .csv file (see field_mapping.default_target_loader()) as the target 'name'.
+            If 'warm' is True, the name indexes over all of its name fields are built right away (see Matcher.warm()).
+        '''
+        matcher = Matcher.from_path(path)
+        self.targets[name] = {'path': path, 'matcher': matcher}
+        if warm:
+            matcher.warm()
+
+    def describe(self):
+        ''' Function that returns a JSON-ready description of the loaded targets '''
+        return {
+            'targets': [
+                {'name': name, 'path': target['path'], 'rows': len(target['matcher'].target.index), 'fields': list(target['matcher'].target.columns)}
+                for name, target in self.targets.items()
+            ]
+        }
+
+    def run(self, job):
+        ''' Function that runs a match job (see the description at the top of this module), returning the JSON-ready reply '''
+        profiler = run_profiler.start() if job.get('profile') else None
+        try:
+            reply = self._run(job)
+        finally:
+            if profiler is not None:
+                run_profiler.stop()
+        if profiler is not None:
+            reply['profile'] = profiler.report()
+        return reply
+
+    def _run(self, job):
+        started = time.time()
+        names = list(self.targets)
+        name = job.get('target', names[0] if len(names) == 1 else None)
+        if name not in self.targets:
+            raise ValueError("Unknown target: %s (loaded: %s)" % (name, ', '.join(names)))
+
+        with stage('read incoming') as counts:
+            if 'incoming_path' in job:
+                incoming = pd.read_csv(job['incoming_path'], low_memory=False)
+            elif 'rows' in job:
+                incoming = pd.DataFrame(job['rows'])
+            else:
+                raise ValueError("A job needs either 'incoming_path' or 'rows'")
+            counts['rows_out'] = len(incoming.index)
+
+        result = self.targets[name]['matcher'].match(incoming, {
+            'mapping': job.get('mapping'),
+            'options': job.get('options'),
+            'processes': int(job.get('processes') or 1),
+            'candidates': bool(job.get('candidates_path')),
+            'incremental': bool(job.get('incremental'))
+        }, name=os.path.abspath(job['incoming_path']) if 'incoming_path' in job else None)
+        df = result['frame']
+        if result['candidates'] is not None:
+            result['candidates'].to_csv('%s.csv' % job['candidates_path'], index=False)
+
+        reply = OrderedDict([
+            ('target', name),
+            ('incoming_rows', result['incoming_rows']),
+            ('output_rows', result['output_rows']),
+            ('rematched_rows', result['rematched_rows']),
+            ('counts', OrderedDict([(field, OrderedDict([(str(value), int(count)) for value, count in field_counts.items()]))
+                                    for field, field_counts in result['counts'].items()]))
+        ])
+        if job.get('output_path'):
+            df.to_csv('%s.csv' % job['output_path'], index=False)
+            reply['output_file'] = '%s.csv' % job['output_path']
+        else:
+            reply['fields'] = list(df.columns)
+            reply['rows'] = json.loads(df.to_json(orient='records', force_ascii=False))
+        reply['seconds'] = round(time.time() - started, 3)
+        return reply
+
+
+class MatchRequestHandler(BaseHTTPRequestHandler):
+    ''' HTTP front end of the MatchService attached to the server as 'server.service' '''
+
+    def _reply(self, status, body):
+        content = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        if self.path == '/targets':
+            self._reply(200, self.server.service.describe())
+        else:
+            self._reply(404, {'error': 'Unknown path: %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/match':
+            self._reply(404, {'error': 'Unknown path: %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            job = json.loads(self.rfile.read(length).decode('utf-8'))
+            reply = self.server.service.run(job)
+        except (ValueError, KeyError, TypeError, OSError) as error:
+            self._reply(400, {'error': '%s: %s' % (type(error).__name__, error)})
+        else:
+            self._reply(200, reply)
+
+
+def serve(service, port=8765, host='127.0.0.1'):
+    ''' Function that serves match jobs for the given MatchService until interrupted.
+        Jobs are run one at a time, in the order they arrive.
+    '''
+    server = HTTPServer((host, port), MatchRequestHandler)
+    server.service = service
+    print("Serving matches against %s on http://%s:%s/ -- press Ctrl-C to stop." % (', '.join(service.targets), host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local service matching incoming place names against warm CHGIS targets.")
+    parser.add_argument('--target', action='append', required=True, metavar='NAME=PATH',
+                        help="a CHGIS v5/v6 .csv file to load under the given name (may be repeated)")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--cold', action='store_true', help="build the name indexes on the first job that needs them rather than at startup")
+    arguments = parser.parse_args()
+
+    service = MatchService()
+    for item in arguments.target:
+        name, _, path = item.rpartition('=')
+        name = name or os.path.splitext(os.path.basename(path))[0]
+        print("Loading %s as '%s'..." % (path, name))
+        service.add_target(name, path, warm=not arguments.cold)
+    serve(service, arguments.port)
+
+
+if __name__ == '__main__':
+    main()
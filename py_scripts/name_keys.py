@@ -0,0 +1,300 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/name_keys.py
+#
+# Helper module for geoname_match: normalized keys computed from name columns, so that names differing only in ways
+# that don't matter for matching (administrative suffixes, tone marks, punctuation, romanization...) share a key,
+# and can be matched by a hash join on the keys rather than by comparing the full strings pair by pair.
+# Every key function works on a whole column at once, normalizing each distinct name only once.
+# Only non-core libraries used are pandas and numpy
+
+import re
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+
+def _distinct(names, normalize):
+    ''' Applies 'normalize' (a function of a Series of strings) to the distinct non-missing values of a column only,
+        and maps the results back onto every row.  Returns a Series of keys, with missing values (NaN) where a name is
+        missing or normalizes to nothing.
+    '''
+    names = pd.Series(names)
+    codes, uniques = pd.factorize(names.astype(object).where(names.notnull(), None))
+    keys = normalize(pd.Series(np.asarray(uniques, dtype=object), dtype=object).astype(str))
+    keys = np.asarray(keys.where(keys != ''), dtype=object)
+    result = np.full(len(codes), np.nan, dtype=object)
+    found = codes >= 0
+    result[found] = keys[codes[found]]
+    return pd.Series(result, index=names.index, dtype=object)
+
+
+### pinyin keys
+
+# administrative types (as written in pinyin in the CHGIS 'type_py' field) dropped from the end of a name when written
+# as a word of their own, e.g. 'Quyang Xian' -> 'Quyang' (but not 'Anlu' -> 'An')
+PINYIN_SUFFIXES = [
+    'xian', 'zhou', 'jun', 'lu', 'fu', 'guo', 'houguo', 'wangguo', 'ting', 'zhiliting', 'zhilizhou', 'wei', 'suo',
+    'qianhusuo', 'zhen', 'dao', 'sheng', 'xingsheng', 'jian', 'meng', 'bu', 'qi', 'zhai', 'si', 'tusi', 'anfusi',
+    'xuanfusi', 'xuanweisi', 'zhaotaosi', 'zhangguansi', 'jiedushi', 'duhufu', 'dudufu', 'wanhufu', 'junminfu', 'dusi',
+    'xingdusi'
+]
+_PINYIN_SUFFIX = re.compile(r'^(.+?)[\s\-]+(?:%s)$' % '|'.join(sorted(PINYIN_SUFFIXES, key=len, reverse=True)))
+
+# spellings found in Wade-Giles romanization but never in pinyin: aspiration marks, hs-, ts-/tz-, and the finals
+# -ih, -ieh, -ien, -ung, -erh and chü
+_WADE_GILES = re.compile(r"(?:ch|ts|tz|[kpt])'|\bhs|\bts|\btz|\bszu\b|\bssu\b|ih\b|ieh\b|ien\b|ung\b|\berh\b|chü")
+
+# Wade-Giles initials and their pinyin equivalents, longest first; 'zh' and 'ch' become 'j' and 'q' before i and ü
+_WG_INITIALS = [
+    ("ch'", 'ch'), ("ts'", 'c'), ("tz'", 'c'), ("k'", 'k'), ("p'", 'p'), ("t'", 't'),
+    ('ch', 'zh'), ('hs', 'x'), ('sh', 'sh'), ('ts', 'z'), ('tz', 'z'), ('k', 'g'), ('p', 'b'), ('t', 'd'), ('j', 'r')
+]
+
+# Wade-Giles finals that are spelled differently in pinyin
+_WG_FINALS = [('ieh', 'ie'), ('üeh', 'üe'), ('ueh', 'ue'), ('ien', 'ian'), ('iung', 'iong'), ('ung', 'ong'), ('uei', 'ui'), ('ih', 'i')]
+
+# whole Wade-Giles syllables that don't follow the rules above
+_WG_SYLLABLES = {
+    'szu': 'si', 'ssu': 'si', 'ssŭ': 'si', 'tzu': 'zi', 'tzŭ': 'zi', "tz'u": 'ci', "tz'ŭ": 'ci', 'erh': 'er',
+    'yu': 'you', 'yü': 'yu', 'yüan': 'yuan', 'yüeh': 'yue', 'yün': 'yun', 'yung': 'yong', 'yeh': 'ye', 'yen': 'yan'
+}
+
+
+def wade_giles_syllable(syllable):
+    ''' Function that converts a single (lower-case) Wade-Giles syllable to pinyin, e.g. "ch'ü" -> 'qu', 'hsien' -> 'xian' '''
+    syllable = syllable.replace('ê', 'e')
+    if syllable in _WG_SYLLABLES:
+        return _WG_SYLLABLES[syllable]
+
+    initial, final = '', syllable
+    for wade_giles, pinyin in _WG_INITIALS:
+        if syllable.startswith(wade_giles):
+            initial, final = pinyin, syllable[len(wade_giles):]
+            break
+    for wade_giles, pinyin in _WG_FINALS:
+        if final.endswith(wade_giles):
+            final = final[:-len(wade_giles)] + pinyin
+            break
+
+    if initial in ('zh', 'ch') and final.startswith(('i', 'ü')):
+        initial = 'j' if initial == 'zh' else 'q'
+    if initial in ('j', 'q', 'x'):
+        final = final.replace('ü', 'u')
+    if final == 'o' and initial in ('g', 'k', 'h'):
+        final = 'e'
+    elif final == 'o' and initial in ('d', 't', 'n', 'l', 'z', 'c', 's', 'r', 'zh', 'ch', 'sh'):
+        final = 'uo'
+    return initial + final
+
+
+def wade_giles_to_pinyin(name):
+    ''' Function that converts a (lower-case) name romanized in Wade-Giles, with its syllables separated by hyphens or
+        spaces, to pinyin syllables separated by spaces, e.g. "ch'ü-yang hsien" -> 'qu yang xian'
+    '''
+    return ' '.join(wade_giles_syllable(syllable) for syllable in re.split(r'[\s\-]+', name.strip()) if syllable)
+
+
+def _pinyin_normalize(names):
+    names = names.str.lower().str.replace(r"[’‘`ʼ]", "'", regex=True)
+
+    # only names with spellings peculiar to Wade-Giles are converted, since many pinyin syllables are also valid
+    # (but different) Wade-Giles syllables
+    wade_giles = names.str.contains(_WADE_GILES)
+    if wade_giles.any():
+        names[wade_giles] = names[wade_giles].map(wade_giles_to_pinyin)
+
+    names = names.str.replace(_PINYIN_SUFFIX, r'\1', regex=True)
+    # dropping tone marks (and the umlaut of ü), 'v' typed for ü, tone numbers, apostrophes, hyphens and spaces
+    names = names.str.normalize('NFKD').str.replace(r'[̀-ͯ]', '', regex=True).str.replace('v', 'u')
+    return names.str.replace(r'[^a-z]', '', regex=True)
+
+
+def pinyin_keys(names):
+    ''' Function that returns the phonetic keys of a column of pinyin (or Wade-Giles) names: lower-cased, converted from
+        Wade-Giles where recognizably so, without a trailing administrative suffix (see PINYIN_SUFFIXES), and without
+        tone marks or numbers, apostrophes, hyphens or spaces.
+        E.g. 'Quyang Xian', 'Qu-yang', 'Qūyáng' and "Ch'ü-yang hsien" all have the key 'quyang'.
+    '''
+    return _distinct(names, _pinyin_normalize)
+
+
+### stems of Chinese names
+
+# administrative types (as written in characters in the CHGIS 'type_ch' field, simplified and traditional) dropped
+# from the end of a name, e.g. '曲陽縣' -> '曲陽'; only one is dropped, the longest that leaves at least two characters
+# of the name, so that a bare name ending in one of them keeps it (e.g. '安國' and '鄭州', but not '安國縣' -> '安國')
+CHINESE_SUFFIXES = [
+    '县', '縣', '州', '郡', '国', '國', '侯国', '侯國', '路', '府', '军', '軍', '厅', '廳', '省', '行省', '卫', '衛', '所',
+    '镇', '鎮', '道', '监', '監', '寨', '砦', '堡', '盟', '部', '旗', '司', '土司', '宣慰司', '宣抚司', '宣撫司', '安抚司',
+    '安撫司', '招讨司', '招討司', '长官司', '長官司', '千户所', '千戶所', '都护府', '都護府', '都督府', '总管府', '總管府',
+    '军民府', '軍民府', '万户府', '萬戶府', '节度使', '節度使', '观察使', '觀察使', '防御使', '防禦使', '团练使', '團練使',
+    '经略使', '經略使', '直隶州', '直隸州', '直隶厅', '直隸廳'
+]
+_CHINESE_SUFFIX = re.compile(r'^(.{2,}?)(?:%s)$' % '|'.join(sorted(CHINESE_SUFFIXES, key=len, reverse=True)))
+
+
+def _stem_normalize(names):
+    return names.str.strip().str.replace(_CHINESE_SUFFIX, r'\1', regex=True)
+
+
+def stem_keys(names):
+    ''' Function that returns the stems of a column of names in Chinese characters: the names without a trailing
+        administrative type (see CHINESE_SUFFIXES), e.g. '曲陽縣', '曲陽郡' and '曲陽' all have the stem '曲陽', and
+        '安國縣' and '安國' the stem '安國'.  Names of two characters keep them all (e.g. '安州' isn't taken for '安').
+        Names are otherwise left as they are, so simplified and traditional names have different stems.
+    '''
+    return _distinct(names, _stem_normalize)
+
+
+### folding of characters into one script
+
+# traditional characters and the simplified characters they are folded into, as pairs
+_TRADITIONAL_FORMS = '''
+萬万 與与 專专 業业 叢丛 東东 絲丝 兩两 嚴严 喪丧 個个 豐丰 臨临 為为 麗丽 舉举 麼么 義义 烏乌 樂乐 喬乔 習习 鄉乡 書书
+買买 亂乱 爭争 於于 虧亏 雲云 亞亚 產产 畝亩 親亲 褻亵 億亿 僅仅 從从 侖仑 倉仓 儀仪 們们 價价 眾众 優优 夥伙 會会 傘伞
+偉伟 傳传 傷伤 倫伦 偽伪 佇伫 體体 餘余 傭佣 僉佥 俠侠 侶侣 僥侥 偵侦 側侧 僑侨 儈侩 儕侪 儂侬 俁俣 儔俦 儼俨 倆俩 儷俪
+儉俭 債债 傾倾 僂偻 僨偾 償偿 儲储 兒儿 兌兑 兗兖 黨党 蘭兰 關关 興兴 茲兹 養养 獸兽 內内 岡冈 冊册 寫写 軍军 農农 塚冢
+馮冯 沖冲 決决 況况 凍冻 淨净 淒凄 涼凉 減减 湊凑 凜凛 幾几 鳳凤 鳧凫 憑凭 凱凯 擊击 鑿凿 芻刍 劃划 劉刘 則则 剛刚 創创
+刪删 別别 剎刹 劑剂 剮剐 劍剑 劇剧 勸劝 辦办 務务 勱劢 動动 勵励 勁劲 勞劳 勢势 勳勋 勻匀 匭匦 匱匮 區区 醫医 華华 協协
+單单 賣卖 盧卢 鹵卤 臥卧 衛卫 卻却 巹卺 廠厂 廳厅 曆历 歷历 厲厉 壓压 厭厌 厙厍 廁厕 廂厢 廈厦 廚厨 廝厮 縣县 參参 雙双
+發发 變变 敘叙 疊叠 葉叶 號号 嘆叹 嘰叽 籲吁 後后 嚇吓 呂吕 嗎吗 噸吨 聽听 啟启 吳吴 嘸呒 囈呓 嘔呕 嚦呖 唄呗 員员 咼呙
+嗆呛 嗚呜 詠咏 嚨咙 嚀咛 噝咝 響响 啞哑 噦哕 嘩哗 噲哙 嘵哓 噴喷 喲哟 嘍喽 嚕噜 嗩唢 喚唤 嘖啧 嗇啬 囀啭 嚙啮 嘯啸 噯嗳
+噓嘘 嚶嘤 囑嘱 團团 園园 囪囱 圍围 圇囵 國国 圖图 圓圆 聖圣 壙圹 場场 壞坏 塊块 堅坚 壇坛 壢坜 壩坝 塢坞 墳坟 墜坠 壟垄
+壘垒 墾垦 堊垩 埡垭 塏垲 壎埙 塤埙 墊垫 塹堑 墮堕 壪塆 執执 報报 壯壮 聲声 殼壳 壺壶 處处 備备 復复 夠够 頭头 誇夸 夾夹
+奪夺 奩奁 奐奂 奮奋 獎奖 奧奥 妝妆 婦妇 媽妈 嫵妩 嫗妪 媯妫 姍姗 婁娄 婭娅 嬈娆 嬌娇 孌娈 娛娱 媧娲 嫻娴 嬰婴 嬋婵 嬸婶
+媼媪 孫孙 學学 孿孪 寧宁 寶宝 實实 寵宠 審审 憲宪 宮宫 寬宽 賓宾 寢寝 對对 尋寻 導导 壽寿 將将 爾尔 塵尘 嘗尝 堯尧 尷尴
+屍尸 盡尽 層层 屜屉 屆届 屬属 屢屡 屨屦 嶼屿 歲岁 豈岂 嶇岖 崗岗 峴岘 嶴岙 嵐岚 島岛 嶺岭 嶽岳 崬岽 巋岿 峽峡 嶢峣 嶠峤
+崢峥 巒峦 嶗崂 崍崃 嶮崄 嶄崭 嶸嵘 嶧峄 嶁嵝 巔巅 巖岩 鞏巩 幣币 帥帅 師师 幃帏 帳帐 簾帘 幟帜 帶带 幀帧 幫帮 幬帱 幗帼
+幹干 廣广 莊庄 慶庆 廬庐 廡庑 庫库 應应 廟庙 龐庞 廢废 開开 異异 棄弃 張张 彌弥 彎弯 彈弹 強强 歸归 當当 錄录 彙汇 彥彦
+徹彻 徑径 徠徕 憶忆 懺忏 憂忧 懷怀 態态 慫怂 憮怃 慪怄 悵怅 愴怆 憐怜 總总 懟怼 懌怿 戀恋 懇恳 惡恶 慟恸 懨恹 愷恺 惻恻
+惱恼 惲恽 悅悦 懸悬 慳悭 憫悯 驚惊 懼惧 慘惨 懲惩 憊惫 愜惬 慚惭 憚惮 慣惯 慍愠 憤愤 憒愦 願愿 懾慑 懣懑 懶懒 戇戆 戔戋
+戲戏 戧戗 戰战 戩戬 戶户 撲扑 擴扩 捫扪 掃扫 揚扬 擾扰 撫抚 拋抛 摶抟 摳抠 掄抡 搶抢 護护 擔担 擬拟 攏拢 揀拣 擁拥 攔拦
+擰拧 撥拨 擇择 掛挂 摯挚 攣挛 掗挜 撾挝 撻挞 挾挟 撓挠 擋挡 撟挢 掙挣 擠挤 揮挥 撏挦 撈捞 損损 撿捡 換换 搗捣 據据 擄掳
+摑掴 擲掷 撣掸 攙搀 摻掺 擷撷 攜携 搖摇 攝摄 攛撺 攤摊 攪搅 擺摆 數数 敵敌 斂敛 斃毙 鬥斗 斬斩 斷断 無无 舊旧 時时 曠旷
+暘旸 曇昙 晝昼 顯显 晉晋 曬晒 曉晓 曄晔 暈晕 暉晖 暫暂 曖暧 術术 樸朴 機机 殺杀 雜杂 權权 條条 來来 楊杨 榪杩 傑杰 極极
+構构 樅枞 樞枢 棗枣 櫪枥 梘枧 棖枨 槍枪 楓枫 梟枭 櫃柜 檸柠 檉柽 梔栀 柵栅 標标 棧栈 櫛栉 櫳栊 棟栋 櫨栌 櫟栎 欄栏 樹树
+棲栖 樣样 欒栾 樁桩 槳桨 橋桥 樺桦 檜桧 夢梦 檢检 櫺棂 槨椁 槧椠 欏椤 橢椭 樓楼 欖榄 櫸榉 櫬榇 櫝椟 欞棂 橫横 檣樯 櫻樱
+櫥橱 櫧槠 歡欢 歐欧 殲歼 殤殇 殘残 殞殒 殮殓 殫殚 殯殡 毆殴 毀毁 轂毂 畢毕 氈毡 氌氇 氣气 氫氢 氬氩 漢汉 湯汤 溝沟 灃沣
+漚沤 瀝沥 淪沦 滄沧 溈沩 滬沪 濘泞 淚泪 澩泶 瀧泷 瀘泸 濼泺 潑泼 澤泽 涇泾 潔洁 灑洒 窪洼 浹浃 淺浅 漿浆 澆浇 湞浈 溮浉
+濁浊 測测 澮浍 濟济 瀏浏 渾浑 滸浒 濃浓 潯浔 濤涛 澇涝 渦涡 溳涢 渙涣 滌涤 潤润 澗涧 漲涨 澀涩 淵渊 淥渌 漬渍 瀆渎 漸渐
+澠渑 漁渔 瀋沈 滲渗 溫温 灣湾 濕湿 潰溃 濺溅 漵溆 滯滞 滅灭 灄滠 滿满 瀅滢 濾滤 濫滥 灤滦 濱滨 灘滩 澦滪 潁颍 瀠潆 瀟潇
+瀲潋 濰潍 潛潜 瀦潴 瀾澜 瀨濑 瀕濒 灝灏 滎荥 燈灯 靈灵 災灾 燦灿 煬炀 爐炉 燉炖 煒炜 熗炝 點点 煉炼 熾炽 爍烁 爛烂 烴烃
+燭烛 煙烟 煩烦 燒烧 燁烨 燴烩 燙烫 燼烬 熱热 煥焕 燜焖 燾焘 愛爱 爺爷 牘牍 犛牦 牽牵 犧牺 犢犊 狀状 獷犷 獁犸 猶犹 狽狈
+獮狝 獰狞 獨独 狹狭 獅狮 獪狯 猙狰 獄狱 猻狲 獫猃 獵猎 獼猕 玀猡 豬猪 貓猫 蝟猬 獻献 獺獭 璣玑 瑪玛 瑋玮 環环 現现 璽玺
+瑉珉 琺珐 瓏珑 璫珰 琿珲 璉琏 瑣琐 瓊琼 瑤瑶 瑩莹 璦瑷 甕瓮 甌瓯 電电 畫画 暢畅 疇畴 癤疖 療疗 瘧疟 癘疠 瘍疡 癒愈 瘡疮
+瘋疯 皰疱 癰痈 痙痉 癢痒 瘂痖 癆痨 瘓痪 痺痹 瘞瘗 癱瘫 癮瘾 癭瘿 皚皑 皺皱 盜盗 盞盏 鹽盐 監监 蓋盖 盤盘 盪荡 眥眦 矚瞩
+睜睁 瞼睑 瞞瞒 礬矾 礦矿 碭砀 碼码 磚砖 礪砺 礱砻 礫砾 礎础 碩硕 硯砚 確确 礙碍 磯矶 禮礼 禕祎 禰祢 禍祸 禎祯 禪禅 離离
+禿秃 稈秆 種种 積积 稱称 穢秽 穠秾 穩稳 穀谷 窮穷 竊窃 竅窍 窯窑 竄窜 窩窝 窺窥 竇窦 豎竖 競竞 筆笔 筍笋 箋笺 筧笕 箏筝
+節节 範范 築筑 篋箧 籌筹 簽签 簡简 籃篮 籬篱 簫箫 籠笼 籤签 粵粤 糝糁 糞粪 糧粮 糰团 糴籴 糶粜 糾纠 紀纪 紂纣 約约 紅红
+紆纡 紇纥 紈纨 紉纫 緯纬 紜纭 純纯 紕纰 紗纱 綱纲 納纳 縱纵 綸纶 紛纷 紙纸 紋纹 紡纺 紐纽 紓纾 線线 紺绀 紲绁 紱绂 練练
+組组 紳绅 細细 織织 終终 縐绉 絆绊 紼绋 絀绌 紹绍 繹绎 經经 紿绐 綁绑 絨绒 結结 絝绔 繞绕 絎绗 繪绘 給给 絢绚 絳绛 絡络
+絕绝 絞绞 統统 綆绠 綃绡 絹绢 繡绣 綌绤 綏绥 繼继 綈绨 績绩 緒绪 綾绫 續续 綺绮 緋绯 綽绰 緄绲 繩绳 維维 綿绵 綬绶 繃绷
+綢绸 綹绺 綣绻 綜综 綻绽 綰绾 綠绿 綴缀 緇缁 緙缂 緗缃 緘缄 緬缅 纜缆 緹缇 緲缈 緝缉 緞缎 締缔 緣缘 編编 緩缓 緡缗 緦缌
+縷缕 緶缏 緱缑 縋缒 縑缣 縊缢 縉缙 縛缚 縟缛 縝缜 縫缝 縞缟 纏缠 縭缡 繽缤 縹缥 縵缦 縲缧 纓缨 縮缩 繆缪 繅缫 纈缬 繚缭
+繕缮 繒缯 繯缳 繳缴 纘缵 罌罂 網网 羅罗 罰罚 罷罢 羆罴 羈羁 羥羟 翹翘 耬耧 聳耸 恥耻 聶聂 聾聋 職职 聹聍 聯联 聵聩 聰聪
+肅肃 腸肠 膚肤 骯肮 腎肾 腫肿 脹胀 脅胁 膽胆 勝胜 朧胧 臚胪 脛胫 膠胶 脈脉 膾脍 髒脏 臍脐 腦脑 膿脓 臠脔 腳脚 脫脱 腡脶
+臉脸 臘腊 醃腌 膩腻 騰腾 臏膑 臟脏 艤舣 艦舰 艙舱 艫舻 艱艰 豔艳 艷艳 藝艺 薌芗 蕪芜 蘆芦 蓯苁 莧苋 萇苌 蒼苍 苧苎 蘋苹
+莖茎 蘢茏 蔦茑 塋茔 煢茕 薦荐 荊荆 薘荙 莢荚 蕘荛 蓽荜 蕎荞 薈荟 薺荠 蕩荡 榮荣 葷荤 犖荦 熒荧 蓀荪 蔭荫 蕒荬 葒荭 葤荮
+藥药 蒞莅 萊莱 蓮莲 蒔莳 萵莴 獲获 蕕莸 鶯莺 蓴莼 蘿萝 螢萤 營营 縈萦 蕭萧 薩萨 蔥葱 蕆蒇 蕢蒉 蔣蒋 蔞蒌 藍蓝 薊蓟 蘺蓠
+驀蓦 蘊蕴 藪薮 藺蔺 蘚藓 虜虏 慮虑 虛虚 蟲虫 虯虬 蟣虮 雖虽 蝦虾 蠆虿 蝕蚀 蟻蚁 螞蚂 蠶蚕 蠔蚝 蜆蚬 蠱蛊 蠣蛎 蟶蛏 蠻蛮
+蟄蛰 蛺蛱 蟯蛲 螄蛳 蠐蛴 蛻蜕 蝸蜗 蠟蜡 蠅蝇 蟈蝈 蟬蝉 蠍蝎 螻蝼 蠑蝾 螿螀 釁衅 銜衔 補补 襯衬 袞衮 襖袄 裊袅 褘袆 襪袜
+襲袭 裝装 襠裆 褳裢 襝裣 褲裤 襇裥 褸褛 襤褴 見见 觀观 規规 覓觅 視视 覘觇 覽览 覺觉 覬觊 覡觋 覲觐 覦觎 覯觏 覷觑 觴觞
+觸触 觶觯 訁讠 訂订 訃讣 計计 訊讯 訌讧 討讨 訐讦 訓训 訕讪 訖讫 託托 記记 訛讹 訝讶 訟讼 訣诀 訥讷 訪访 設设 許许 訴诉
+訶诃 診诊 註注 詁诂 詆诋 詎讵 詐诈 詔诏 評评 詛诅 詞词 詡诩 詢询 詣诣 試试 詩诗 詫诧 詬诟 詭诡 詮诠 詰诘 話话 該该 詳详
+詼诙 詿诖 誄诔 誅诛 誆诓 誌志 認认 誑诳 誒诶 誕诞 誘诱 誚诮 語语 誠诚 誡诫 誣诬 誤误 誥诰 誦诵 誨诲 說说 誰谁 課课 誶谇
+誹诽 誼谊 調调 諂谄 諒谅 諄谆 談谈 請请 諍诤 諏诹 諑诼 諉诿 諛谀 諜谍 諞谝 諢诨 諦谛 諧谐 諫谏 諭谕 諮谘 諱讳 諳谙 諶谌
+諷讽 諸诸 諺谚 諾诺 謀谋 謁谒 謂谓 謄誊 謅诌 謊谎 謎谜 謐谧 謔谑 謖谡 謗谤 謙谦 謚谥 講讲 謝谢 謠谣 謨谟 謫谪 謬谬 謳讴
+謹谨 譏讥 譖谮 識识 譙谯 譚谭 譜谱 譫谵 譯译 議议 譴谴 譽誉 讀读 讎雠 讒谗 讓让 讕谰 讖谶 讚赞 讞谳 貝贝 貞贞 負负 財财
+貢贡 貧贫 貨货 販贩 貪贪 貫贯 責责 貯贮 貰贳 貲赀 貳贰 貴贵 貶贬 貸贷 貺贶 費费 貼贴 貽贻 貿贸 賀贺 賁贲 賂赂 賃赁 賄贿
+賅赅 資资 賈贾 賊贼 賑赈 賒赊 賕赇 賙赒 賚赉 賜赐 賞赏 賠赔 賡赓 賢贤 賤贱 賦赋 質质 賬账 賭赌 賴赖 賺赚 賻赙 購购 賽赛
+賾赜 贄贽 贅赘 贈赠 贊赞 贍赡 贏赢 贐赆 贓赃 贖赎 贗赝 贛赣 趙赵 趕赶 趨趋 躉趸 躍跃 蹌跄 跡迹 踐践 躂跶 蹺跷 蹕跸 躚跹
+躋跻 踴踊 躊踌 蹤踪 躓踬 躑踯 躡蹑 蹣蹒 躪躏 軀躯 車车 軋轧 軌轨 軒轩 軔轫 軟软 軸轴 軻轲 軼轶 軫轸 軺轺 較较 載载 輊轾
+輒辄 輓挽 輔辅 輕轻 輛辆 輜辎 輝辉 輟辍 輥辊 輦辇 輩辈 輪轮 輯辑 輸输 輻辐 輾辗 輿舆 轄辖 轅辕 轆辘 轉转 轍辙 轎轿 轟轰
+轡辔 轢轹 辭辞 辮辫 辯辩 迴回 這这 連连 週周 進进 遊游 運运 過过 達达 違违 遙遥 遜逊 遞递 遠远 適适 遲迟 遷迁 選选 遺遗
+遼辽 邁迈 還还 邇迩 邊边 邏逻 邐逦 郟郏 鄆郓 鄒邹 鄔邬 鄖郧 鄧邓 鄭郑 鄰邻 鄲郸 鄴邺 鄶郐 鄺邝 酈郦 酇酂 醞酝 醬酱 釀酿
+釋释 針针 釘钉 釗钊 釙钋 鈞钧 鈍钝 鈔钞 鈕钮 鈣钙 鈴铃 鉀钾 鉅巨 鉑铂 鉛铅 鉞钺 鉤钩 鉦钲 銀银 銅铜 銓铨 銖铢 銘铭 銚铫
+銳锐 銷销 鋁铝 鋒锋 鋤锄 鋪铺 鋸锯 鋼钢 錐锥 錘锤 錢钱 錦锦 錫锡 錯错 鍊炼 鍋锅 鍍镀 鍵键 鍾钟 鎔镕 鎖锁 鎬镐 鎮镇 鏈链
+鏡镜 鏢镖 鐘钟 鐔镡 鐵铁 鐸铎 鑄铸 鑑鉴 鑒鉴 鑾銮 鑰钥 鑲镶 長长 門门 閂闩 閃闪 閉闭 閏闰 閑闲 間间 閔闵 閘闸 閡阂 閣阁
+閥阀 閨闺 閩闽 閬阆 閭闾 閱阅 閶阊 閹阉 閻阎 閼阏 闃阒 闆板 闈闱 闊阔 闋阕 闌阑 闐阗 闔阖 闕阙 闖闯 闞阚 闡阐 闢辟 隊队
+階阶 際际 陸陆 陳陈 陘陉 陝陕 陣阵 陰阴 陽阳 隉陧 隕陨 隨随 險险 隱隐 隴陇 隸隶 難难 雛雏 雞鸡 霧雾 霽霁 靂雳 靄霭 靚靓
+靜静 靨靥 韃鞑 韉鞯 韋韦 韌韧 韓韩 韙韪 韜韬 韞韫 韻韵 頁页 頂顶 頃顷 項项 順顺 須须 頊顼 頌颂 預预 頑顽 頒颁 頓顿 頗颇
+領领 頜颌 頡颉 頤颐 頦颏 頰颊 頷颔 頸颈 頹颓 頻频 顆颗 題题 額额 顎颚 顏颜 顓颛 顛颠 類类 顥颢 顧顾 顫颤 顱颅 風风 颱台
+颳刮 颶飓 颺飏 飄飘 飛飞 飢饥 飩饨 飪饪 飫饫 飭饬 飯饭 飲饮 飴饴 飼饲 飽饱 飾饰 餃饺 餅饼 餉饷 餌饵 餑饽 餓饿 餚肴 餛馄
+餞饯 餡馅 館馆 餵喂 餽馈 饅馒 饈馐 饋馈 饑饥 饒饶 饗飨 饞馋 馬马 馭驭 馱驮 馳驰 馴驯 駁驳 駐驻 駑驽 駒驹 駕驾 駙驸 駛驶
+駝驼 駟驷 駭骇 駱骆 駿骏 騁骋 騎骑 騙骗 騫骞 騶驺 騷骚 驅驱 驃骠 驄骢 驕骄 驗验 驛驿 驟骤 驢驴 驥骥 驪骊 髏髅 髖髋 鬆松
+鬍胡 鬚须 鬧闹 鬩阋 鬱郁 魎魉 魘魇 魚鱼 魯鲁 魷鱿 鮑鲍 鮮鲜 鯉鲤 鯨鲸 鰱鲢 鰲鳌 鱗鳞 鱷鳄 鳥鸟 鳩鸠 鳴鸣 鴆鸩 鴉鸦 鴕鸵
+鴛鸳 鴣鸪 鴦鸯 鴨鸭 鴻鸿 鵑鹃 鵝鹅 鵠鹄 鵡鹉 鵬鹏 鵲鹊 鶉鹑 鶴鹤 鷗鸥 鷲鹫 鷹鹰 鷺鹭 鸚鹦 鸞鸾 鹹咸 鹺鹾 鹼碱 麥麦 麩麸
+麵面 黃黄 黌黉 黲黪 黴霉 黷黩 黽黾 黿鼋 鼉鼍 鼴鼹 齊齐 齋斋 齒齿 齡龄 齦龈 齜龇 齪龊 齬龉 齲龋 齷龌 龍龙 龔龚 龕龛 龜龟
+亙亘 併并 係系 兇凶 冪幂 匯汇 卹恤 嚮向 奬奖 姦奸 廄厩 弒弑 捨舍 摺折 暱昵 朮术 汙污 洩泄 瀰弥 痲麻 癡痴 皁皂 硃朱 稜棱
+筴策 籐藤 緻致 罈坛 臺台 舖铺 薑姜 蔔卜 衝冲 裡里 裏里 覈核 谿溪 釐厘 鉋刨 鍼针 閒闲 隻只 雋隽 餬糊 麯曲 髮发 鬨哄 鬭斗
+鬪斗 燄焰 徵征 製制 複复 穫获 儘尽 簷檐 纔才 繫系 醜丑 準准 峯峰 崑昆 崙仑 嶋岛 聞闻 欽钦 禦御 蘇苏 祿禄 郵邮 漣涟 樑梁
+昇升 恆恒 塗涂 篤笃 淩凌 淶涞 葦苇 湧涌 楨桢 騏骐 硤硖 蘄蕲 賧赕 閿阌 軹轵 鮦鲖 軑轪 鏞镛 齕龁 噥哝 劄札 糓谷 茍苟 墰坛
+脩修 穌稣 鉉铉 鈺钰 鏗铿 鐃铙 銑铣 鋏铗 鋌铤 錙锱 錚铮 錠锭 錳锰 鍚钖 鎂镁 鎧铠 鏤镂 鑊镬 鑠铄 閎闳 閌闶 闥闼 紘纮 縯䌸
+纖纤 罵骂 翺翱 藹蔼 蘞蔹 衊蔑 鐙镫 鎰镒 鏟铲 鐫镌 鑣镳 鑼锣 閾阈 闓闿 闒阘 韁缰 頎颀 頏颃 顒颙 颼飕 颸飔 餳饧 餺馎 饃馍
+駔驵 駘骀 駢骈 騅骓 騍骒 騖骛 騭骘 驍骁 驊骅 驌骕 驤骧 鬢鬓 魴鲂 鯀鲧 鰍鳅 鱘鲟 鱸鲈 鴟鸱 鴝鸲 鵂鸺 鵓鹁 鵜鹈 鵪鹌 鶇鸫
+鶘鹕 鶚鹗 鶻鹘 鷂鹞 鷓鹧 鷯鹩 鸛鹳 鸝鹂 麅狍 黶黡 鼕冬 齏齑
+'''
+
+# variant forms (異體字) and the (simplified) standard characters they are folded into, as pairs
+_VARIANT_FORMS = '''
+羣群 甯宁 邨村 敍叙 爲为 僞伪 眞真 淸清 靑青 緖绪 硏研 戸户 卽即 旣既 歎叹 鷄鸡 綫线 牀床 窻窗 峩峨 嵗岁 秊年 囯国 舘馆
+濶阔 汚污 疎疏 雝雍 廼乃 迺乃 竝并 並并 吿告 衆众 兎兔 寳宝 亊事 剏创 刱创 坵丘 壻婿 尅克 廵巡 徳德 悳德 恊协 挿插 晩晚
+暎映 曺曹 栢柏 桒桑 棊棋 槩概 欵款 歩步 毎每 氷冰 渉涉 湼涅 溼湿 滙汇 煑煮 畧略 畱留 疉叠 瘉愈 皐皋 盃杯 礮炮 砲炮 祕秘
+稺稚 穉稚 筭算 箒帚 粧妆 絶绝 綉绣 緜绵 繖伞 罸罚 羗羌 耡锄 脣唇 舩船 菴庵 葢盖 蔴麻 虵蛇 衇脉 衞卫 覩睹 賔宾 躰体 軆体
+迯逃 遶绕 鉄铁 銕铁 鎗枪 鑛矿 隄堤 霛灵 靣面 鞌鞍 餧喂 駈驱 鴈雁 鷰燕 麪面 黙默 鼈鳖 嵒岩 巗岩 崐昆 陜陕 蘓苏 甦苏 凖准
+凈净 匃丐 卄廿 厛厅 叡睿 啓启 啔启 嗁啼 囘回 囬回 塲场 墻墙 壄野 埜野 姙妊 婣姻 媿愧 嫰嫩 尙尚 屛屏 岀出 峝峒 崘仑 嶃崭
+廹迫 廻回 弔吊 彊强 徃往 恉旨 恠怪 悤匆 愽博 慙惭 憇憩 挍校 搵揾 敎教 敺驱 昻昂 晳皙 暦历 杇圬 枏楠 柹柿 梹槟 椶棕 榘矩
+槕桌 檯台 欝郁 歛敛 殀夭 毘毗 毬球 氊毡 沍冱 泝溯 洶汹 涖莅 淛浙 煇辉 熈熙 煕熙 狥徇 玅妙 琱雕 甞尝 畊耕 畞亩 疿痱 皷鼓
+盌碗 眡视 睠眷 磤殷 秌秋 稟禀 窓窗 竢俟 筯箸 篛箬 糉粽 紥扎 絃弦 綑捆 縂总 羨羡 翫玩 肎肯 胷胸 脇胁 芲花 苐第 荅答 莕荇
+菓果 蔆菱 蕋蕊 藁槁 蘂蕊 蛕蛔 蝯猿 螘蚁 袵衽 裠裙 襍杂 覔觅 觔斤 詧察 諡谥 譌讹 讁谪 豓艳 貍狸 賸剩 趂趁 跥跺 踰逾 蹟迹
+躶裸 迻移 遡溯 鄕乡 酧酬 醻酬 釦扣 鈎钩 銲焊 鋭锐 鍳鉴 鑪炉 閧哄 闗关 陗峭 隷隶 霑沾 靭韧 鞵鞋 顋腮 飱飧 餈糍 馀余 駡骂
+髣仿 髴佛 鬰郁 鯗鲞 鰐鳄 鵞鹅 鷀鹚 麁粗 麤粗 黒黑 鼇鳌 齧啮 龢和 龝秋
+'''
+
+# translation table folding every traditional and variant character above into its simplified form; simplified is
+# the canonical script since several traditional characters can share one simplified form (e.g. 後 and 后), but not
+# the other way round
+FOLD_TABLE = str.maketrans(dict(pair for pair in (_TRADITIONAL_FORMS + _VARIANT_FORMS).split()))
+
+
+def _fold_normalize(names):
+    # (NFKC first turns the CJK compatibility ideographs and full-width forms into their ordinary forms)
+    return names.str.normalize('NFKC').str.translate(FOLD_TABLE).str.strip()
+
+
+def fold_keys(names):
+    ''' Function that folds a column of names in Chinese characters character by character into simplified characters
+        (see FOLD_TABLE), so that the same name in traditional, simplified or variant characters has the same key,
+        e.g. '曲陽', '曲阳' and '麯陽' all have the key '曲阳'.
+    '''
+    return _distinct(names, _fold_normalize)
+
+
+# the key functions by name, as given in the 'name_keys' matching option; keys are applied in the order given
+KEY_FUNCTIONS = OrderedDict([
+    ('pinyin', pinyin_keys),
+    ('stem', stem_keys),
+    ('fold', fold_keys)
+])
+
+
+def name_keys(names, keys):
+    ''' Function that applies the named key functions (see KEY_FUNCTIONS) to a column of names, one after another.
+        Returns a Series of keys (NaN where a name is missing or normalizes to nothing).
+    '''
+    for key in keys:
+        if key not in KEY_FUNCTIONS:
+            raise ValueError("Unknown name key: %s" % key)
+        names = KEY_FUNCTIONS[key](names)
+    return names
+
+
+def key_column(field, keys):
+    ''' Function that returns the name of the column under which the keys of a name field can be stored alongside it,
+        e.g. 'tgaz_nm_trad__fold', so that they are computed once with the rest of a target's snapshot
+    '''
+    return '%s__%s' % (field, '_'.join(keys))
@@ -0,0 +1,136 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/parent_index.py
+#
+# Helper module for geoname_match: an index of the TARGET rows by the composite key (name, name of a parent unit), so
+# that an incoming name given together with its parent (e.g. '薊縣' in '幽州刺史部') only finds the target rows of that
+# name lying within a unit of that name, rather than every same-named unit in China.
+# The parents of each target row are taken from its own parent fields, and, where the CHGIS PartOf table is given, from
+# the chain of parent units recorded there (CHILD_ID -> PRT_ID, for the years the link held), up to a few levels up.
+# Candidate pairs are returned in the same 'target_pos'/'incoming_pos' layout used by match_index.merge_candidates()
+# Only non-core libraries used are pandas and numpy
+
+import pandas as pd
+import numpy as np
+
+from chgis_schema import read_table
+from match_index import KeyIndex
+from name_keys import name_keys
+from year_overlap import to_years
+
+
+# separator of the name and parent keys in a composite key (a control character, which no name contains)
+KEY_SEPARATOR = '\x1f'
+
+# number of levels of parent units looked up in PartOf, e.g. county -> commandery -> circuit
+DEFAULT_DEPTH = 3
+
+
+def read_part_of(path):
+    ''' Function that reads the CHGIS PartOf table (see chgis_schema.LAYOUTS), returning the links from child to parent
+        units as a DataFrame with the fields 'child_id', 'beg', 'end', 'parent_id', 'parent_ch' and 'parent_py'
+    '''
+    frame, layout = read_table(path, usecols=['CHILD_ID', 'BEG_YR', 'END_YR', 'PRT_ID', 'PRT_NMCH', 'PRT_NMPY'])
+    if layout != 'PartOf':
+        raise ValueError("%s does not have the fields of the CHGIS PartOf table" % path)
+    return pd.DataFrame({
+        'child_id': pd.to_numeric(frame['CHILD_ID'], errors='coerce').astype(float).values,
+        'beg': to_years(frame['BEG_YR']),
+        'end': to_years(frame['END_YR']),
+        'parent_id': pd.to_numeric(frame['PRT_ID'], errors='coerce').astype(float).values,
+        'parent_ch': frame['PRT_NMCH'].astype(object).values,
+        'parent_py': frame['PRT_NMPY'].astype(object).values
+    })
+
+
+def _numeric_ids(values):
+    ''' Returns CHGIS IDs ('hvd_12345' or 12345) as a float64 numpy array of their numbers, NaN where there is none '''
+    values = pd.Series(values).astype(object).astype(str).str.replace(r'^hvd_', '', regex=True)
+    return pd.to_numeric(values, errors='coerce').astype(float).values
+
+
+def ancestor_names(target, part_of=None, pinyin=False, depth=DEFAULT_DEPTH):
+    ''' Function that returns the names of the parent units of every target row, as a DataFrame of ('target_pos',
+        'parent') pairs without duplicates: its own parent (the 'tgaz_prnt_simp' or, if 'pinyin', 'tgaz_prnt_py' field),
+        then, if a PartOf table is given (see read_part_of()), the parents recorded there for the row's unit, their own
+        parents and so on up to 'depth' levels, as far as the links' years overlap the row's.
+    '''
+    found = []
+    own_field = 'tgaz_prnt_py' if pinyin else 'tgaz_prnt_simp'
+    if own_field in target.columns:
+        found.append(pd.DataFrame({'target_pos': np.arange(len(target.index)), 'parent': target[own_field].astype(object).values}))
+
+    if part_of is not None and 'tgaz_sys_id' in target.columns:
+        links = part_of[['child_id', 'beg', 'end', 'parent_id', 'parent_py' if pinyin else 'parent_ch']]
+        links.columns = ['child_id', 'link_beg', 'link_end', 'parent_id', 'parent']
+        # (rows without years take on those of every link)
+        frontier = pd.DataFrame({
+            'target_pos': np.arange(len(target.index)),
+            'child_id': _numeric_ids(target['tgaz_sys_id']),
+            'beg': to_years(target['tgaz_beg']) if 'tgaz_beg' in target.columns else np.nan,
+            'end': to_years(target['tgaz_end']) if 'tgaz_end' in target.columns else np.nan
+        }).dropna(subset=['child_id'])
+
+        for level in range(depth):
+            step = frontier.merge(links, on='child_id', how='inner')
+            with np.errstate(invalid='ignore'):
+                overlapping = ~((step['link_beg'] > step['end']) | (step['link_end'] < step['beg']))
+            step = step[overlapping.values]
+            if not len(step.index):
+                break
+            found.append(step[['target_pos', 'parent']])
+            # narrowing each row's span to the years the link held, for looking up the next level
+            frontier = pd.DataFrame({
+                'target_pos': step['target_pos'].values,
+                'child_id': step['parent_id'].values,
+                'beg': np.fmax(step['beg'].values, step['link_beg'].values),
+                'end': np.fmin(step['end'].values, step['link_end'].values)
+            }).dropna(subset=['child_id']).drop_duplicates()
+
+    if not found:
+        return pd.DataFrame({'target_pos': np.array([], dtype=np.int64), 'parent': np.array([], dtype=object)})
+    ancestors = pd.concat(found, ignore_index=True)
+    ancestors = ancestors[ancestors['parent'].notnull()].drop_duplicates()
+    return ancestors.sort_values('target_pos', kind='mergesort').reset_index(drop=True)
+
+
+class ParentIndex(object):
+    ''' Index of the TARGET rows by the composite key of their name and the name of each of their parent units (see
+        ancestor_names()), built once over the target.  Names are keyed by 'keys' and parent names by 'parent_keys'
+        (see name_keys.py), so that parent names can be normalized like the names themselves.
+        A target row is found by an incoming (name, parent) if the name keys are equal and any of its parents' keys
+        is equal to the incoming parent's.
+    '''
+
+    def __init__(self, names, ancestors, keys=(), parent_keys=()):
+        self.keys = list(keys)
+        self.parent_keys = list(parent_keys)
+        names = name_keys(names, self.keys) if self.keys else pd.Series(names).astype(object)
+        parents = name_keys(ancestors['parent'], self.parent_keys) if self.parent_keys else ancestors['parent'].astype(object)
+
+        self.target_pos = ancestors['target_pos'].values.astype(np.int64)
+        self.index = KeyIndex(self._composite(np.asarray(names, dtype=object)[self.target_pos], parents))
+
+    @staticmethod
+    def _composite(names, parents):
+        names = pd.Series(np.asarray(names, dtype=object))
+        parents = pd.Series(np.asarray(parents, dtype=object))
+        return (names + KEY_SEPARATOR + parents).where(names.notnull() & parents.notnull()).values
+
+    def __len__(self):
+        return len(self.index)
+
+    def pairs(self, names, parents):
+        ''' Function that returns the candidate pairs of row positions whose names and parent names match, given the
+            incoming names (already keyed like the target's) and the incoming parent names (as they are), ordered by
+            incoming row and then target row
+        '''
+        if self.parent_keys:
+            parents = name_keys(parents, self.parent_keys)
+        pairs = self.index.pairs(self._composite(names, parents))
+        pairs['target_pos'] = self.target_pos[pairs['target_pos'].values]
+        # (a row whose parent and grandparent share a name is found twice)
+        pairs = pairs.drop_duplicates().sort_values(['incoming_pos', 'target_pos'], kind='mergesort')
+        return pairs.reset_index(drop=True)
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/release_merge.py
+#
+# The N-way counterpart of version_merge: merges any number of CHGIS releases or drafts (v5, V6_input_draft_20160811.csv,
+# GISInfoTable exports, deliveries from elsewhere...) in one go, writing a .csv with one row per 'sys_id' telling which
+# releases hold the record and whether it is the same in each of them as in the first release holding it, with the
+# fields that changed (see version_compare.merge_releases()).
+# The fields of releases in a known layout (see chgis_schema.LAYOUTS) are mapped as in version_compare.RELEASE_MAPPINGS;
+# those of any other release are mapped by a .json file of {field of the release: merged field}, the merged fields
+# being 'sys_id' and the v6 names of the compared fields (e.g. {"ID": "sys_id", "NAME": "nm_simp", "BEG": "beg_yr"}).
+#
+# Usage:
+#   python3 release_merge.py --release v5=input/v5_augment_2016-08-09.csv --release draft=input/V6_input_draft_20160811.csv
+#                            [--release fudan=input/fudan.csv --mapping fudan=input/fudan_mapping.json] --output merged.csv
+#
+# Releases are compared in the order given.
+# Only non-core libraries used are pandas and numpy
+
+import argparse
+import json
+import os.path
+
+from chgis_schema import read_table
+from version_compare import merge_releases, RELEASE_MAPPINGS
+
+
+def _named(items):
+    ''' Returns the NAME=PATH items as a list of (name, path), the name defaulting to the file's name '''
+    named = []
+    for item in items:
+        name, _, path = item.rpartition('=')
+        named.append((name or os.path.splitext(os.path.basename(path))[0], path))
+    return named
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merges any number of CHGIS releases, record by record, on 'sys_id'.")
+    parser.add_argument('--release', action='append', required=True, metavar='NAME=PATH',
+                        help="a release (.csv) to merge, under the given name (repeated for each release, in order)")
+    parser.add_argument('--mapping', action='append', default=[], metavar='NAME=PATH',
+                        help="a .json mapping of the fields of the release NAME onto the merged fields")
+    parser.add_argument('--output', required=True, help="path of the .csv file to write")
+    arguments = parser.parse_args()
+
+    mappings = {}
+    for name, path in _named(arguments.mapping):
+        with open(path, encoding='utf-8') as source:
+            mappings[name] = json.load(source)
+
+    releases = []
+    for name, path in _named(arguments.release):
+        frame, layout = read_table(path)
+        mapping = mappings.get(name, RELEASE_MAPPINGS.get(layout))
+        if mapping is None:
+            parser.error("%s isn't in a known layout: give a mapping of its fields with --mapping %s=..." % (path, name))
+        print("Read %s rows of %s as '%s'%s." % (len(frame.index), path, name, ' (%s layout)' % layout if layout else ''))
+        releases.append((name, frame, mapping))
+
+    merged = merge_releases(releases)
+    merged.to_csv(arguments.output, index=False)
+
+    print("\n%s records in all." % len(merged.index))
+    for name, _, _ in releases:
+        held = merged['in_%s' % name]
+        print("%s: %s records held, %s of them changed." % (name, held.sum(), (merged['same_%s' % name] == False).sum()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/run_profiler.py
+#
+# Stage-by-stage instrumentation of a geoname_match run: the wall and CPU time of each stage (loading, renaming, indexing,
+# merging, the coordinate/type/year comparisons, ranking, writing), the peak resident memory by its end, and the rows
+# going in and out of it -- from which the candidate fan-out of the merge and the throughput of every stage follow.
+# Nothing is recorded unless a profiler has been started (see start()); the matcher starts one when the CHGIS_PROFILE
+# environment variable is set (or geoname_match_cli.py is given --profile), and writes its report as JSON next to the
+# output, as <output_path>.profile.json.  With CHGIS_PROFILE=cprofile (or --cprofile), the stages are also run under
+# cProfile and its statistics dumped to <output_path>.prof, for reading with 'python3 -m pstats' or snakeviz.
+# Stages run in worker processes (see match_engine.match_in_parallel()) are only timed as a whole, by the parent process.
+# Only core libraries are used
+
+import cProfile
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # (not on Windows, where memory isn't reported)
+    resource = None
+
+
+# environment variable switching the profiler on: '1' (or any value) for the JSON report, 'cprofile' for the cProfile dump as well
+PROFILE_VARIABLE = 'CHGIS_PROFILE'
+
+# the profiler currently recording, if any
+_active = None
+
+
+def _peak_rss_mb():
+    ''' Returns the peak resident memory of this process so far, in MB (None where it can't be measured) '''
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def _cpu_seconds():
+    ''' Returns the CPU time used by this process and by its finished worker processes, in seconds '''
+    seconds = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        seconds += children.ru_utime + children.ru_stime
+    return seconds
+
+
+class RunProfiler(object):
+    ''' The records of the stages of one run, in the order they were first entered.  A stage entered several times (e.g.
+        once per chunk of the incoming file) adds up its times and rows, and counts its calls.  Stages may be nested
+        (e.g. the merge within the whole match), their 'level' being the number of stages they were entered within.
+    '''
+
+    def __init__(self, cprofile=False):
+        self.started = datetime.now()
+        self.clock = time.perf_counter()
+        self.stages = OrderedDict()
+        self.profile = cProfile.Profile() if cprofile else None
+        self.depth = 0
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        ''' Context manager timing the code run within it as the stage 'name', given the number of rows going into it.
+            Yields a dictionary in which the code may set 'rows_out', the number of rows coming out of the stage.
+        '''
+        counts = {'rows_in': rows_in, 'rows_out': None}
+        level = self.depth
+        # (recorded as it is entered, so that stages are listed in the order they began, outer before inner)
+        self._record(name, level)
+        if self.profile is not None and level == 0:
+            self.profile.enable()
+        self.depth += 1
+        wall, cpu = time.perf_counter(), _cpu_seconds()
+        try:
+            yield counts
+        finally:
+            wall, cpu = time.perf_counter() - wall, _cpu_seconds() - cpu
+            self.depth -= 1
+            if self.profile is not None and self.depth == 0:
+                self.profile.disable()
+            self._record(name, level, wall, cpu, counts)
+
+    def _record(self, name, level, wall=None, cpu=None, counts=None):
+        record = self.stages.setdefault(name, OrderedDict([
+            ('stage', name), ('level', level), ('calls', 0), ('wall_s', 0.0), ('cpu_s', 0.0), ('peak_rss_mb', None), ('rows_in', None), ('rows_out', None)
+        ]))
+        if counts is None:
+            return
+        record['calls'] += 1
+        record['wall_s'] += wall
+        record['cpu_s'] += cpu
+        record['peak_rss_mb'] = _peak_rss_mb()
+        for field in ['rows_in', 'rows_out']:
+            if counts[field] is not None:
+                record[field] = (record[field] or 0) + int(counts[field])
+
+    def report(self, **details):
+        ''' Function that returns the JSON-ready report of the run: the given details (e.g. the options and the numbers of
+            rows), the totals, and the records of the stages with their throughput ('rows_per_s', of rows in) and fan-out
+            ('fan_out', rows out per row in; for the merge, the number of candidates per incoming row)
+        '''
+        stages = []
+        for record in self.stages.values():
+            record = OrderedDict(record)
+            rows_in, rows_out = record['rows_in'], record['rows_out']
+            # (stages quicker than a millisecond get no throughput, which would be mostly noise)
+            record['rows_per_s'] = round(rows_in / record['wall_s'], 1) if rows_in is not None and record['wall_s'] >= 0.001 else None
+            record['fan_out'] = round(float(rows_out) / rows_in, 3) if rows_in and rows_out is not None else None
+            record['wall_s'], record['cpu_s'] = round(record['wall_s'], 4), round(record['cpu_s'], 4)
+            stages.append(record)
+
+        report = OrderedDict([('started', self.started.isoformat(timespec='seconds'))])
+        report.update(details)
+        report['totals'] = OrderedDict([
+            # (the time elapsed includes any time spent waiting on prompts; the stages' time, of the outermost ones, doesn't)
+            ('elapsed_s', round(time.perf_counter() - self.clock, 4)),
+            ('stages_wall_s', round(sum(record['wall_s'] for record in stages if record['level'] == 0), 4)),
+            ('stages_cpu_s', round(sum(record['cpu_s'] for record in stages if record['level'] == 0), 4)),
+            ('peak_rss_mb', _peak_rss_mb())
+        ])
+        report['stages'] = stages
+        return report
+
+    def write(self, path, **details):
+        ''' Function that writes the report (see report()) to <path>.profile.json, and the cProfile statistics, if
+            collected, to <path>.prof.  Returns the list of the files written.
+        '''
+        with open('%s.profile.json' % path, 'w', encoding='utf-8') as out:
+            json.dump(self.report(**details), out, ensure_ascii=False, indent=2, default=str)
+        written = ['%s.profile.json' % path]
+        if self.profile is not None:
+            self.profile.dump_stats('%s.prof' % path)
+            written.append('%s.prof' % path)
+        return written
+
+
+def start(cprofile=False):
+    ''' Function that starts recording the stages of the run in a new profiler, and returns it '''
+    global _active
+    _active = RunProfiler(cprofile)
+    return _active
+
+
+def stop():
+    ''' Function that stops recording, returning the profiler that was recording (None if there was none) '''
+    global _active
+    profiler, _active = _active, None
+    return profiler
+
+
+def start_from_environment():
+    ''' Function that starts a profiler if the CHGIS_PROFILE environment variable is set, returning it (or None) '''
+    setting = os.environ.get(PROFILE_VARIABLE, '').strip().lower()
+    if setting in ('', '0', 'no', 'off'):
+        return None
+    return start(cprofile=(setting == 'cprofile'))
+
+
+@contextmanager
+def stage(name, rows_in=None):
+    ''' Context manager timing the code within it as the stage 'name' of the profiler recording (see RunProfiler.stage()),
+        or doing nothing but yield a dictionary to set 'rows_out' in when none is
+    '''
+    if _active is None:
+        yield {'rows_in': rows_in, 'rows_out': None}
+    else:
+        with _active.stage(name, rows_in) as counts:
+            yield counts
+
+
+def timed_items(name, items):
+    ''' Generator of the items of the iterable, timing the getting of each of them (e.g. the reading of a chunk of a file)
+        as the stage 'name', with the rows of the item as the rows out
+    '''
+    items = iter(items)
+    finished = object()
+    while True:
+        with stage(name) as counts:
+            item = next(items, finished)
+            if item is not finished:
+                counts['rows_out'] = len(item)
+        if item is finished:
+            return
+        yield item
@@ -0,0 +1,113 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/spatial_index.py
+#
+# Helper module for geoname_match: a grid-hash index over the TARGET's decimal-degree coordinates, for finding every
+# target point within a given radius (in kilometres) of each incoming point without comparing all pairs of points.
+# All distance computations are done on whole numpy arrays at once; candidate pairs are returned in the same
+# 'target_pos'/'incoming_pos' layout used by match_index.merge_candidates()
+# Only non-core libraries used are pandas and numpy
+
+import pandas as pd
+import numpy as np
+
+
+# mean radius of the earth, and the length of one degree of latitude, in kilometres
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = EARTH_RADIUS_KM * np.pi / 180
+
+
+def haversine_km(x1, y1, x2, y2):
+    ''' Function that returns the great-circle distance in kilometres between points given as decimal-degree
+        longitudes (x) and latitudes (y).  Accepts scalars, numpy arrays or pandas Series, and works element-wise.
+    '''
+    x1, y1, x2, y2 = [np.radians(np.asarray(value, dtype=float)) for value in (x1, y1, x2, y2)]
+    a = np.sin((y2 - y1) / 2) ** 2 + np.cos(y1) * np.cos(y2) * np.sin((x2 - x1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def _cell_keys(cell_x, cell_y):
+    ''' Packs integer grid cell coordinates into a single int64 key per cell '''
+    return cell_x.astype(np.int64) * (1 << 32) + (cell_y.astype(np.int64) + (1 << 31))
+
+
+class GridIndex(object):
+    ''' Grid-hash spatial index over a set of points given as decimal-degree longitudes (x) and latitudes (y).
+        Points are bucketed into square cells of 'cell_degrees' and sorted by cell, so that the points of any cell
+        are found by binary search; a radius query then only measures distances to the points in the cells around
+        each query point.  Points with missing (NaN) coordinates are left out of the index.
+    '''
+
+    def __init__(self, x, y, cell_degrees=0.1):
+        x = np.asarray(pd.to_numeric(pd.Series(x), errors='coerce'), dtype=float)
+        y = np.asarray(pd.to_numeric(pd.Series(y), errors='coerce'), dtype=float)
+        valid = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+
+        self.cell_degrees = float(cell_degrees)
+        keys = _cell_keys(np.floor(x[valid] / self.cell_degrees), np.floor(y[valid] / self.cell_degrees))
+        order = np.argsort(keys, kind='mergesort')
+
+        self.keys = keys[order]
+        self.positions = valid[order]
+        self.x = x
+        self.y = y
+
+    def __len__(self):
+        return len(self.positions)
+
+    def within(self, x, y, radius_km, top_k=None):
+        ''' Function that finds, for every query point, all indexed points within 'radius_km' kilometres of it.
+            Returns a DataFrame with the fields 'target_pos', 'incoming_pos' and 'out_distance_km', ordered by query
+            point and then by distance.  If 'top_k' is given, only the nearest 'top_k' points are kept per query point.
+        '''
+        qx = np.asarray(pd.to_numeric(pd.Series(x), errors='coerce'), dtype=float)
+        qy = np.asarray(pd.to_numeric(pd.Series(y), errors='coerce'), dtype=float)
+        queries = np.flatnonzero(~(np.isnan(qx) | np.isnan(qy)))
+
+        # how many cells the radius spans: north-south it is constant, but east-west a degree of longitude shrinks
+        # towards the poles, so the reach is computed for the highest latitude the radius can get to
+        reach_y = int(np.ceil(radius_km / (KM_PER_DEGREE * self.cell_degrees)))
+        if len(queries):
+            max_lat = min(np.abs(qy[queries]).max() + radius_km / KM_PER_DEGREE, 89.0)
+        else:
+            max_lat = 0.0
+        reach_x = int(np.ceil(radius_km / (KM_PER_DEGREE * np.cos(np.radians(max_lat)) * self.cell_degrees)))
+
+        cell_x = np.floor(qx[queries] / self.cell_degrees)
+        cell_y = np.floor(qy[queries] / self.cell_degrees)
+
+        target_pos, incoming_pos = [], []
+        for offset_x in range(-reach_x, reach_x + 1):
+            for offset_y in range(-reach_y, reach_y + 1):
+                keys = _cell_keys(cell_x + offset_x, cell_y + offset_y)
+                starts = np.searchsorted(self.keys, keys, side='left')
+                counts = np.searchsorted(self.keys, keys, side='right') - starts
+                total = counts.sum()
+                if not total:
+                    continue
+                # expanding each query point's [start, start + count) run of sorted index entries into single rows
+                run_starts = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+                target_pos.append(self.positions[run_starts + np.arange(total)])
+                incoming_pos.append(np.repeat(queries, counts))
+
+        if target_pos:
+            target_pos = np.concatenate(target_pos)
+            incoming_pos = np.concatenate(incoming_pos)
+        else:
+            target_pos = incoming_pos = np.array([], dtype=np.int64)
+
+        distances = haversine_km(qx[incoming_pos], qy[incoming_pos], self.x[target_pos], self.y[target_pos])
+        pairs = pd.DataFrame({
+            'target_pos': target_pos,
+            'incoming_pos': incoming_pos,
+            'out_distance_km': distances
+        }, columns=['target_pos', 'incoming_pos', 'out_distance_km'])
+        pairs = pairs[pairs['out_distance_km'] <= radius_km]
+        pairs = pairs.sort_values(['incoming_pos', 'out_distance_km', 'target_pos'], kind='mergesort')
+
+        if top_k is not None:
+            pairs = pairs.groupby('incoming_pos', sort=False).head(top_k)
+        pairs['out_distance_km'] = pairs['out_distance_km'].round(3)
+        return pairs.reset_index(drop=True)
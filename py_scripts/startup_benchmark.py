@@ -0,0 +1,119 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/startup_benchmark.py
+#
+# Cold-start benchmark for the matcher: starts it (by default geoname_match_cli.py) several times, measuring how long
+# its first prompt takes to appear and the process's peak resident memory up to that point, and -- when run through
+# Python's '-X importtime' -- which heavy modules were already imported by then.
+# With --max-seconds and/or --max-rss-mb, exits with status 1 if the median run exceeds them, so that regressions in
+# cold start can be caught.  Also works on a bundled executable, e.g.:
+#   python3 startup_benchmark.py --command dist/geoname_match_cli/geoname_match_cli
+# Uses os.wait4() for the memory figures, and so only runs on Unix-like systems.
+
+import argparse
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# text of the matcher's first prompt
+FIRST_PROMPT = 'Please type the path of the INCOMING'
+
+# modules that have no business being imported before the first prompt
+HEAVY_MODULES = ['pandas', 'numpy', 'pyarrow', 'PyQt4', 'PyQt5', 'IPython', 'matplotlib', 'PIL', 'Cython', 'tkinter']
+
+
+def default_command():
+    ''' Returns the command running geoname_match_cli.py with the current Python, unbuffered and logging its imports '''
+    return [sys.executable, '-u', '-X', 'importtime', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'geoname_match_cli.py')]
+
+
+def imported_modules(log):
+    ''' Function that returns the names of the top-level packages listed in the output of '-X importtime' '''
+    modules = set()
+    for line in log.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            name = line.rsplit('|', 1)[1].strip()
+            if name != 'package':
+                modules.add(name.split('.')[0])
+    return modules
+
+
+def time_to_prompt(command, prompt=FIRST_PROMPT):
+    ''' Function that starts the command, waits for 'prompt' to appear in its output, then closes its input so that it exits.
+        Returns the number of seconds until the prompt appeared (None if it never did), the peak resident memory in MB,
+        and the set of top-level modules imported (empty unless the command logs its imports with '-X importtime').
+    '''
+    environment = dict(os.environ, PYTHONUNBUFFERED='1')
+    with tempfile.TemporaryFile() as errors:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=errors, env=environment)
+        seconds = None
+        for line in iter(process.stdout.readline, b''):
+            if prompt in line.decode('utf-8', 'replace'):
+                seconds = time.perf_counter() - started
+                break
+
+        # the matcher gives up on its first input() once its input is closed
+        process.stdin.close()
+        process.stdout.read()
+        process.stdout.close()
+        # (reaped here rather than by process.wait(), for the resource usage that os.wait4() returns)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        errors.seek(0)
+        modules = imported_modules(errors.read().decode('utf-8', 'replace'))
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    peak_rss_mb = usage.ru_maxrss / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+    return seconds, peak_rss_mb, modules
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures the time to the matcher's first prompt and its peak memory up to then.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-seconds', type=float, help="fail if the median time to the first prompt exceeds this")
+    parser.add_argument('--max-rss-mb', type=float, help="fail if the median peak resident memory exceeds this")
+    parser.add_argument('--command', nargs=argparse.REMAINDER, help="command to benchmark instead of geoname_match_cli.py")
+    arguments = parser.parse_args()
+    command = arguments.command or default_command()
+
+    print("Benchmarking: %s" % ' '.join(command))
+    timings, peaks, heavy = [], [], set()
+    for run in range(arguments.runs):
+        seconds, peak_rss_mb, modules = time_to_prompt(command)
+        if seconds is None:
+            print("The first prompt never appeared -- is this the matcher?")
+            return 1
+        timings.append(seconds)
+        peaks.append(peak_rss_mb)
+        heavy |= modules & set(HEAVY_MODULES)
+        print("run %s: first prompt after %.3f s, peak RSS %.1f MB" % (run + 1, seconds, peak_rss_mb))
+
+    print("\nmedian: first prompt after %.3f s, peak RSS %.1f MB" % (median(timings), median(peaks)))
+    if heavy:
+        print("heavy modules imported before the first prompt: %s" % ', '.join(sorted(heavy)))
+
+    failed = False
+    if arguments.max_seconds is not None and median(timings) > arguments.max_seconds:
+        print("FAILED: the first prompt took longer than %.3f s" % arguments.max_seconds)
+        failed = True
+    if arguments.max_rss_mb is not None and median(peaks) > arguments.max_rss_mb:
+        print("FAILED: peak RSS exceeded %.1f MB" % arguments.max_rss_mb)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
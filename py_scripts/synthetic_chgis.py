@@ -0,0 +1,351 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/synthetic_chgis.py
+#
+# Generator of synthetic CHGIS tables of any size (e.g. 10^4 to 10^7 rows), for benchmarking geoname_match and
+# version_merge at scales well beyond the sample data (see match_benchmark.py).
+# Names, administrative types, parent units and year spans are modelled on the real ones in input/PartOf.csv: each name
+# is a real name stem (e.g. 福建 / Fujian), drawn as often as it occurs there, optionally given one of a few common
+# prefixes (东, 新...) so that larger tables have more distinct names, plus a real administrative type (e.g. 路 / Lu).
+# As in the CHGIS, the same name thus recurs across periods and places.  Coordinates are scattered around a few hundred
+# centres over China proper.  Lower units have a higher-level unit whose years overlap theirs as their parent, and
+# higher-level units a dynasty.
+# The tables come in the CHGIS v5 layout (see chgis_schema.LAYOUTS), and can be turned into v6 (to_v6()), into the
+# PartOf table (part_of()), into a later release with some units changed, dropped and added (derive_release()), or
+# into incoming data drawn from them, with noise, in the standard 'input_*' fields (incoming_from()).
+#
+# Usage:
+#   python3 synthetic_chgis.py --rows 1000000 --output v5_synthetic.csv [--layout v6] [--part-of PartOf_synthetic.csv]
+#                              [--incoming incoming_synthetic.csv --incoming-rows 100000] [--seed 0]
+#
+# Only non-core libraries used are pandas and numpy
+
+import argparse
+import os.path
+import re
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from chgis_schema import LAYOUTS
+from name_keys import CHINESE_SUFFIXES
+
+
+# the CHGIS PartOf table the names are modelled on, where the repository keeps it
+PART_OF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'input', 'PartOf.csv')
+
+# (simplified, traditional, pinyin) stems and types used when no PartOf table is available
+FALLBACK_STEMS = [
+    ('福建', '福建', 'Fujian'), ('长安', '長安', "Chang'an"), ('洛阳', '洛陽', 'Luoyang'), ('蓟', '薊', 'Ji'),
+    ('临淄', '臨淄', 'Linzi'), ('江陵', '江陵', 'Jiangling'), ('成都', '成都', 'Chengdu'), ('吴', '吳', 'Wu'),
+    ('会稽', '會稽', 'Kuaiji'), ('南阳', '南陽', 'Nanyang'), ('广陵', '廣陵', 'Guangling'), ('安化', '安化', 'Anhua'),
+    ('永宁', '永寧', 'Yongning'), ('建安', '建安', "Jian'an"), ('丰城', '豐城', 'Fengcheng'), ('武康', '武康', 'Wukang')
+]
+FALLBACK_TYPES = [('县', '縣', 'Xian', 60), ('州', '州', 'Zhou', 15), ('郡', '郡', 'Jun', 10), ('府', '府', 'Fu', 6),
+                  ('路', '路', 'Lu', 3), ('侯国', '侯國', 'Houguo', 4), ('卫', '衛', 'Wei', 2)]
+FALLBACK_DYNASTIES = [('西汉', 'Xihan'), ('东汉', 'Donghan'), ('隋', 'Sui'), ('唐', 'Tang'), ('北宋', 'Beisong'), ('明', 'Ming')]
+
+# prefixes that, in the CHGIS as in this generator, tell apart units that share a stem: (simplified, traditional, pinyin)
+PREFIXES = [('东', '東', 'Dong'), ('西', '西', 'Xi'), ('南', '南', 'Nan'), ('北', '北', 'Bei'), ('新', '新', 'Xin'),
+            ('上', '上', 'Shang'), ('下', '下', 'Xia'), ('中', '中', 'Zhong'), ('大', '大', 'Da'), ('小', '小', 'Xiao'),
+            ('永', '永', 'Yong'), ('安', '安', 'An'), ('长', '長', 'Chang'), ('广', '廣', 'Guang')]
+
+# pinyin administrative types of the higher-level units, which are the parents of all other units
+PARENT_TYPES = ['Zhou', 'Jun', 'Fu', 'Lu', 'Dao', 'Sheng', 'Xingsheng', 'Junminfu', 'Zhilizhou', 'Dudufu', 'Duhufu']
+
+# the CHGIS covers 221 BCE to 1911
+FIRST_YEAR, LAST_YEAR = -221, 1911
+
+# number of centres the coordinates are scattered around, and their spread in degrees
+CENTRES, SPREAD = 400, 0.8
+
+# a name's stem and administrative type (e.g. 福建 and 路), using the types known to name_keys
+_CHINESE_SUFFIX = re.compile(r'^(.+?)(%s)$' % '|'.join(sorted(CHINESE_SUFFIXES, key=len, reverse=True)))
+
+
+def name_model(path=PART_OF_PATH):
+    ''' Function that reads the name stems, administrative types, dynasties and year spans found in the CHGIS PartOf table
+        at 'path', with how often each occurs.  Falls back on a few built-in ones if there is no such file.
+        Returns a dictionary of DataFrames ('stems', 'types', 'dynasties') and of numpy arrays ('begs', 'spans').
+    '''
+    if not os.path.isfile(path):
+        stems = pd.DataFrame(FALLBACK_STEMS, columns=['simp', 'trad', 'py'])
+        stems['count'] = 1
+        types = pd.DataFrame(FALLBACK_TYPES, columns=['simp', 'trad', 'py', 'count'])
+        dynasties = pd.DataFrame(FALLBACK_DYNASTIES, columns=['simp', 'py'])
+        begs = np.arange(FIRST_YEAR, LAST_YEAR, 50)
+        return {'stems': stems, 'types': types, 'dynasties': dynasties, 'begs': begs, 'spans': np.array([5, 20, 50, 100, 300])}
+
+    part_of = pd.read_csv(path, low_memory=False)
+    names = part_of[['CHILD_NMCH', 'CHILD_NMFT', 'CHILD_NMPY']].dropna()
+    names.columns = ['simp', 'trad', 'py']
+    # splitting 'Fujian Lu' / 福建路 into its stem and type, keeping the names where both are found
+    words = names['py'].str.rsplit(' ', n=1, expand=True).reindex(columns=[0, 1])
+    simp = names['simp'].str.extract(_CHINESE_SUFFIX)
+    trad = names['trad'].str.extract(_CHINESE_SUFFIX)
+    split = pd.DataFrame({
+        'stem_simp': simp[0].values, 'type_simp': simp[1].values, 'stem_trad': trad[0].values, 'type_trad': trad[1].values,
+        'stem_py': words[0].values, 'type_py': words[1].values
+    }).dropna()
+
+    def counted(frame, fields):
+        frame = frame.groupby(fields, sort=True).size().reset_index(name='count')
+        frame.columns = ['simp', 'trad', 'py', 'count']
+        return frame
+
+    # (the parents named by a single word of pinyin, e.g. 'Tang', being dynasties, if they are parents often enough)
+    dynasties = part_of.loc[part_of['PRT_NMPY'].astype(str).str.match(r'^[A-Za-z]+$'), ['PRT_NMCH', 'PRT_NMPY']]
+    counts = dynasties.groupby(['PRT_NMCH', 'PRT_NMPY']).size()
+    dynasties = counts[counts >= 20].reset_index()[['PRT_NMCH', 'PRT_NMPY']]
+    dynasties.columns = ['simp', 'py']
+    years = part_of[['BEG_YR', 'END_YR']].apply(pd.to_numeric, errors='coerce').dropna()
+    years = years[(years['END_YR'] >= years['BEG_YR'])]
+    return {
+        'stems': counted(split, ['stem_simp', 'stem_trad', 'stem_py']),
+        'types': counted(split, ['type_simp', 'type_trad', 'type_py']),
+        'dynasties': dynasties.reset_index(drop=True),
+        'begs': years['BEG_YR'].values.astype(np.int64),
+        'spans': (years['END_YR'] - years['BEG_YR']).values.astype(np.int64)
+    }
+
+
+def _draw(rng, frame, rows):
+    ''' Returns the positions of 'rows' rows of the frame drawn as often as their 'count' '''
+    weights = frame['count'].values.astype(float)
+    return rng.choice(len(frame.index), size=rows, p=weights / weights.sum())
+
+
+def _names(rng, model, rows, prefixed):
+    ''' Function that draws the names of 'rows' units, a share 'prefixed' of them with a prefix.  Returns a dictionary of
+        object arrays: their full names ('nm_simp', 'nm_trad', 'nm_py'), administrative types ('type_ch', 'type_py')
+        and present locations ('pres_loc').  Each distinct name is only built once, and shared by all the rows bearing it.
+    '''
+    stems = _draw(rng, model['stems'], rows)
+    prefixes = np.where(rng.random(rows) < prefixed, rng.integers(len(PREFIXES), size=rows), -1)
+    types = _draw(rng, model['types'], rows)
+    type_count, prefix_count = len(model['types'].index), len(PREFIXES) + 1
+    distinct, inverse = np.unique((stems * prefix_count + prefixes + 1) * type_count + types, return_inverse=True)
+    distinct_types = distinct % type_count
+    distinct_prefixes = (distinct // type_count) % prefix_count - 1
+    distinct_stems = distinct // type_count // prefix_count
+
+    names = OrderedDict([(field, []) for field in ['nm_simp', 'nm_trad', 'nm_py', 'pres_loc']])
+    stem_table, type_table = model['stems'].values, model['types'].values
+    for stem, prefix, kind in zip(distinct_stems, distinct_prefixes, distinct_types):
+        simp, trad, py = stem_table[stem][:3]
+        if prefix >= 0:
+            # ('An' + 'Ding' -> 'Anding', but 'Dong' + 'Anhua' -> "Dong'anhua", pinyin marking a syllable break before a vowel)
+            simp, trad = PREFIXES[prefix][0] + simp, PREFIXES[prefix][1] + trad
+            py = PREFIXES[prefix][2] + ("'" if py[:1].lower() in 'aeo' else '') + py.lower()
+        names['nm_simp'].append(simp + type_table[kind][0])
+        names['nm_trad'].append(trad + type_table[kind][1])
+        names['nm_py'].append('%s %s' % (py, type_table[kind][2]))
+        names['pres_loc'].append(simp[:2] + '市')
+
+    columns = OrderedDict((field, np.array(values, dtype=object)[inverse]) for field, values in names.items())
+    columns['type_ch'] = model['types']['simp'].values.astype(object)[types]
+    columns['type_py'] = model['types']['py'].values.astype(object)[types]
+    return columns
+
+
+def generate_target(rows, seed=0, model=None):
+    ''' Function that generates a synthetic CHGIS target of 'rows' rows in the v5 layout (see the top of this module).
+        Returns a DataFrame with the v5 fields, its 'sys_id's being 'hvd_1' onwards.
+    '''
+    rng = np.random.default_rng(seed)
+    model = model if model is not None else name_model()
+
+    # the larger the table, the more of its names are prefixed, so that the number of distinct names keeps growing
+    prefixed = min(0.9, 0.1 * max(1.0, np.log10(max(rows, 10)) - 3))
+    names = _names(rng, model, rows, prefixed)
+
+    picks = rng.integers(len(model['begs']), size=rows)
+    begs = np.clip(model['begs'][picks], FIRST_YEAR, LAST_YEAR)
+    ends = np.clip(begs + model['spans'][rng.integers(len(model['spans']), size=rows)], begs, LAST_YEAR)
+
+    # centres over China proper, weighted towards the east
+    centre_x = 100.0 + 22.0 * rng.beta(2.5, 1.5, size=CENTRES)
+    centre_y = 20.0 + 22.0 * rng.random(CENTRES)
+    centres = rng.integers(CENTRES, size=rows)
+    x = np.round(centre_x[centres] + rng.normal(0, SPREAD, rows), 5)
+    y = np.round(centre_y[centres] + rng.normal(0, SPREAD, rows), 5)
+
+    ids = np.arange(1, rows + 1)
+    target = pd.DataFrame(OrderedDict([
+        ('seq', ids),
+        ('sys_id', np.array(['hvd_%d' % number for number in ids], dtype=object)),
+        ('src', 'CHGIS'),
+        ('nm_py', names['nm_py']),
+        ('nm_simp', names['nm_simp']),
+        ('nm_trad', names['nm_trad']),
+        ('x_coord', x),
+        ('y_coord', y),
+        ('pres_loc', names['pres_loc']),
+        ('type_py', names['type_py']),
+        ('type_ch', names['type_ch']),
+        ('beg', begs),
+        ('end', ends),
+        ('obj_type', np.array(['POINT', 'POLYGON'], dtype=object)[(rng.random(rows) >= 0.9).astype(np.int64)]),
+    ]))
+    _add_parents(rng, model, target)
+    return target
+
+
+def _add_parents(rng, model, target):
+    ''' Adds the parent fields ('prnt_*') to the v5-layout target: a higher-level unit whose span overlaps theirs for
+        every other unit (where there is one), and a dynasty for the higher-level units themselves
+    '''
+    rows = len(target.index)
+    higher = np.flatnonzero(target['type_py'].isin(PARENT_TYPES).values)
+    parent = np.full(rows, -1, dtype=np.int64)
+    if len(higher):
+        # the higher-level units by beginning year; each unit takes one of those beginning shortly before it
+        order = higher[np.argsort(target['beg'].values[higher], kind='mergesort')]
+        starts = np.searchsorted(target['beg'].values[order], target['beg'].values, side='right') - 1
+        picks = np.clip(starts - rng.integers(0, 25, size=rows), 0, len(order) - 1)
+        parent = order[picks]
+        overlapping = target['end'].values[parent] >= target['beg'].values
+        parent[~overlapping] = -1
+    parent[higher] = -1
+
+    has_parent = parent >= 0
+    dynasty = model['dynasties'].iloc[rng.integers(len(model['dynasties'].index), size=rows)]
+    target['prnt_id'] = np.where(has_parent, parent + 1, 0)
+    target['prnt_sysid'] = np.where(has_parent, target['sys_id'].values[parent], '')
+    target['prnt_simp'] = np.where(has_parent, target['nm_simp'].values[parent], dynasty['simp'].values)
+    target['prnt_py'] = np.where(has_parent, target['nm_py'].values[parent], dynasty['py'].values)
+
+
+def part_of(target):
+    ''' Function that returns the PartOf table (see chgis_schema.LAYOUTS) of a v5-layout target from generate_target(),
+        one row per unit with a parent
+    '''
+    linked = target[target['prnt_id'] > 0]
+    ids = linked['sys_id'].str.replace('hvd_', '', regex=False).astype(np.int64)
+    return pd.DataFrame(OrderedDict([
+        ('CHILD_ID', ids.values),
+        ('CHILD_NMPY', linked['nm_py'].values),
+        ('CHILD_NMCH', linked['nm_simp'].values),
+        ('CHILD_NMFT', linked['nm_trad'].values),
+        ('BEG_YR', linked['beg'].values),
+        ('END_YR', linked['end'].values),
+        ('PRT_NMPY', linked['prnt_py'].values),
+        ('PRT_NMCH', linked['prnt_simp'].values),
+        ('PRT_ID', linked['prnt_id'].values)
+    ]))
+
+
+def to_v6(target):
+    ''' Function that returns a v5-layout target from generate_target() in the CHGIS v6 layout (see chgis_schema.LAYOUTS) '''
+    v6 = pd.DataFrame(OrderedDict([
+        ('beg_rule', 'Unknown'), ('beg_type', 'Year'), ('beg_yr', target['beg'].values),
+        ('checker', 'synthetic'), ('compiler', 'synthetic'), ('end_rule', 'Unknown'), ('end_type', 'Year'),
+        ('end_yr', target['end'].values), ('entry_date', '2016-08-11'), ('filename', 'synthetic'),
+        ('geo_comp', 'synthetic'), ('geo_src', target['src'].values), ('level', np.where(target['prnt_id'].values > 0, '6', '2')),
+        ('mdb_id', target['seq'].values), ('nm_py', target['nm_py'].values), ('nm_simp', target['nm_simp'].values),
+        ('nm_trad', target['nm_trad'].values), ('note_id', ''), ('obj_type', target['obj_type'].values),
+        ('orig_id', target['seq'].astype(str).values), ('pres_loc', target['pres_loc'].values),
+        ('sys_id', target['sys_id'].values), ('type_py', target['type_py'].values), ('type_simp', target['type_ch'].values),
+        ('x_coord', target['x_coord'].values), ('y_coord', target['y_coord'].values)
+    ]))
+    return v6[list(LAYOUTS['v6'].keys())]
+
+
+def derive_release(target, seed=1, changed=0.05, dropped=0.02, added=0.03, model=None):
+    ''' Function that derives a later release from a v5-layout target from generate_target(): a share 'changed' of its
+        units get new coordinates, years or names, a share 'dropped' are left out, and new units amounting to a share
+        'added' of it are appended (with new 'sys_id's).  Returns the new DataFrame, in the same layout.
+    '''
+    rng = np.random.default_rng(seed)
+    rows = len(target.index)
+    release = target[rng.random(rows) >= dropped].reset_index(drop=True)
+
+    kept = len(release.index)
+    which = rng.random(kept)
+    moved = np.flatnonzero(which < changed / 3)
+    redated = np.flatnonzero((which >= changed / 3) & (which < 2 * changed / 3))
+    renamed = np.flatnonzero((which >= 2 * changed / 3) & (which < changed))
+    release.loc[moved, 'x_coord'] = np.round(release.loc[moved, 'x_coord'].values + rng.normal(0, 0.05, len(moved)), 5)
+    release.loc[moved, 'y_coord'] = np.round(release.loc[moved, 'y_coord'].values + rng.normal(0, 0.05, len(moved)), 5)
+    release.loc[redated, 'end'] = np.clip(release.loc[redated, 'end'].values + rng.integers(1, 30, len(redated)), None, LAST_YEAR)
+    release.loc[renamed, 'nm_simp'] = '新' + release.loc[renamed, 'nm_simp'].values
+    release.loc[renamed, 'nm_trad'] = '新' + release.loc[renamed, 'nm_trad'].values
+    names_py = release.loc[renamed, 'nm_py'].astype(str)
+    release.loc[renamed, 'nm_py'] = ('Xin' + names_py.str[:1].str.lower() + names_py.str[1:]).values
+
+    new_rows = int(rows * added)
+    if new_rows:
+        new = generate_target(new_rows, seed=seed + 1000, model=model)
+        # (numbered on from the last unit, so that releases derived from derived releases don't reuse 'sys_id's)
+        last = int(target['seq'].max()) if rows else 0
+        ids = np.arange(last + 1, last + new_rows + 1)
+        new['seq'] = ids
+        new['sys_id'] = np.array(['hvd_%d' % number for number in ids], dtype=object)
+        # (parents within the new units only, renumbered accordingly)
+        new['prnt_id'] = np.where(new['prnt_id'].values > 0, new['prnt_id'].values + last, 0)
+        new['prnt_sysid'] = np.where(new['prnt_id'].values > 0, 'hvd_' + new['prnt_id'].astype(str).values, '')
+        release = pd.concat([release, new], ignore_index=True)
+    return release
+
+
+def incoming_from(target, rows, seed=2, unmatched=0.2, noise_km=2.0):
+    ''' Function that draws 'rows' incoming rows, in the standard 'input_*' fields (see field_mapping.py), from a
+        v5-layout target from generate_target(), as a gazetteer compiled elsewhere might give them: years off by a few
+        years, coordinates off by up to about 'noise_km', and a share 'unmatched' of names found nowhere in the target
+    '''
+    rng = np.random.default_rng(seed)
+    sample = target.iloc[rng.integers(len(target.index), size=rows)]
+    degrees = noise_km / 111.0
+    incoming = pd.DataFrame(OrderedDict([
+        ('input_id', np.arange(1, rows + 1)),
+        ('input_nm_py', sample['nm_py'].values),
+        ('input_nm_simp', sample['nm_simp'].values),
+        ('input_nm_trad', sample['nm_trad'].values),
+        ('input_type_ch', sample['type_ch'].values),
+        ('input_year_beg', sample['beg'].values + rng.integers(-3, 4, size=rows)),
+        ('input_year_end', sample['end'].values + rng.integers(-3, 4, size=rows)),
+        ('input_prnt', sample['prnt_simp'].values),
+        ('input_x_coord', np.round(sample['x_coord'].values + rng.uniform(-degrees, degrees, rows), 5)),
+        ('input_y_coord', np.round(sample['y_coord'].values + rng.uniform(-degrees, degrees, rows), 5))
+    ]))
+    # exact coordinates for some, as when both were taken from the same source
+    exact = rng.random(rows) < 0.3
+    incoming.loc[exact, 'input_x_coord'] = sample['x_coord'].values[exact]
+    incoming.loc[exact, 'input_y_coord'] = sample['y_coord'].values[exact]
+
+    missing = np.flatnonzero(rng.random(rows) < unmatched)
+    for field, mark in [('input_nm_simp', '無'), ('input_nm_trad', '無'), ('input_nm_py', 'Wu')]:
+        names = incoming.loc[missing, field].astype(str)
+        incoming.loc[missing, field] = mark + (names.str.lower() if field == 'input_nm_py' else names).values
+    return incoming
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic CHGIS table (and, optionally, its PartOf table and incoming data).")
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--output', required=True, help="path of the .csv file to write the table to")
+    parser.add_argument('--layout', choices=['v5', 'v6'], default='v5')
+    parser.add_argument('--part-of', help="path of a .csv file to write its PartOf table to")
+    parser.add_argument('--incoming', help="path of a .csv file to write incoming data drawn from it to")
+    parser.add_argument('--incoming-rows', type=int, help="number of incoming rows (default: a tenth of --rows)")
+    parser.add_argument('--seed', type=int, default=0)
+    arguments = parser.parse_args()
+
+    target = generate_target(arguments.rows, arguments.seed)
+    (to_v6(target) if arguments.layout == 'v6' else target).to_csv(arguments.output, index=False)
+    print("%s rows written to %s" % (len(target.index), arguments.output))
+    if arguments.part_of:
+        links = part_of(target)
+        links.to_csv(arguments.part_of, index=False)
+        print("%s links written to %s" % (len(links.index), arguments.part_of))
+    if arguments.incoming:
+        incoming = incoming_from(target, arguments.incoming_rows or max(arguments.rows // 10, 1), arguments.seed + 2)
+        incoming.to_csv(arguments.incoming, index=False)
+        print("%s incoming rows written to %s" % (len(incoming.index), arguments.incoming))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/target_cache.py
+#
+# Helper module for geoname_match and version_merge: an on-disk cache of parsed (and renamed) target tables such as
+# the CHGIS v5/v6 .csv files, stored in the uncompressed Feather (Arrow IPC) format.
+# A cached table is reloaded by memory-mapping the file rather than parsing text, and several processes loading the
+# same table share its pages through the operating system's page cache.
+# Cached tables are keyed by the source file's path, size, modification time and (when those change) content hash,
+# plus a 'variant' naming the normalization applied, so that a changed source is never served stale.
+# Requires pyarrow; without it, nothing is cached and tables are simply built from the source each time.
+
+import hashlib
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+
+
+# default location of the cache, overridable via the CHGIS_CACHE_DIR environment variable
+CACHE_DIR = os.environ.get('CHGIS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.chgis_cache'))
+
+
+def file_hash(path, block_size=1 << 20):
+    ''' Function that returns the SHA-1 hex digest of a file's contents '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_paths(source_path, variant, cache_dir):
+    ''' Returns the paths of the cached table and of its metadata for the given source file and variant '''
+    key = hashlib.sha1(('%s|%s' % (os.path.abspath(source_path), variant)).encode('utf-8')).hexdigest()
+    stem = os.path.join(cache_dir, '%s_%s' % (os.path.splitext(os.path.basename(source_path))[0], key[:16]))
+    return stem + '.feather', stem + '.json'
+
+
+def _write_atomically(path, write):
+    ''' Calls write(temporary_path), then moves the result into place, so that other processes never see a partial file '''
+    temporary_path = '%s.%s.tmp' % (path, os.getpid())
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def load_cached(source_path, variant, cache_dir=None):
+    ''' Function that returns the cached table for the source file and variant, along with the metadata stored with it
+        (see store_cached()), or (None, None) if there is no cache entry or the source file has changed since.
+    '''
+    if pyarrow is None:
+        return None, None
+    table_path, meta_path = _cache_paths(source_path, variant, cache_dir or CACHE_DIR)
+    if not (os.path.isfile(table_path) and os.path.isfile(meta_path)):
+        return None, None
+
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+    except (OSError, ValueError):
+        return None, None
+
+    status = os.stat(source_path)
+    if (meta['size'], meta['mtime']) != (status.st_size, status.st_mtime):
+        # the file has been touched: only its contents decide whether the cached table is still good
+        if meta['size'] != status.st_size or meta['sha1'] != file_hash(source_path):
+            return None, None
+        meta['mtime'] = status.st_mtime
+        _write_atomically(meta_path, lambda path: _dump_meta(meta, path))
+
+    try:
+        frame = pyarrow.feather.read_table(table_path, memory_map=True).to_pandas()
+    except (OSError, ValueError, pyarrow.ArrowException):
+        return None, None
+    return frame, meta['info']
+
+
+def _dump_meta(meta, path):
+    with open(path, 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file, ensure_ascii=False, indent=1)
+
+
+def store_cached(source_path, variant, frame, info=None, cache_dir=None):
+    ''' Function that stores a table in the cache for the source file and variant, along with 'info' (anything that
+        can be written as JSON, e.g. a field mapping).  Returns True if the table was cached.
+        Tables that Arrow can't store (e.g. columns mixing numbers and text) are simply not cached.
+    '''
+    if pyarrow is None:
+        return False
+    cache_dir = cache_dir or CACHE_DIR
+    table_path, meta_path = _cache_paths(source_path, variant, cache_dir)
+    status = os.stat(source_path)
+    meta = {
+        'source': os.path.abspath(source_path),
+        'variant': variant,
+        'size': status.st_size,
+        'mtime': status.st_mtime,
+        'sha1': file_hash(source_path),
+        'info': info
+    }
+
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        # uncompressed, so that the file can be memory-mapped as it is
+        frame = frame.reset_index(drop=True)
+        _write_atomically(table_path, lambda path: frame.to_feather(path, compression='uncompressed'))
+        _write_atomically(meta_path, lambda path: _dump_meta(meta, path))
+    except (OSError, ValueError, TypeError, pyarrow.ArrowException) as error:
+        print("Could not cache %s (%s); it will be parsed from the .csv file next time too." % (os.path.basename(source_path), error))
+        return False
+    return True
+
+
+def cached_frame(source_path, variant, build, cache_dir=None):
+    ''' Function that returns the table for the source file and variant from the cache if possible, and otherwise calls
+        build() -- which must return a DataFrame and its info, or info None if the result should not be cached --
+        and caches its result.  Returns the DataFrame and its info.
+    '''
+    frame, info = load_cached(source_path, variant, cache_dir)
+    if frame is not None:
+        return frame, info
+    frame, info = build()
+    if info is not None:
+        store_cached(source_path, variant, frame, info, cache_dir)
+    return frame, info
@@ -0,0 +1,11 @@
+# coding: utf-8
+#
+# /py_scripts/tests/conftest.py
+#
+# The modules of py_scripts import one another by their bare names, as when run from that folder: putting it on the
+# path lets the tests import them the same way, wherever pytest is run from.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
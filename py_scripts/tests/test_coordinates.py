@@ -0,0 +1,42 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_coordinates.py
+#
+# Fixed-point coordinates: parsing, comparing within a tolerance and rounding, and their use by the matcher.
+
+import numpy as np
+import pandas as pd
+
+from coordinates import to_fixed, to_units, fixed_equal, fixed_differ, round_fixed
+from match_engine import compare_coordinates, DEFAULT_OPTIONS
+
+
+def test_to_fixed_parses_numbers_and_text():
+    fixed = to_fixed(pd.Series(['119.64656', '119.646560', 119.64656, None, 'n/a']))
+    assert fixed.tolist()[:3] == [119646560] * 3
+    assert fixed.isna().tolist() == [False, False, False, True, True]
+
+
+def test_fixed_equal_and_differ():
+    first = to_fixed([1.0, 1.000002, None, None])
+    second = to_fixed([1.0, 1.0, 1.0, None])
+    np.testing.assert_array_equal(fixed_equal(first, second), [True, False, False, False])
+    np.testing.assert_array_equal(fixed_equal(first, second, to_units(0.000002)), [True, True, False, False])
+    # (two missing coordinates being the same, one missing coordinate a change)
+    np.testing.assert_array_equal(fixed_differ(first, second), [False, True, True, False])
+
+
+def test_round_fixed_halves_to_even():
+    fixed = to_fixed([0.125, 0.135, -2.5, 1.5, None])
+    assert round_fixed(fixed, 2).tolist()[:4] == [120000, 140000, -2500000, 1500000]
+    assert round_fixed(fixed, 0).tolist()[2:4] == [-2000000, 2000000]
+    assert round_fixed(fixed, 0).isna().tolist()[4]
+
+
+def test_compare_coordinates_strict_with_tolerance():
+    df = pd.DataFrame({'input_x_coord': ['119.64656', '119.64657', None], 'tgaz_x_coord': [119.646560, 119.64656, 119.64656]})
+    options = dict(DEFAULT_OPTIONS, coords=['x'], coord_mode='strict')
+    compare_coordinates(df, options)
+    assert df['out_x_coord_match'].tolist() == [True, False, False]
+    compare_coordinates(df, dict(options, coord_epsilon=0.00001))
+    assert df['out_x_coord_match'].tolist() == [True, True, False]
@@ -0,0 +1,24 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_field_mapping.py
+#
+# The cached snapshot of a default-mapped target being told apart by what its added columns are derived with.
+
+import coordinates
+import name_keys
+from field_mapping import snapshot_variant
+
+
+def test_snapshot_variant_follows_the_fold_table(monkeypatch):
+    variant = snapshot_variant()
+    assert snapshot_variant() == variant
+    folds = dict(name_keys.FOLD_TABLE)
+    folds[ord('㐀')] = ord('一')
+    monkeypatch.setattr(name_keys, 'FOLD_TABLE', folds)
+    assert snapshot_variant() != variant
+
+
+def test_snapshot_variant_follows_the_coordinate_scale(monkeypatch):
+    variant = snapshot_variant()
+    monkeypatch.setattr(coordinates, 'SCALE', coordinates.SCALE * 10)
+    assert snapshot_variant() != variant
@@ -0,0 +1,23 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_match_engine.py
+#
+# The frequency counts of the output fields written to the summary of a match.
+
+import pandas as pd
+
+from match_engine import count_values
+from year_overlap import classify_year_overlap
+
+
+def test_count_values_leaves_out_categories_not_found():
+    overlap = classify_year_overlap(pd.Series([900, 900]), pd.Series([950, 950]), pd.Series([900, 960]), pd.Series([950, 990]))
+    counts = count_values(pd.DataFrame({'out_year_overlap': overlap}), ['out_year_overlap'])
+    assert dict(counts['out_year_overlap']) == {'perfect_match': 1, '': 1}
+
+
+def test_count_values_accumulates_chunks():
+    first = pd.DataFrame({'out_year_overlap': classify_year_overlap(pd.Series([900]), pd.Series([950]), pd.Series([900]), pd.Series([950]))})
+    second = pd.DataFrame({'out_year_overlap': classify_year_overlap(pd.Series([900]), pd.Series([950]), pd.Series([951]), pd.Series([990]))})
+    counts = count_values(second, ['out_year_overlap'], count_values(first, ['out_year_overlap']))
+    assert dict(counts['out_year_overlap']) == {'perfect_match': 1, 'adjacent': 1}
@@ -0,0 +1,34 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_name_keys.py
+#
+# Edge cases of the name keys of name_keys: stems of names ending in characters that are also administrative types.
+
+import pandas as pd
+
+from name_keys import stem_keys, pinyin_keys
+
+
+def keys(function, names):
+    return function(pd.Series(names)).tolist()
+
+
+def test_stem_drops_the_administrative_type():
+    assert keys(stem_keys, ['曲陽縣', '曲陽郡', '曲陽', '安西都護府']) == ['曲陽', '曲陽', '曲陽', '安西']
+
+
+def test_stem_keeps_bare_names_ending_in_a_type():
+    assert keys(stem_keys, ['安國', '鄭州', '中國', '安州']) == ['安國', '鄭州', '中國', '安州']
+
+
+def test_bare_name_matches_its_suffixed_form():
+    assert keys(stem_keys, ['安國縣', '鄭州府']) == keys(stem_keys, ['安國', '鄭州'])
+
+
+def test_stem_leaves_one_type_and_missing_names():
+    assert keys(stem_keys, ['鄭州府', '縣', None])[:2] == ['鄭州', '縣']
+    assert pd.isna(keys(stem_keys, [None])[0])
+
+
+def test_pinyin_suffix_only_as_a_word():
+    assert keys(pinyin_keys, ['Quyang Xian', 'Anlu']) == ['quyang', 'anlu']
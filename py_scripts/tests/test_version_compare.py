@@ -0,0 +1,81 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_version_compare.py
+#
+# The keyed diff of version_compare: pairing v5 and v6 records by 'sys_id' and by the crosswalks of 'orig_id' and
+# 'mdb_id', and the change-set that follows.
+
+import numpy as np
+import pandas as pd
+
+from version_compare import pair_records, diff_versions
+
+
+def listed(values):
+    ''' Returns the values of a Series as a list, missing values as None '''
+    return [None if pd.isna(value) else value for value in values]
+
+
+def v5_table():
+    return pd.DataFrame({
+        'sys_id': ['hvd_1', 'hvd_2', 'hvd_3', 'hvd_4', 'hvd_5'],
+        'nm_simp': ['安县', '郑州', '临安县', '深州', '福建路'],
+        'x_coord': [112.01767, 113.6, 121.71233, 115.5, 119.3],
+        'y_coord': [40.13561, 34.7, 30.27634, 38.0, 26.1]
+    })
+
+
+def v6_table():
+    # hvd_1 kept its 'sys_id'; hvd_2 and hvd_3 lost theirs, but are found by the crosswalks of 'orig_id' and 'mdb_id';
+    # hvd_4 is gone; the record of 'sys_id' 9 is new, and its 'orig_id' of 5 doesn't count, its 'sys_id' being given
+    return pd.DataFrame({
+        'sys_id': ['hvd_1', None, None, 'hvd_9'],
+        'orig_id': [None, 2, None, 5],
+        'mdb_id': [None, None, 'hvd_3', None],
+        'nm_simp': ['安县', '郑州', '临安', '福建路'],
+        'x_coord': [112.01767, 113.6, 121.71233, 119.3],
+        'y_coord': [40.13561, 34.7, 30.27634, 26.1]
+    })
+
+
+def test_pair_records_by_sys_id_then_crosswalks():
+    partner, paired_by = pair_records(v5_table(), v6_table())
+    np.testing.assert_array_equal(partner, [0, 1, 2, -1, -1])
+    np.testing.assert_array_equal(paired_by, [0, 1, 2, -1, -1])
+
+
+def test_pair_records_skips_ambiguous_keys():
+    v6 = v6_table()
+    v6.loc[3, 'sys_id'] = None
+    v6.loc[3, 'orig_id'] = 2
+    partner, _ = pair_records(v5_table(), v6)
+    # ('orig_id' 2 being found twice, neither record is paired by it)
+    assert partner[1] == -1
+
+
+def test_diff_versions_change_set():
+    changes = diff_versions(v5_table(), v6_table())
+    assert listed(changes['change']) == ['modified', 'removed', 'removed', 'added']
+    assert listed(changes['v5_sys_id']) == ['hvd_3', 'hvd_4', 'hvd_5', None]
+    assert listed(changes['v6_sys_id']) == [None, None, None, 'hvd_9']
+    assert listed(changes['paired_by']) == ['sys_id/mdb_id', None, None, None]
+    assert listed(changes['changed_fields']) == ['nm_simp', None, None, None]
+
+
+
+def test_diff_versions_compares_coordinates_as_fixed_point():
+    # (the same coordinates, given with more digits or as text, aren't changes)
+    v6 = v6_table()
+    v6['x_coord'] = ['112.017670', 113.6, 121.71233, 119.3]
+    v6['y_coord'] = [40.13561, 34.7000001, 30.27634, 26.1]
+    assert listed(diff_versions(v5_table(), v6)['changed_fields']) == ['nm_simp', None, None, None]
+
+
+def test_diff_versions_coordinate_tolerance():
+    v6 = v6_table()
+    v6['x_coord'] = [112.01768, 113.6, 121.71233, 119.3]
+    # (hvd_1 moved by a hundred-thousandth of a degree: a change, unless within the tolerance)
+    exact = diff_versions(v5_table(), v6)
+    assert listed(exact['v5_sys_id'])[:2] == ['hvd_1', 'hvd_3']
+    assert listed(exact['changed_fields'])[0] == 'x_coord'
+    assert 'hvd_1' not in listed(diff_versions(v5_table(), v6, coord_epsilon=0.00001)['v5_sys_id'])
@@ -0,0 +1,70 @@
+# coding: utf-8
+#
+# /py_scripts/tests/test_version_delta.py
+#
+# Round-trips of version_delta: applying a delta rebuilds the new release, and chaining deltas gives the delta between
+# the releases at either end, on small synthetic releases (see synthetic_chgis.py).
+
+import pandas as pd
+import pytest
+
+from synthetic_chgis import generate_target, derive_release
+from version_delta import make_delta, apply_delta, compose_delta, summary
+
+
+def assert_same_records(frame, expected, key='sys_id'):
+    ''' Checks that the DataFrames hold the same records, with the same values and dtypes, whatever their order '''
+    pd.testing.assert_frame_equal(frame.sort_values(key).reset_index(drop=True), expected.sort_values(key).reset_index(drop=True))
+
+
+@pytest.fixture(scope='module')
+def releases():
+    first = generate_target(500)
+    second = derive_release(first, seed=1)
+    third = derive_release(second, seed=2)
+    return first, second, third
+
+
+def test_apply_rebuilds_the_new_release(releases):
+    first, second, _ = releases
+    delta = make_delta(first, second)
+    pd.testing.assert_frame_equal(apply_delta(first, delta), second)
+    assert sum(summary(delta).values()) == len(delta['changes'].index)
+
+
+def test_apply_rejects_another_release(releases):
+    first, second, third = releases
+    with pytest.raises(ValueError):
+        apply_delta(third, make_delta(first, second))
+
+
+def test_compose_chains_two_deltas(releases):
+    first, second, third = releases
+    composed = compose_delta(make_delta(first, second), make_delta(second, third))
+    assert_same_records(apply_delta(first, composed), third)
+
+
+def test_compose_with_additions_only(releases):
+    first, second, _ = releases
+    third = derive_release(second, seed=3, changed=0, dropped=0, added=0.01)
+    composed = compose_delta(make_delta(first, second), make_delta(second, third))
+    assert_same_records(apply_delta(first, composed), third)
+
+
+def test_compose_removed_then_added_again(releases):
+    first = releases[0]
+    second = first.drop(index=[5, 6]).reset_index(drop=True)
+    # (the records coming back, one of them changed)
+    returning = first.iloc[[5, 6]].copy()
+    returning.loc[returning.index[0], 'nm_py'] = 'Huilai Xian'
+    third = pd.concat([second, returning], ignore_index=True)
+
+    composed = compose_delta(make_delta(first, second), make_delta(second, third))
+    assert summary(composed) == {'added': 0, 'removed': 0, 'modified': 2}
+    assert_same_records(apply_delta(first, composed), third)
+
+
+def test_compose_rejects_deltas_that_dont_follow(releases):
+    first, second, third = releases
+    with pytest.raises(ValueError):
+        compose_delta(make_delta(second, third), make_delta(first, second))
@@ -0,0 +1,342 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/version_compare.py
+#
+# The duplicate checks of version_merge, as one pass over the concatenated CHGIS v5 and v6 tables: the values of each
+# compared field (or pair of fields) are factorized once into integer group codes, from which every row's duplicate
+# flag follows by counting the rows of its group.  The flags of all the comparisons are written into a single block of
+# boolean columns, added to the table in one go and without reordering its rows.
+# The flags are the same as those of pandas' duplicated(subset=..., keep=False): a row is flagged if any other row has
+# the same values in the compared fields, missing values counting as equal to one another.
+# It also makes the keyed diff of the two versions (see diff_versions()): each v5 record is paired with its v6 counterpart
+# by 'sys_id', or failing that by the crosswalks of the v6 'orig_id' and 'mdb_id', and the compared fields of the paired
+# records are checked for equality, giving a change-set of the added, removed and modified records.
+# Any number of releases (v5, v6 drafts, GISInfoTable exports, other deliveries...) can be merged at once (see
+# merge_releases()): their fields are mapped onto the v6 names of the compared fields, their records aligned in a single
+# hash join on 'sys_id', and each record's presence in every release, and whether it is the same there as in the first
+# release holding it, laid out side by side.  Each release adds one pass over its rows, rather than a comparison with
+# every other release.
+# Coordinates are compared as fixed-point integers (see coordinates.py), so that the same coordinate given with more or
+# fewer digits, or read as text, isn't taken for a change; the diff can also be given a tolerance for them.
+# Only non-core libraries used are pandas and numpy
+
+from collections import OrderedDict
+
+import pandas as pd
+import numpy as np
+
+from coordinates import to_fixed, to_units, fixed_differ
+
+
+# the fields of CHGIS v6 compared with those of v5 (v6 field, v5 field, flag field), in order, as listed in
+# 'Match_fields_from_V6_to_V5.csv'
+COMPARED_FIELDS = [
+    ('nm_py', 'nm_py', 'nm_py_duplicate'),
+    ('nm_simp', 'nm_simp', 'nm_simp_duplicate'),
+    ('nm_trad', 'nm_trad', 'nm_trad_duplicate'),
+    ('x_coord', 'x_coord', 'x_coord_duplicate'),
+    ('y_coord', 'y_coord', 'y_coord_duplicate'),
+    ('pres_loc', 'pres_loc', 'pres_loc_duplicate'),
+    ('type_py', 'type_py', 'type_py_duplicate'),
+    ('type_simp', 'type_ch', 'type_simp/ch_duplicate'),
+    ('beg_yr', 'beg', 'beg_yr_duplicate'),
+    ('end_yr', 'end', 'end_yr_duplicate'),
+    ('obj_type', 'obj_type', 'obj_type_duplicate')
+]
+
+# the compared fields holding coordinates (named the same in v5 and v6), compared by their fixed-point forms
+COORDINATE_FIELDS = ['x_coord', 'y_coord']
+
+# the keys pairing v5 records with v6 records (v5 field, v6 field), tried in order on the records not yet paired: the
+# 'sys_id' itself, then the crosswalks of v6's 'orig_id' (the MainTable's PT_ID / BOU_ID, from which its 'sys_id' is
+# made) and 'mdb_id' (the GISInfoTable's SYS_ID) to the number of v5's 'hvd_' 'sys_id'.  The first key is taken to be
+# authoritative: the crosswalks only pair the v6 records that have no value in it.
+DIFF_KEYS = [
+    ('sys_id', 'sys_id'),
+    ('sys_id', 'orig_id'),
+    ('sys_id', 'mdb_id')
+]
+
+
+def compared_values(values, field):
+    ''' Function that returns the values of a compared field in the form they are compared in: coordinates (see
+        COORDINATE_FIELDS) as fixed-point integers, other fields as they are
+    '''
+    return to_fixed(values) if field in COORDINATE_FIELDS else values
+
+
+def group_codes(frame, fields):
+    ''' Function that returns the group code of each row of the DataFrame by the values of the given fields, as an array
+        of integers from 0: rows with the same values (missing values counting as equal) get the same code
+    '''
+    codes = None
+    # (each field once, comparing a field with itself being comparing the field)
+    for field in dict.fromkeys(fields):
+        # (missing values, coded -1 by factorize(), make a group of their own)
+        field_codes, uniques = pd.factorize(compared_values(frame[field], field))
+        field_codes = field_codes.astype(np.int64) + 1
+        if codes is None:
+            codes = field_codes
+        else:
+            # combining the codes of the fields so far with this field's, and renumbering the combinations from 0 so
+            # that combining more fields can't overflow
+            codes = pd.factorize(codes * (len(uniques) + 1) + field_codes)[0].astype(np.int64)
+    return codes
+
+
+def duplicate_flags(codes):
+    ''' Function that returns, for the group code of each row, whether any other row has the same code '''
+    return np.bincount(codes)[codes] > 1
+
+
+def flag_duplicates(frame, comparisons):
+    ''' Function that returns the DataFrame with a boolean flag field added for each of the comparisons, a list of
+        (flag field, fields compared), telling whether any other row has the same values in the fields compared.
+        The flags are computed into one block and added at once; the rows keep their order.
+    '''
+    block = np.empty((len(frame.index), len(comparisons)), dtype=bool)
+    for number, (_, fields) in enumerate(comparisons):
+        block[:, number] = duplicate_flags(group_codes(frame, fields))
+    flags = pd.DataFrame(block, index=frame.index, columns=[flag_field for flag_field, _ in comparisons])
+    return pd.concat([frame, flags], axis=1)
+
+
+def compare_versions(frame, compared_fields=COMPARED_FIELDS):
+    ''' Function that runs the duplicate checks of version_merge on the concatenated v5 and v6 DataFrame: the flag of
+        duplicate 'sys_id's, the flags of the compared fields (see COMPARED_FIELDS), 'exact_match' (all of the
+        DataFrame's boolean fields are True), and 'content_only' / 'id_only' ('True' where everything but the 'sys_id'
+        is duplicated / only the 'sys_id' is, as strings).  Returns the new DataFrame, its rows in their original order.
+    '''
+    frame = flag_duplicates(frame, [('sys_id_duplicate', ['sys_id'])])
+    frame = flag_duplicates(frame, [(flag_field, [v6_field, v5_field]) for v6_field, v5_field, flag_field in compared_fields])
+    frame['exact_match'] = frame.select_dtypes(include='bool').all(axis=1)
+
+    flags = frame[[flag_field for _, _, flag_field in compared_fields]].values
+    frame['content_only'] = np.where(~frame['sys_id_duplicate'].values & flags.all(axis=1), 'True', 'False')
+    frame['id_only'] = np.where(frame['sys_id_duplicate'].values & ~flags.any(axis=1), 'True', 'False')
+    return frame
+
+# the default mapping of the fields of each known layout (see chgis_schema.LAYOUTS) onto the fields merged across
+# releases ({field of the release: merged field}), the latter named as in v6
+RELEASE_MAPPINGS = {
+    'v5': dict([('sys_id', 'sys_id')] + [(v5_field, v6_field) for v6_field, v5_field, _ in COMPARED_FIELDS]),
+    'v6': dict([('sys_id', 'sys_id')] + [(v6_field, v6_field) for v6_field, _, _ in COMPARED_FIELDS]),
+    'GISInfoTable': {
+        'SYS_ID': 'sys_id', 'NAME_PY': 'nm_py', 'NAME_CH': 'nm_simp', 'NAME_FT': 'nm_trad', 'X_COOR': 'x_coord',
+        'Y_COOR': 'y_coord', 'PRES_LOC': 'pres_loc', 'TYPE_PY': 'type_py', 'TYPE_CH': 'type_simp', 'BEG_YR': 'beg_yr',
+        'END_YR': 'end_yr', 'OBJ_TYPE': 'obj_type'
+    }
+}
+
+# the fields compared across releases, in order
+MERGED_FIELDS = [v6_field for v6_field, _, _ in COMPARED_FIELDS]
+
+
+def key_values(values):
+    ''' Function that returns the values of a key field as strings without the 'hvd_' prefix (e.g. 'hvd_1234', 1234 and
+        '1234' all giving '1234'), so that 'sys_id's can be looked up among 'orig_id's and 'mdb_id's.  Missing values stay missing.
+    '''
+    if pd.api.types.is_float_dtype(values):
+        # (IDs read as floats because of missing values, e.g. 1234.0)
+        values = values.astype('Int64')
+    return values.astype('string').str.strip().str.replace(r'^hvd_', '', regex=True).values
+
+
+def pair_records(v5, v6, keys=DIFF_KEYS):
+    ''' Function that pairs the records of the v5 and v6 DataFrames by the keys (see DIFF_KEYS), each key pairing only the
+        records left unpaired by the keys before it, and only by values found once among them on either side.  Keys
+        after the first only pair the v6 records without a value in the first key's field.
+        Returns, for each v5 record, the position of its v6 counterpart and the key that paired them (its position in
+        'keys'), both -1 for records left unpaired, as arrays.
+    '''
+    partner = np.full(len(v5.index), -1, dtype=np.int64)
+    paired_by = np.full(len(v5.index), -1, dtype=np.int8)
+    v6_open = np.ones(len(v6.index), dtype=bool)
+    for number, (v5_field, v6_field) in enumerate(keys):
+        if v5_field not in v5.columns or v6_field not in v6.columns:
+            continue
+        if number == 1 and keys[0][1] in v6.columns:
+            v6_open &= v6[keys[0][1]].isna().values
+        v5_rows, v6_rows = np.flatnonzero(partner < 0), np.flatnonzero(v6_open)
+        if not len(v5_rows) or not len(v6_rows):
+            break
+        # (the same field being compared as it is, and different fields by their 'hvd_' numbers)
+        if v5_field == v6_field:
+            v5_keys, v6_keys = v5[v5_field].iloc[v5_rows].reset_index(drop=True), v6[v6_field].iloc[v6_rows].reset_index(drop=True)
+        else:
+            v5_keys, v6_keys = pd.Series(key_values(v5[v5_field].iloc[v5_rows])), pd.Series(key_values(v6[v6_field].iloc[v6_rows]))
+        # (a value found more than once on either side can't tell which records belong together)
+        v5_usable = (v5_keys.notna() & ~v5_keys.duplicated(keep=False)).values
+        v6_usable = (v6_keys.notna() & ~v6_keys.duplicated(keep=False)).values
+
+        # looking up the v5 values in a hash index of the v6 values, once each
+        found = pd.Index(v6_keys.values[v6_usable]).get_indexer(v5_keys.values[v5_usable])
+        hits = found >= 0
+        v5_found, v6_found = v5_rows[v5_usable][hits], v6_rows[v6_usable][found[hits]]
+        partner[v5_found] = v6_found
+        paired_by[v5_found] = number
+        v6_open[v6_found] = False
+    return partner, paired_by
+
+
+def changed_values(old, new):
+    ''' Function that returns, for each pair of aligned values of the two Series, whether they differ (missing values
+        counting as equal to one another), as a boolean array
+    '''
+    if old.dtype == new.dtype and not isinstance(old.dtype, pd.CategoricalDtype):
+        old, new = old.reset_index(drop=True), new.reset_index(drop=True)
+        equal = (old == new).fillna(False).to_numpy(dtype=bool)
+        return ~(equal | (old.isna().values & new.isna().values))
+    # (otherwise both factorized together, so that values of different dtypes, e.g. categoricals with different
+    # categories, compare by their values)
+    codes = pd.factorize(pd.concat([old.reset_index(drop=True), new.reset_index(drop=True)], ignore_index=True))[0]
+    return codes[:len(old.index)] != codes[len(old.index):]
+
+
+def diff_versions(v5, v6, compared_fields=COMPARED_FIELDS, keys=DIFF_KEYS, coord_epsilon=0):
+    ''' Function that returns the change-set from the v5 DataFrame to the v6 DataFrame, one row per record that is
+        'modified' (paired, see pair_records(), but differing in any of the compared fields found in both), 'removed'
+        (a v5 record without a v6 counterpart) or 'added' (a v6 record without a v5 counterpart), with the fields:
+            'change'          'modified', 'removed' or 'added'
+            'v5_sys_id'       the 'sys_id' of the v5 record (missing for added records)
+            'v6_sys_id'       the 'sys_id' of the v6 record (missing for removed records)
+            'paired_by'       the key pairing the records, e.g. 'sys_id' or 'sys_id/orig_id' (v5 field/v6 field)
+            'changed_fields'  the compared fields that differ, named as in the flags of compare_versions() without
+                              '_duplicate' and separated by ', ' (e.g. 'nm_simp, x_coord')
+        Modified and removed records come in the order of v5, then added records in the order of v6.
+        Records that are the same in every compared field are left out.  Coordinates within 'coord_epsilon' degrees of
+        one another count as the same.
+    '''
+    partner, paired_by = pair_records(v5, v6, keys)
+    v5_pairs = np.flatnonzero(partner >= 0)
+    v6_pairs = partner[v5_pairs]
+
+    # a bit for each compared field found in both versions, set where the paired records differ in it
+    compared = [(v6_field, v5_field, flag_field.replace('_duplicate', '')) for v6_field, v5_field, flag_field in compared_fields
+                if v6_field in v6.columns and v5_field in v5.columns]
+    bits = np.zeros(len(v5.index), dtype=np.int64)
+    epsilon = to_units(coord_epsilon)
+    for bit, (v6_field, v5_field, _) in enumerate(compared):
+        old, new = v5[v5_field].iloc[v5_pairs], v6[v6_field].iloc[v6_pairs]
+        if v6_field in COORDINATE_FIELDS:
+            differ = fixed_differ(to_fixed(old), to_fixed(new), epsilon)
+        else:
+            differ = changed_values(old, new)
+        bits[v5_pairs] |= differ.astype(np.int64) << bit
+
+    # the modified and removed records, in the order of v5, then the added records, in the order of v6
+    rows = np.flatnonzero((partner < 0) | (bits > 0))
+    added = np.ones(len(v6.index), dtype=bool)
+    added[v6_pairs] = False
+    added = np.flatnonzero(added)
+    modified = partner[rows] >= 0
+
+    # writing out the list of fields once for each distinct combination of changed fields
+    combination_codes, combinations = pd.factorize(bits[rows])
+    lists = np.array([', '.join(name for bit, (_, _, name) in enumerate(compared) if combination >> bit & 1) or None
+                      for combination in combinations] + [None], dtype=object)
+    key_names = np.array(['%s/%s' % key if key[0] != key[1] else key[0] for key in keys] + [None], dtype=object)
+
+    v5_ids = np.asarray(v5['sys_id'].values if 'sys_id' in v5.columns else np.full(len(v5.index), None), dtype=object)
+    v6_ids = np.asarray(v6['sys_id'].values if 'sys_id' in v6.columns else np.full(len(v6.index), None), dtype=object)
+    v6_ids = np.append(v6_ids, None)
+    return pd.DataFrame({
+        'change': np.concatenate([np.where(modified, 'modified', 'removed').astype(object), np.full(len(added), 'added', dtype=object)]),
+        'v5_sys_id': np.concatenate([v5_ids[rows], np.full(len(added), None, dtype=object)]),
+        # (position -1, of the records left unpaired, picking the None appended to the lists)
+        'v6_sys_id': np.concatenate([v6_ids[partner[rows]], v6_ids[added]]),
+        'paired_by': np.concatenate([key_names[paired_by[rows]], np.full(len(added), None, dtype=object)]),
+        'changed_fields': np.concatenate([lists[combination_codes], np.full(len(added), None, dtype=object)])
+    }, columns=['change', 'v5_sys_id', 'v6_sys_id', 'paired_by', 'changed_fields'])
+
+
+def joint_codes(values):
+    ''' Function that factorizes a list of Series together, returning an array of codes for each: values equal across
+        the Series get the same code, and missing values -1.  Each Series is factorized in its own dtype, and only the
+        distinct values of each are compared with those of the others.
+    '''
+    if all(value.dtype == values[0].dtype for value in values) and not isinstance(values[0].dtype, pd.CategoricalDtype):
+        # (values of one dtype being factorized together as they are)
+        codes = pd.factorize(pd.concat(values, ignore_index=True))[0]
+        return np.split(codes, np.cumsum([len(value.index) for value in values])[:-1])
+    factorized = [pd.factorize(value) for value in values]
+    uniques = pd.concat([pd.Series(np.asarray(release_uniques, dtype=object)) for _, release_uniques in factorized], ignore_index=True)
+    unique_codes = pd.factorize(uniques)[0]
+    codes, start = [], 0
+    for release_codes, release_uniques in factorized:
+        mapped = unique_codes[start:start + len(release_uniques)]
+        start += len(release_uniques)
+        codes.append(np.where(release_codes >= 0, mapped[np.maximum(release_codes, 0)] if len(mapped) else -1, -1))
+    return codes
+
+
+def merge_releases(releases, key='sys_id', fields=MERGED_FIELDS):
+    ''' Function that merges any number of releases, given as a list of (name, DataFrame, mapping) in order, each mapping
+        ({field of the release: merged field}, see RELEASE_MAPPINGS) naming the release's key field and any of the
+        'fields' it has.  The records of all releases are aligned by their keys (see key_values()), a record found more
+        than once in a release counting as its first row there; rows without a key are left out.
+        Returns a DataFrame with one row per record, in the order they are first found, with the fields:
+            'sys_id'              the key, as given by the first release holding the record
+            'releases'            the number of releases holding the record
+            'in_<name>'           whether the release holds the record
+            'same_<name>'         whether the record is the same there, in every field the release has, as in the first
+                                  release holding it (missing where the release doesn't hold it)
+            'changed_<name>'      the fields in which it differs (e.g. 'nm_simp, x_coord'), if any
+    '''
+    names = [name for name, _, _ in releases]
+    if len(set(names)) != len(names):
+        raise ValueError("The releases need different names")
+    # (the merged fields, and the fields of each release they are found in)
+    columns = [dict((merged, field) for field, merged in mapping.items() if field in frame.columns) for _, frame, mapping in releases]
+    for name, fields_of in zip(names, columns):
+        if key not in fields_of:
+            raise ValueError("No field of the release '%s' is mapped onto the key '%s'" % (name, key))
+
+    # one hash join of the keys of all the releases at once, numbering the records from 0 in the order found
+    codes, uniques = pd.factorize(np.concatenate([key_values(frame[fields_of[key]]) for (_, frame, _), fields_of in zip(releases, columns)]))
+    rows = np.full((len(uniques), len(releases)), -1, dtype=np.int64)
+    start = 0
+    for number, (_, frame, _) in enumerate(releases):
+        release_codes = codes[start:start + len(frame.index)]
+        start += len(frame.index)
+        found = np.flatnonzero(release_codes >= 0)
+        # (written last row first, so that the first row of a record found more than once is the one kept)
+        rows[release_codes[found[::-1]], number] = found[::-1]
+    present = rows >= 0
+    first = present.argmax(axis=1)
+
+    # for each field, the values of all releases factorized together, and compared with those of each record's first release
+    bits = np.zeros(rows.shape, dtype=np.int64)
+    compared = [field for field in fields if field != key]
+    for bit, field in enumerate(compared):
+        holding = [number for number, fields_of in enumerate(columns) if field in fields_of]
+        value_codes = np.full(rows.shape, -2, dtype=np.int64)
+        values = [compared_values(releases[number][1][columns[number][field]].iloc[rows[present[:, number], number]].reset_index(drop=True), field)
+                  for number in holding]
+        if not values:
+            continue
+        for number, release_codes in zip(holding, joint_codes(values)):
+            value_codes[present[:, number], number] = release_codes
+        reference = value_codes[np.arange(len(uniques)), first]
+        # (a release without the field, or a first release without it, telling nothing of whether it changed)
+        differs = present & (value_codes != reference[:, None]) & (value_codes != -2) & (reference[:, None] != -2)
+        bits |= differs.astype(np.int64) << bit
+
+    keys = np.empty(len(uniques), dtype=object)
+    for number, (_, frame, _) in enumerate(releases):
+        firsts = np.flatnonzero(first == number)
+        keys[firsts] = np.asarray(frame[columns[number][key]].iloc[rows[firsts, number]].values, dtype=object)
+    merged = OrderedDict([(key, keys), ('releases', present.sum(axis=1))])
+    combination_codes, combinations = pd.factorize(bits.ravel())
+    lists = np.array([', '.join(field for bit, field in enumerate(compared) if combination >> bit & 1) or None
+                      for combination in combinations], dtype=object)
+    changed = lists[combination_codes].reshape(bits.shape)
+    for number, name in enumerate(names):
+        merged['in_%s' % name] = present[:, number]
+    for number, name in enumerate(names):
+        merged['same_%s' % name] = pd.array(np.where(present[:, number], bits[:, number] == 0, None), dtype='boolean')
+    for number, name in enumerate(names):
+        merged['changed_%s' % name] = np.where(present[:, number], changed[:, number], None)
+    return pd.DataFrame(merged)
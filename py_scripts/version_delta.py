@@ -0,0 +1,365 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/version_delta.py
+#
+# Helper module for version_merge: a compact delta between two releases of a CHGIS table (e.g. v5 and v6, or v6 and
+# v7), keyed on 'sys_id', from which the later release can be rebuilt and through which releases can be chained.
+# A delta holds one row per record that was added, removed or modified, with the bitmask of the fields changed and
+# their new values (see make_delta()).  apply_delta() rebuilds the later release from the earlier one and the delta,
+# and compose_delta() chains two deltas (v5 to v6, then v6 to v7) into one (v5 to v7) without the release in between.
+# Each delta carries the fingerprints of the contents of both releases, so that applying it to the wrong table, or
+# chaining deltas that don't follow one another, is caught.
+# Deltas are stored as an uncompressed Feather (Arrow IPC) file of the changed records, which keeps their dtypes, and
+# a .json file of the rest, as the cached tables are (see target_cache.py).
+#
+# Usage:
+#   python3 version_delta.py make v5.csv v6.csv v5_to_v6     (writes v5_to_v6.feather and v5_to_v6.json)
+#   python3 version_delta.py apply v5.csv v5_to_v6 v6_rebuilt.csv
+#   python3 version_delta.py compose v5_to_v6 v6_to_v7 v5_to_v7
+#
+# Requires pyarrow to write and read deltas.
+# Only non-core libraries used are pandas and numpy
+
+import argparse
+import hashlib
+import json
+
+import pandas as pd
+import numpy as np
+
+from chgis_schema import read_table
+from match_cache import row_hashes
+from target_cache import pyarrow, _write_atomically
+from version_compare import pair_records, changed_values
+
+
+# fields of a delta's changed records besides the fields of the release: the kind of change ('added', 'removed' or
+# 'modified'), and the bitmask of the fields given (1 for the first of the delta's 'fields', 2 for the second...)
+CHANGE_FIELD, CHANGED_FIELD = '_change', '_changed'
+
+
+def _fingerprint(fields, hashes):
+    # (the hashes of the rows summed, wrapping around, so that the order of the rows doesn't matter)
+    digest = hashlib.sha1(json.dumps([str(field) for field in fields]).encode('utf-8'))
+    digest.update(np.array([len(hashes), np.sum(hashes, dtype=np.uint64)], dtype=np.uint64).tobytes())
+    return digest.hexdigest()
+
+
+def content_fingerprint(frame):
+    ''' Function that returns the SHA-1 hex digest of the fields and contents of a DataFrame, regardless of the order of
+        its rows (a release rebuilt from a delta lists its records in an order of its own, see apply_delta())
+    '''
+    return _fingerprint(frame.columns, row_hashes(frame))
+
+
+def _check_keys(frame, key, name):
+    keys = frame[key]
+    if keys.isna().any() or keys.duplicated().any():
+        raise ValueError("The key '%s' of the %s release is missing or repeated in some records" % (key, name))
+
+
+def _nullable(dtype):
+    ''' Returns the nullable counterpart of a dtype of plain integers or booleans (e.g. 'Int16' for int16), which can hold
+        missing values; other dtypes are returned as they are
+    '''
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iub':
+        return 'boolean' if dtype.kind == 'b' else '%sInt%d' % ('U' if dtype.kind == 'u' else '', dtype.itemsize * 8)
+    return dtype
+
+
+def make_delta(old, new, key='sys_id'):
+    ''' Function that returns the delta from the 'old' DataFrame to the 'new' one, whose records are paired by 'key'
+        (see version_compare.pair_records()), as a dict:
+            'key'                 the key field
+            'fields'              the fields of the new release, in order
+            'dtypes'              the dtype of each of them, by name
+            'kept_fields'         the fields the new release has in common with the old one, which are carried over
+                                  from it (the others start out missing, and are given by the delta)
+            'base_fields'         the fields of the old release
+            'base_rows', 'rows'   the numbers of records of the old and new releases
+            'base_fingerprint', 'fingerprint'
+                                  the fingerprints of the contents of the old and new releases (see content_fingerprint())
+            'changes'             a DataFrame of the changed records: the key, CHANGE_FIELD, CHANGED_FIELD and the fields
+                                  of the new release, holding the new values of the fields changed (of every field, for
+                                  added records) and missing values otherwise
+        The key must be given, and found once, in every record of both releases.
+    '''
+    _check_keys(old, key, 'old')
+    _check_keys(new, key, 'new')
+    fields = list(new.columns)
+    if len(fields) > 63:
+        raise ValueError("A delta can't describe tables of more than 63 fields")
+    kept_fields = [field for field in fields if field in old.columns]
+
+    partner, _ = pair_records(old, new, [(key, key)])
+    old_pairs = np.flatnonzero(partner >= 0)
+    new_pairs = partner[old_pairs]
+
+    # a bit for each field in which the paired records differ (for fields the old release lacks, any value differs)
+    bits = np.zeros(len(old_pairs), dtype=np.int64)
+    for bit, field in enumerate(fields):
+        if field in kept_fields:
+            changed = changed_values(old[field].iloc[old_pairs], new[field].iloc[new_pairs])
+        else:
+            changed = new[field].iloc[new_pairs].notna().values
+        bits |= changed.astype(np.int64) << bit
+
+    modified = bits > 0
+    removed = np.flatnonzero(partner < 0)
+    added = np.ones(len(new.index), dtype=bool)
+    added[new_pairs] = False
+    added = np.flatnonzero(added)
+
+    # (removed records taking the place of any record of the new release, until all but their key is blanked out)
+    modified_bits = bits[modified]
+    rows = np.concatenate([new_pairs[modified], added, np.zeros(len(removed), dtype=np.int64)])
+    changes = new.iloc[rows].reset_index(drop=True) if len(new.index) else new.reindex(range(len(removed)))
+    changes[key] = pd.concat([changes[key].iloc[:len(rows) - len(removed)], old[key].iloc[removed]], ignore_index=True).astype(new[key].dtype)
+    for bit, field in enumerate(fields):
+        if field == key:
+            continue
+        # (the values of the fields a modified record kept as they were are left out, as missing values)
+        blank = np.concatenate([np.flatnonzero((modified_bits >> bit & 1) == 0), np.arange(len(rows) - len(removed), len(rows))])
+        # (plain integers and booleans stored in their nullable counterparts whether or not any value is blanked out,
+        # so that deltas of the same fields can always be chained, see compose_delta())
+        changes[field] = changes[field].astype(_nullable(changes[field].dtype))
+        if len(blank):
+            changes.loc[blank, field] = None
+    changes.insert(1, CHANGE_FIELD, np.repeat(['modified', 'added', 'removed'], [len(modified_bits), len(added), len(removed)]).astype(object))
+    changes.insert(2, CHANGED_FIELD, np.concatenate([
+        modified_bits, np.full(len(added), (1 << len(fields)) - 1, dtype=np.int64), np.zeros(len(removed), dtype=np.int64)
+    ]))
+    changes = changes[[key, CHANGE_FIELD, CHANGED_FIELD] + [field for field in fields if field != key]]
+
+    return {
+        'key': key,
+        'fields': fields,
+        'dtypes': dict((field, str(new[field].dtype)) for field in fields),
+        'kept_fields': kept_fields,
+        'base_fields': list(old.columns),
+        'base_rows': len(old.index),
+        'rows': len(new.index),
+        'base_fingerprint': content_fingerprint(old),
+        'fingerprint': content_fingerprint(new),
+        'changes': changes
+    }
+
+
+def summary(delta):
+    ''' Function that returns the numbers of records added, removed and modified by a delta, as a dict '''
+    counts = delta['changes'][CHANGE_FIELD].value_counts()
+    return dict((change, int(counts.get(change, 0))) for change in ['added', 'removed', 'modified'])
+
+
+def _patched(column, positions, values):
+    ''' Returns a copy of the column (a Series) with the values at the given positions replaced, in the dtype of the
+        values (categoricals getting any categories they lack)
+    '''
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        if not isinstance(column.dtype, pd.CategoricalDtype):
+            column = column.astype('category')
+        missing = dtype.categories.difference(column.cat.categories)
+        column = column.cat.add_categories(missing) if len(missing) else column.copy()
+    elif column.dtype != dtype:
+        column = column.astype(dtype)
+    else:
+        column = column.copy()
+    if len(positions):
+        column.iloc[positions] = values.values
+    return column
+
+
+def apply_delta(old, delta, check=True):
+    ''' Function that rebuilds the new release from the old one (a DataFrame) and the delta from one to the other (see
+        make_delta()).  The records kept come in the order of the old release, followed by those added, in the order of
+        the delta.  If 'check' is True, the old release is checked against the delta's fingerprints before, and the new
+        one after; a ValueError is raised if either doesn't match.
+    '''
+    key, changes = delta['key'], delta['changes']
+    if check:
+        hashes = row_hashes(old)
+        if _fingerprint(old.columns, hashes) != delta['base_fingerprint']:
+            raise ValueError("The table isn't the release the delta was made from")
+
+    # locating the records removed and modified in the old release
+    positions = pd.Index(old[key]).get_indexer(changes[key])
+    kinds = changes[CHANGE_FIELD].values
+    if ((positions < 0) & (kinds != 'added')).any() or ((positions >= 0) & (kinds == 'added')).any():
+        raise ValueError("The records of the delta don't match those of the table")
+    kept = np.ones(len(old.index), dtype=bool)
+    kept[positions[kinds == 'removed']] = False
+
+    modified = np.flatnonzero(kinds == 'modified')
+    added = changes.iloc[np.flatnonzero(kinds == 'added')]
+    bits = changes[CHANGED_FIELD].values[modified]
+    columns = {}
+    for bit, field in enumerate(delta['fields']):
+        values = changes[field]
+        if field in delta['kept_fields']:
+            column = old[field]
+        else:
+            column = pd.Series(None, index=old.index, dtype=values.dtype)
+        given = modified[(bits >> bit & 1) == 1]
+        column = _patched(column.reset_index(drop=True), positions[given], values.iloc[given])
+        column = _patched(column[kept].reset_index(drop=True), [], added[field])
+        columns[field] = pd.concat([column, added[field].astype(column.dtype)], ignore_index=True)
+    new = pd.DataFrame(columns, columns=delta['fields'])
+    # (fields of plain integers or booleans having been given missing values in the delta, see make_delta())
+    for field, dtype in delta['dtypes'].items():
+        if dtype.startswith(('int', 'uint', 'bool')) and new[field].notna().all():
+            new[field] = new[field].astype(dtype)
+
+    if check:
+        if delta['fields'] == list(old.columns):
+            # (the records carried over as they were keep their hashes, leaving only those the delta gives to be hashed)
+            carried = kept.copy()
+            carried[positions[modified]] = False
+            given = np.flatnonzero(~carried[kept])
+            hashes = np.concatenate([hashes[carried], row_hashes(new.iloc[np.concatenate([given, np.arange(kept.sum(), len(new.index))])])])
+        else:
+            hashes = row_hashes(new)
+        if _fingerprint(new.columns, hashes) != delta['fingerprint']:
+            raise ValueError("The table rebuilt from the delta isn't the release the delta was made for")
+    return new
+
+
+def _restored(values, dtype):
+    # the values (a Series of objects) in the given dtype, categoricals getting the categories of their values, and
+    # plain integers and booleans being made nullable (the records of one delta having no values in the fields the
+    # other gives)
+    return values.astype('category' if isinstance(dtype, pd.CategoricalDtype) else _nullable(dtype))
+
+
+def compose_delta(first, second):
+    ''' Function that chains two deltas, the first from a release A to a release B and the second from B to a release C
+        (see make_delta()), into the delta from A to C.  A ValueError is raised if the second delta wasn't made from
+        the release the first was made for, or if their changes contradict one another (e.g. a record modified after
+        being removed).
+    '''
+    if second['base_fingerprint'] != first['fingerprint'] or second['key'] != first['key']:
+        raise ValueError("The second delta wasn't made from the release the first was made for")
+    key, fields = first['key'], second['fields']
+    old, new = first['changes'], second['changes']
+
+    # the first delta's records in the fields of C: bits of the fields B has no more dropped, the others moved to the
+    # fields' places in C
+    old_bits = np.zeros(len(old.index), dtype=np.int64)
+    for bit, field in enumerate(first['fields']):
+        if field in fields:
+            old_bits |= (old[CHANGED_FIELD].values >> bit & 1) << fields.index(field)
+    old = old.reindex(columns=[key, CHANGE_FIELD] + [field for field in fields if field != key])
+
+    # pairing the records of both deltas by key: records changed by one delta only are taken as they are
+    where = pd.Index(old[key]).get_indexer(new[key])
+    both_new = np.flatnonzero(where >= 0)
+    both_old = where[both_new]
+    only_old = np.ones(len(old.index), dtype=bool)
+    only_old[both_old] = False
+    only_old = np.flatnonzero(only_old)
+    only_new = np.flatnonzero(where < 0)
+
+    kinds = pd.Series(old[CHANGE_FIELD].values[both_old]) + '/' + pd.Series(new[CHANGE_FIELD].values[both_new])
+    # the change from A to C of records changed by both: added then modified still being added, removed then added
+    # being modified in every field, and added then removed not being there at all
+    outcomes = {'added/modified': 'added', 'modified/modified': 'modified', 'modified/removed': 'removed',
+                'removed/added': 'modified', 'added/removed': None}
+    unknown = sorted(set(kinds) - set(outcomes))
+    if unknown:
+        raise ValueError("The deltas contradict one another (%s)" % ', '.join(unknown))
+    outcome = kinds.map(outcomes).values
+    both_bits = np.where(kinds.values == 'removed/added', (1 << len(fields)) - 1,
+                         old_bits[both_old] | new[CHANGED_FIELD].values[both_new])
+    both_bits = np.where(outcome == 'added', (1 << len(fields)) - 1, np.where(outcome == 'removed', 0, both_bits))
+    present = pd.notna(outcome)
+
+    columns = {key: pd.concat([old[key].iloc[only_old], new[key].iloc[only_new], new[key].iloc[both_new[present]]], ignore_index=True)}
+    columns[CHANGE_FIELD] = np.concatenate([old[CHANGE_FIELD].values[only_old], new[CHANGE_FIELD].values[only_new], outcome[present]]).astype(object)
+    columns[CHANGED_FIELD] = np.concatenate([old_bits[only_old], new[CHANGED_FIELD].values[only_new], both_bits[present]]).astype(np.int64)
+    for bit, field in enumerate(fields):
+        if field == key:
+            continue
+        # (where both deltas give the field, the second's value is the one C has)
+        use_second = (new[CHANGED_FIELD].values[both_new[present]] >> bit & 1) == 1
+        both = new[field].iloc[both_new[present]].astype(object).reset_index(drop=True)
+        both = both.where(use_second, old[field].iloc[both_old[present]].astype(object).reset_index(drop=True))
+        both[outcome[present] == 'removed'] = None
+        columns[field] = _restored(pd.concat([old[field].iloc[only_old].astype(object), new[field].iloc[only_new].astype(object),
+                                              both], ignore_index=True), new[field].dtype)
+    changes = pd.DataFrame(columns, columns=[key, CHANGE_FIELD, CHANGED_FIELD] + [field for field in fields if field != key])
+
+    return {
+        'key': key,
+        'fields': fields,
+        'dtypes': second['dtypes'],
+        'kept_fields': [field for field in second['kept_fields'] if field in first['kept_fields']],
+        'base_fields': first['base_fields'],
+        'base_rows': first['base_rows'],
+        'rows': second['rows'],
+        'base_fingerprint': first['base_fingerprint'],
+        'fingerprint': second['fingerprint'],
+        'changes': changes
+    }
+
+
+def _delta_paths(stem):
+    return stem + '.feather', stem + '.json'
+
+
+def write_delta(stem, delta):
+    ''' Function that writes a delta (see make_delta()) as <stem>.feather (its changed records) and <stem>.json (the rest) '''
+    if pyarrow is None:
+        raise ImportError("Writing a delta requires pyarrow")
+    table_path, meta_path = _delta_paths(stem)
+    changes = delta['changes'].reset_index(drop=True)
+    _write_atomically(table_path, lambda path: changes.to_feather(path, compression='uncompressed'))
+    meta = dict((name, value) for name, value in delta.items() if name != 'changes')
+    with open(meta_path, 'w', encoding='utf-8') as meta_file:
+        json.dump(meta, meta_file, ensure_ascii=False, indent=1)
+
+
+def read_delta(stem):
+    ''' Function that reads a delta written by write_delta() '''
+    if pyarrow is None:
+        raise ImportError("Reading a delta requires pyarrow")
+    table_path, meta_path = _delta_paths(stem)
+    with open(meta_path, 'r', encoding='utf-8') as meta_file:
+        delta = json.load(meta_file)
+    delta['changes'] = pyarrow.feather.read_table(table_path).to_pandas()
+    return delta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Makes, applies and chains deltas between releases of a CHGIS table.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    make = commands.add_parser('make', help="writes the delta from an old release (.csv) to a new one")
+    make.add_argument('old')
+    make.add_argument('new')
+    make.add_argument('delta', help="path of the delta, without extension")
+    make.add_argument('--key', default='sys_id')
+    apply = commands.add_parser('apply', help="rebuilds the new release (.csv) from the old one and a delta")
+    apply.add_argument('old')
+    apply.add_argument('delta')
+    apply.add_argument('output')
+    compose = commands.add_parser('compose', help="chains the deltas from A to B and from B to C into one from A to C")
+    compose.add_argument('first')
+    compose.add_argument('second')
+    compose.add_argument('delta')
+    arguments = parser.parse_args()
+
+    if arguments.command == 'make':
+        delta = make_delta(read_table(arguments.old)[0], read_table(arguments.new)[0], arguments.key)
+        write_delta(arguments.delta, delta)
+    elif arguments.command == 'apply':
+        delta = read_delta(arguments.delta)
+        apply_delta(read_table(arguments.old)[0], delta).to_csv(arguments.output, index=False)
+    else:
+        delta = compose_delta(read_delta(arguments.first), read_delta(arguments.second))
+        write_delta(arguments.delta, delta)
+    print("%(added)s records added, %(removed)s removed and %(modified)s modified." % summary(delta))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,14 +15,21 @@
 # Columns containing Boolean values are appended to the end of rows, indicating whether fields are duplicates or not
 # There are several "meta" columns at the end, marking out rows that may be of interest
 # Note that while there are several rows where all relevant data save for 'sys_id' match, there do not appear to be any where only the 'sys_id' matches
-# The script has not been fully refactored, and can yet be optimized; however, it should still run relatively quickly.
+# The checks are made in a single pass over both versions (see version_compare.py), which keeps the rows in their original order
 # Three .csv files are output -- one containing the entirety of both v5 and v6 together, one containing just v5 rows, and one containing just v6 rows
+# Optionally, a fourth is output: the keyed change-set from v5 to v6, pairing each v5 record with its v6 counterpart by 'sys_id' (or the
+# 'orig_id' / 'mdb_id' crosswalks) and listing the added, removed and modified records, with the fields changed in each (see version_compare.py)
+# With it comes the delta from v5 to v6 (V5_to_V6.feather and V5_to_V6.json), from which v6 can be rebuilt out of v5 and which can be chained
+# with the deltas of later releases (see version_delta.py)
 
 import pandas as pd
-from pandas import Series, DataFrame
-import numpy as np
 import os, os.path
 
+from target_cache import cached_frame
+from chgis_schema import read_table
+from version_compare import compare_versions, diff_versions
+from version_delta import make_delta, write_delta
+
 # suppressing SettingWithCopyWarning
 pd.options.mode.chained_assignment = None  # default='warn'
 
@@ -33,7 +40,8 @@ pd.options.mode.chained_assignment = None  # default='warn'
 def csv_picker():
     ''' Function for checking whether user input path 1) is that of a valid file, and 2) is of a file ending with '.csv'
         Prompts for re-entry if entry is invalid.
-        Returns a pandas DataFrame constructed from the valid .csv file
+        Returns a pandas DataFrame constructed from the valid .csv file, with the compact dtypes planned for its columns in chgis_schema.py
+        (reloaded from a binary cache if the file has been read before and is unchanged)
     '''
     path_name = input()
 
@@ -51,7 +59,8 @@ def csv_picker():
     
     # storing only the file's basename, for use in user prompts
     name = os.path.basename(path_name)
-    return pd.read_csv(path_name, low_memory=False), name
+    frame, _ = cached_frame(path_name, 'version_merge_compact', lambda: (read_table(path_name)[0], {}))
+    return frame, name
 
 
 # In[3]:
@@ -70,6 +79,15 @@ v6['version'] = 6
 
 # In[4]:
 
+print("Would you also like the keyed change-set from v5 to v6 (the added, removed and modified records, paired by 'sys_id')? (y/n)\n")
+choice = input().strip().lower()
+
+while choice not in ('y', 'yes', 'n', 'no'):
+    print("Invalid response.  Please try again:\n")
+    choice = input().strip().lower()
+
+keyed_diff = choice in ('y', 'yes')
+
 print("Proceeding with merge and check of %s and %s" % (v5_name, v6_name))
 # merge v5 and v6 into a single DataFrame
 df = pd.concat([v5,v6])
@@ -77,103 +95,26 @@ df = pd.concat([v5,v6])
 
 # In[5]:
 
-# check merged df for duplicates by sys_id, generate file with tagging
-mask_duplicates = df.duplicated(subset='sys_id', keep=False)
-mask_uniques = ~mask_duplicates
-duplicates = df[mask_duplicates]
-duplicates['sys_id_duplicate'] = True
-uniques = df[mask_uniques]
-uniques['sys_id_duplicate'] = False
-df_two = pd.concat([duplicates, uniques])
-df_two.to_csv('output/v5_and_v5_duplicates_and_uniques.csv')
+# checking the merged df for duplicates by sys_id, and field-by-field per 'Match_fields_from_V6_to_V5.csv' (see version_compare.py),
+# appending a Boolean flag for each, and the 'exact_match', 'content_only' and 'id_only' columns for ease of filtering
+df_final = compare_versions(df)
 
-### following lines would output .csv's containing only the duplicates and uniques
-#duplicates.to_csv('output/v5_and_v6_primary_duplicates.csv')
-#uniques.to_csv('v5_and_v6_uniques.csv')
+# generating file with tagging by sys_id
+df_final[list(df.columns) + ['sys_id_duplicate']].to_csv('output/v5_and_v5_duplicates_and_uniques.csv')
 
 
 # In[6]:
 
-# function for adding Boolean flags as fields to the DataFrame file
-def field_matcher(frame, v6_field, v5_field, new_field):
-    '''Simple function for comparing the specified fields from versions 5 and 6 of the CHGIS within the specified composite frame, outputting the Boolean result to a new field.  
-    Assumes that the CHGIS versions' tables which have been concatenated into the frame are already internally unique, i.e. that any matches found will be between versions, not within.  
-    Rather than iterate over rows, creates a Series of Boolean values which serves as a sort of mask for filtering out rows with duplicate and unique values in the specified fields. -- SF, 160817'''
-    mask_duplicates = frame.duplicated(subset=[v6_field, v5_field], keep=False)
-    mask_uniques = ~mask_duplicates
-    duplicates = frame[mask_duplicates]
-    duplicates[new_field] = True
-    uniques = frame[mask_uniques]
-    uniques[new_field] = False
-    return pd.concat([duplicates, uniques])        
-
-
-# In[7]:
-
-# performing duplicate checks field-by-field per 'Match_fields_from_V6_to_V5.csv'
-df_three = field_matcher(df_two, 'nm_py', 'nm_py', 'nm_py_duplicate')
-df_four = field_matcher(df_three, 'nm_simp', 'nm_simp', 'nm_simp_duplicate')
-df_five = field_matcher(df_four, 'nm_trad', 'nm_trad', 'nm_trad_duplicate')
-
-# trying to workaround failure to recognize matches
-df_five['x_coord'] = df_five['x_coord'].astype(str)
-df_five['y_coord'] = df_five['y_coord'].astype(str)
-df_six = field_matcher(df_five, 'x_coord', 'x_coord', 'x_coord_duplicate')
-df_seven = field_matcher(df_six, 'y_coord', 'y_coord', 'y_coord_duplicate')
-df_seven['x_coord'] = df_seven['x_coord'].astype(float)
-df_seven['y_coord'] = df_seven['y_coord'].astype(float)
-
-# resuming secondary checks
-df_eight = field_matcher(df_seven, 'pres_loc', 'pres_loc', 'pres_loc_duplicate')
-df_nine = field_matcher(df_eight, 'type_py', 'type_py', 'type_py_duplicate')
-df_ten = field_matcher(df_nine, 'type_simp', 'type_ch', 'type_simp/ch_duplicate')
-df_eleven = field_matcher(df_ten, 'beg_yr', 'beg', 'beg_yr_duplicate')
-df_twelve = field_matcher(df_eleven, 'end_yr', 'end', 'end_yr_duplicate')
-df_thirteen = field_matcher(df_twelve, 'obj_type', 'obj_type', 'obj_type_duplicate')
-df_thirteen['exact_match'] = df_thirteen.all(axis=1, bool_only=True)
-
-
-# In[8]:
-
-### creating new columns for ease of filtering
-
-# NOTE that this can probably be refactored to use a slice of df_thirteen columns; 
-# I was having problems slicing it right, however, so I used this less elegant approach, explicitly checking each field's value
-# The script runs sufficiently quickly as-is, however
-
-# Note that numpy.where() is used here, and NOT pandas.where() 
-
-## if 'sys_id_duplicate' == False, but the other duplicate fields == True, then 'content_only' = True
-df_thirteen['content_only'] = np.where(
-    ((df_thirteen['sys_id_duplicate'] == False) &
-    ((df_thirteen['nm_py_duplicate'] == True) & 
-    (df_thirteen['nm_simp_duplicate'] == True) & 
-    (df_thirteen['nm_trad_duplicate'] == True) &
-    (df_thirteen['x_coord_duplicate'] == True) &
-    (df_thirteen['y_coord_duplicate'] == True) &
-    (df_thirteen['pres_loc_duplicate'] == True) &
-    (df_thirteen['type_py_duplicate'] == True) &
-    (df_thirteen['type_simp/ch_duplicate'] == True) &
-    (df_thirteen['beg_yr_duplicate'] == True) &
-    (df_thirteen['end_yr_duplicate'] == True) &
-    (df_thirteen['obj_type_duplicate'] == True))), 'True', 'False') 
-
-## if 'sys_id'duplicate' == True, but the other duplicate fields == False, then 'id_only' = True
-df_thirteen['id_only'] = np.where(
-    ((df_thirteen['sys_id_duplicate'] == True) & 
-    ((df_thirteen['nm_py_duplicate'] == False) & 
-    (df_thirteen['nm_simp_duplicate'] == False) & 
-    (df_thirteen['nm_trad_duplicate'] == False) &
-    (df_thirteen['x_coord_duplicate'] == False) &
-    (df_thirteen['y_coord_duplicate'] == False) &
-    (df_thirteen['pres_loc_duplicate'] == False) &
-    (df_thirteen['type_py_duplicate'] == False) &
-    (df_thirteen['type_simp/ch_duplicate'] == False) &
-    (df_thirteen['beg_yr_duplicate'] == False) &
-    (df_thirteen['end_yr_duplicate'] == False) &
-    (df_thirteen['obj_type_duplicate'] == False))), 'True', 'False') 
-
-df_final = df_thirteen
+# pairing v5 and v6 records by key, and listing those added, removed or modified (with the fields changed), if asked for
+if keyed_diff:
+    changes = diff_versions(v5.drop(columns='version'), v6.drop(columns='version'))
+    print("%s records modified, %s removed and %s added from v5 to v6." % tuple(
+        (changes['change'] == change).sum() for change in ['modified', 'removed', 'added']))
+    try:
+        delta = make_delta(v5.drop(columns='version'), v6.drop(columns='version'))
+    except ValueError as error:
+        print("No delta from v5 to v6 can be made (%s)." % error)
+        delta = None
 
 
 # In[9]:
@@ -200,3 +141,12 @@ v6_mask = df_final['version'] == 6
 v6_final = df_final[v6_mask]
 v6_final.to_csv('V6_output.csv')
 
+# outputting the keyed change-set from v5 to v6
+if keyed_diff:
+    changes.to_csv('V5_to_V6_changes.csv', index=False)
+    if delta is not None:
+        try:
+            write_delta('V5_to_V6', delta)
+        except ImportError as error:
+            print("The delta from v5 to v6 could not be written (%s)." % error)
+
@@ -0,0 +1,121 @@
+# coding: utf-8
+
+#! /usr/bin/python3
+#
+# /py_scripts/year_overlap.py
+#
+# Helper module for geoname_match: handling of the beginning/ending years of incoming and target rows.
+# The target's years are parsed once into numeric arrays, so that whether two lifespans overlap can be checked on
+# candidate pairs of row positions (see match_index.py) before the pairs are turned into full rows.
+# Only non-core libraries used are pandas and numpy
+
+import pandas as pd
+import numpy as np
+
+
+def to_years(values):
+    ''' Function that converts a column of years (including nullable integers) to a float64 numpy array, with
+        non-numeric and missing values as NaN
+    '''
+    return pd.to_numeric(pd.Series(values), errors='coerce').astype(float).values
+
+
+class YearFilter(object):
+    ''' The lifespans (beginning and ending years) of the TARGET rows, as arrays by row position, for filtering the
+        candidate pairs found by the name join: pairs whose lifespans neither overlap nor come within 'tolerance' years
+        of one another (e.g. 1 for 'adjacent' spans such as 220-265 and 266-316) are dropped before being merged.
+        It looks the years of each pair up by position rather than searching the spans, so it doesn't find pairs itself.
+        Rows with a missing or non-numeric year on either side are never dropped, since they can't be ruled out.
+    '''
+
+    def __init__(self, beg, end):
+        self.beg = to_years(beg)
+        self.end = to_years(end)
+
+    def __len__(self):
+        return len(self.beg)
+
+    def overlaps(self, target_pos, beg, end, tolerance=0):
+        ''' Function that returns a Boolean numpy array indicating, for each target row position in 'target_pos',
+            whether its lifespan overlaps the corresponding span from 'beg' and 'end' (widened by 'tolerance' years).
+        '''
+        target_pos = np.asarray(target_pos, dtype=np.int64)
+        beg = to_years(beg)
+        end = to_years(end)
+        target_beg = self.beg[target_pos]
+        target_end = self.end[target_pos]
+
+        unknown = np.isnan(beg) | np.isnan(end) | np.isnan(target_beg) | np.isnan(target_end)
+        with np.errstate(invalid='ignore'):
+            overlapping = (target_beg <= end + tolerance) & (target_end >= beg - tolerance)
+        return overlapping | unknown
+
+    def block(self, pairs, incoming_beg, incoming_end, tolerance=0):
+        ''' Function that filters a DataFrame of candidate pairs (with 'target_pos' and 'incoming_pos' fields) down to
+            the pairs whose lifespans overlap, given the incoming rows' beginning and ending years.
+        '''
+        incoming_beg = to_years(incoming_beg)
+        incoming_end = to_years(incoming_end)
+        incoming_pos = pairs['incoming_pos'].values
+        mask = self.overlaps(pairs['target_pos'].values, incoming_beg[incoming_pos], incoming_end[incoming_pos], tolerance)
+        return pairs[mask].reset_index(drop=True)
+
+
+# categories of relationship between an incoming and a target lifespan, in the order of precedence in which they are
+# assigned: where more than one applies (e.g. zero years in a perfect match), the later one wins
+YEAR_OVERLAP_CATEGORIES = [
+    '',
+    'adjacent',
+    'partial_incl_start_of_target',
+    'partial_incl_end_of_target',
+    'incoming_nested_in_target',
+    'target_nested_in_incoming',
+    'perfect_match',
+    'CAUTION__ZEROES',
+    'ERROR__END_BEFORE_BEG',
+    'ERROR__NON_NUMERIC_YEAR_VALUE'
+]
+
+
+def classify_year_overlap(incoming_beg, incoming_end, target_beg, target_end, found=None):
+    ''' Function that classifies the relationship between incoming and target lifespans, pair by pair, returning a
+        categorical Series with the values in YEAR_OVERLAP_CATEGORIES ('' where none applies).
+        Each comparison of the four year columns is computed only once, and the categories are then picked by precedence
+        in a single pass.  Non-numeric years are only flagged where 'found' (a Boolean array marking the pairs actually
+        matched, e.g. match == 'found') is True; if 'found' is not given, they are flagged everywhere.
+    '''
+    index = incoming_beg.index if isinstance(incoming_beg, pd.Series) else None
+    in_beg, in_end, tg_beg, tg_end = [to_years(values) for values in (incoming_beg, incoming_end, target_beg, target_end)]
+
+    with np.errstate(invalid='ignore'):
+        beg_equal = in_beg == tg_beg
+        end_equal = in_end == tg_end
+        beg_before = in_beg < tg_beg
+        end_before = in_end < tg_end
+        beg_after = in_beg > tg_beg
+        end_after = in_end > tg_end
+        ends_after_target_begins = in_end >= tg_beg
+        begins_before_target_ends = in_beg <= tg_end
+
+        adjacent = (in_beg == tg_end + 1) | (in_end == tg_beg - 1)
+        zeroes = (in_beg == 0) | (in_end == 0) | (tg_beg == 0) | (tg_end == 0)
+        end_before_beg = (in_beg > in_end) | (tg_beg > tg_end)
+
+    non_numeric = np.isnan(in_beg) | np.isnan(in_end) | np.isnan(tg_beg) | np.isnan(tg_end)
+    if found is not None:
+        non_numeric &= np.asarray(found, dtype=bool)
+
+    # highest precedence first, i.e. the reverse of YEAR_OVERLAP_CATEGORIES
+    conditions = [
+        non_numeric,
+        end_before_beg,
+        zeroes,
+        beg_equal & end_equal,
+        ((beg_before | beg_equal) & end_after) | (beg_before & (end_after | end_equal)),
+        ((beg_after | beg_equal) & end_before) | (beg_after & (end_before | end_equal)),
+        beg_after & begins_before_target_ends & (end_after | end_equal),
+        (beg_before | beg_equal) & ends_after_target_begins & end_before,
+        adjacent
+    ]
+    codes = np.select(conditions, list(range(len(YEAR_OVERLAP_CATEGORIES) - 1, 0, -1)), default=0)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=YEAR_OVERLAP_CATEGORIES), index=index)